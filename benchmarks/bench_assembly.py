@@ -0,0 +1,52 @@
+"""
+Compare the assembly of a map from many organisms with the former approach: parse every .conf file completely
+and merge the shapes by raw position.
+
+Usage: KEGG_MAP_WIZARD_DATA=/tmp python benchmarks/bench_assembly.py
+"""
+import os
+import sys
+from timeit import timeit
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [ROOT, os.path.join(ROOT, 'tests')]
+from kegg_fixture import fake_data_dir  # noqa: E402
+from kegg_map_wizard.kegg_conf import ShapeAssembly, parse_conf, read_conf_columns  # noqa: E402
+from kegg_map_wizard.kegg_download import map_conf_path  # noqa: E402
+
+N_SHAPES = 8000  # about as many as map01100 has
+N_ORGS = 32  # the .conf files of the fixture are reused
+REPEAT = 5
+
+
+def per_org(paths: [str]) -> int:
+    shapes = {}
+    for path in paths:
+        table = parse_conf(path)
+        for shape in table.iter_shapes([[('key', path)]] * len(table.urls)):
+            if shape.raw_position in shapes:
+                shapes[shape.raw_position].merge(shape)
+            else:
+                shapes[shape.raw_position] = shape
+    return len(shapes)
+
+
+def assembled(paths: [str]) -> int:
+    assembly = ShapeAssembly()
+    for path in paths:
+        columns = read_conf_columns(path)
+        assembly.add(columns, [[('key', path)]] * len(columns.urls))
+    return len(list(assembly.iter_shapes()))
+
+
+if __name__ == '__main__':
+    with fake_data_dir(n_shapes=N_SHAPES):
+        orgs = ['ko', 'rn', 'ec', 'eco']
+        paths = [map_conf_path(orgs[i % len(orgs)], '01100') for i in range(N_ORGS)]
+        assert per_org(paths) == assembled(paths)
+        print(f'{N_ORGS} .conf files with {N_SHAPES} shapes each')
+
+        before = timeit(lambda: per_org(paths), number=REPEAT) / REPEAT
+        after = timeit(lambda: assembled(paths), number=REPEAT) / REPEAT
+        print(f'parse every file and merge: {before * 1e3:7.1f} ms')
+        print(f'assembly:                   {after * 1e3:7.1f} ms ({before / after:.1f}x)')
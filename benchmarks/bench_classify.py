@@ -0,0 +1,69 @@
+"""
+Compare the prefix-dispatch annotation classifier with the linear regex scan over ANNOTATION_SETTINGS,
+on all tokens of a synthetic catalogue.
+
+Usage: python benchmarks/bench_classify.py
+"""
+import os
+import sys
+from random import Random
+from timeit import timeit
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [ROOT, os.path.join(ROOT, 'tests')]
+from test_kegg_annotation import parse_query_reference  # noqa: E402
+from kegg_map_wizard.KeggAnnotation import KeggAnnotation, AnnotationClassifier, InvalidAnnotationException  # noqa: E402
+
+N = 20000  # distinct identifiers per type
+OCCURRENCES = 5  # every token appears in about this many urls
+REPEAT = 3
+
+
+def catalogue(org: str) -> [str]:
+    tokens = [
+        *(f'K{i:05d}' for i in range(N)),
+        *(f'R{i:05d}' for i in range(N)),
+        *(f'RC{i:05d}' for i in range(N // 10)),
+        *(f'C{i:05d}' for i in range(N)),
+        *(f'G{i:05d}' for i in range(N // 10)),
+        *(f'D{i:05d}' for i in range(N // 2)),
+        *(f'DG{i:05d}' for i in range(N // 10)),
+        *(f'{i // 1000 % 7 + 1}.{i // 100 % 10}.{i // 10 % 10}.{i % 10}' for i in range(N)),
+        *(f'{org}:{i}' for i in range(N)),
+        *(f'map{i:05d}' for i in range(500)),
+        *(f'br:{i:05d}' for i in range(50)),
+        'dr:D00001', 'htext=br08003', 'map4670', 'invalid',
+    ]
+    tokens *= OCCURRENCES
+    Random(0).shuffle(tokens)
+    return tokens
+
+
+def classify_all(classify, tokens: [str]) -> int:
+    n_invalid = 0
+    for token in tokens:
+        try:
+            classify(token)
+        except InvalidAnnotationException:
+            n_invalid += 1
+    return n_invalid
+
+
+if __name__ == '__main__':
+    org = 'hsa'
+    re_org_anno = KeggAnnotation.org_pattern(org)
+    tokens = catalogue(org)
+    print(f'{len(tokens)} tokens, {len(set(tokens))} distinct')
+
+    linear = timeit(lambda: classify_all(lambda t: parse_query_reference(t, re_org_anno, org), tokens), number=REPEAT)
+    cold = timeit(lambda: classify_all(AnnotationClassifier(org, re_org_anno).classify, tokens), number=REPEAT)
+    unique = list(dict.fromkeys(tokens))
+    dispatch = timeit(lambda: classify_all(AnnotationClassifier(org, re_org_anno).classify, unique), number=REPEAT)
+    classifier = AnnotationClassifier(org, re_org_anno)
+    classify_all(classifier.classify, tokens)
+    warm = timeit(lambda: classify_all(classifier.classify, tokens), number=REPEAT)
+
+    print(f'linear regex scan:        {linear / REPEAT * 1e3:7.1f} ms')
+    print(f'dispatch, distinct only:  {dispatch / REPEAT * 1e3:7.1f} ms')
+    print(f'dispatch + memo, cold:    {cold / REPEAT * 1e3:7.1f} ms ({linear / cold:.1f}x)')
+    print(f'dispatch + memo, warm:    {warm / REPEAT * 1e3:7.1f} ms ({linear / warm:.1f}x)')
@@ -0,0 +1,40 @@
+"""
+Compare the columnar .conf parser with the per-line parser on a large map.
+
+Usage: KEGG_MAP_WIZARD_DATA=/tmp python benchmarks/bench_conf.py
+"""
+import os
+import sys
+from timeit import timeit
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [ROOT, os.path.join(ROOT, 'tests')]
+from kegg_fixture import fake_data_dir  # noqa: E402
+from kegg_map_wizard.KeggShape import KeggShape  # noqa: E402
+from kegg_map_wizard.kegg_conf import parse_conf  # noqa: E402
+from kegg_map_wizard.kegg_download import map_conf_path  # noqa: E402
+
+N_SHAPES = 8000  # about as many as map01100 has
+REPEAT = 20
+
+
+def parse_lines(path: str) -> [KeggShape]:
+    with open(path) as f:
+        return [
+            KeggShape.create_shape(raw_position, description, annotations={})
+            for raw_position, url, description in (line.rstrip().split('\t') for line in f)
+        ]
+
+
+if __name__ == '__main__':
+    with fake_data_dir(orgs=('ko',), n_shapes=N_SHAPES):
+        path = map_conf_path('ko', '01100')
+        table = parse_conf(path)
+        print(f'{path}: {len(table)} shapes, {len(table.urls)} unique urls')
+
+        per_line = timeit(lambda: parse_lines(path), number=REPEAT) / REPEAT
+        columnar = timeit(lambda: parse_conf(path), number=REPEAT) / REPEAT
+        materialized = timeit(lambda: list(table.iter_shapes([{}] * len(table.urls))), number=REPEAT) / REPEAT
+        print(f'per-line parser:  {per_line * 1e3:7.2f} ms')
+        print(f'columnar parser:  {columnar * 1e3:7.2f} ms ({per_line / columnar:.1f}x)')
+        print(f'materialize all:  {materialized * 1e3:7.2f} ms (only when KeggMap.shapes is accessed)')
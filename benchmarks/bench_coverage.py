@@ -0,0 +1,40 @@
+"""
+Benchmark genome x map coverage for thousands of genomes.
+
+Usage: KEGG_MAP_WIZARD_DATA=/tmp python benchmarks/bench_coverage.py
+"""
+import os
+import sys
+import time
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [ROOT, os.path.join(ROOT, 'tests')]
+from kegg_fixture import fake_data_dir  # noqa: E402
+from kegg_map_wizard.KeggMapWizard import KeggMapWizard  # noqa: E402
+
+N_GENOMES = 5_000
+KOS_PER_GENOME = 2500
+N_KOS = 20_000
+
+
+def random_genomes(n: int) -> [(str, [str])]:
+    rng = np.random.default_rng(0)
+    kos = [f'K{i:05d}' for i in range(N_KOS)]
+    return [(f'genome{g}', [kos[i] for i in rng.choice(N_KOS, size=KOS_PER_GENOME, replace=False)]) for g in range(n)]
+
+
+if __name__ == '__main__':
+    with fake_data_dir(orgs=('ko',), n_shapes=5000):
+        start = time.perf_counter()
+        catalogue = KeggMapWizard(orgs=['ko']).coverage_catalogue()
+        print(f'{catalogue}: built in {time.perf_counter() - start:.2f} s')
+
+        genomes = random_genomes(N_GENOMES)
+        for workers in sorted({1, os.cpu_count()}):
+            start = time.perf_counter()
+            names, table = catalogue.coverage_table(genomes, chunk_size=1000, workers=workers)
+            seconds = time.perf_counter() - start
+            print(f'{workers=:>3}: {len(names)} genomes x {table.shape[1]} maps in {seconds:.2f} s '
+                  f'({len(names) / seconds:.0f} genomes/s)')
@@ -0,0 +1,28 @@
+"""
+Measure the check that create_map runs before building a map: the former download checks
+(download_configs: isfile per file, non-existent.json, listdir of maps_png, per organism) against
+a lookup in the availability index.
+
+Usage: KEGG_MAP_WIZARD_DATA=/tmp python benchmarks/bench_create_map.py
+"""
+import os
+import sys
+from timeit import timeit
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [ROOT, os.path.join(ROOT, 'tests')]
+from kegg_fixture import fake_data_dir, MAPS  # noqa: E402
+from kegg_map_wizard.KeggMapWizard import KeggMapWizard  # noqa: E402
+
+ORGS = ['ko', 'rn', 'ec', 'eco']
+REPEAT = 200
+
+if __name__ == '__main__':
+    with fake_data_dir(orgs=tuple(ORGS), n_shapes=100):
+        kmw = KeggMapWizard(orgs=ORGS)
+
+        checked = timeit(lambda: [kmw.download_configs(map_ids=[map_id]) for map_id in MAPS], number=REPEAT)
+        indexed = timeit(lambda: [kmw.availability.is_complete(map_id) for map_id in MAPS], number=REPEAT)
+        n = REPEAT * len(MAPS)
+        print(f'download checks:    {checked / n * 1e6:8.1f} µs per map')
+        print(f'availability index: {indexed / n * 1e6:8.1f} µs per map')
@@ -0,0 +1,60 @@
+"""
+Benchmark encode_png against the former pixel-by-pixel loop.
+
+Usage: KEGG_MAP_WIZARD_DATA=/tmp python benchmarks/bench_encode_png.py
+"""
+import os
+import sys
+import time
+from io import BytesIO
+from random import Random
+from tempfile import TemporaryDirectory
+
+from PIL import Image
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [ROOT, os.path.join(ROOT, 'tests')]
+from test_kegg_download import encode_png_reference  # noqa: E402
+from kegg_map_wizard.kegg_download import white_to_transparent  # noqa: E402
+
+# approximate dimensions of real KEGG map PNGs
+SIZES = {
+    '00010': (872, 1104),
+    '00400': (1163, 767),
+    '01100': (4316, 2672),
+}
+
+
+def synthetic_map(size: (int, int), seed: int) -> Image.Image:
+    rnd = Random(seed)
+    img = Image.new('RGB', size, (255, 255, 255))
+    for _ in range(size[0] * size[1] // 5000):
+        x, y = rnd.randrange(size[0] - 46), rnd.randrange(size[1] - 17)
+        img.paste((rnd.randrange(256), rnd.randrange(256), rnd.randrange(256)), (x, y, x + 46, y + 17))
+    return img.convert('P', palette=Image.ADAPTIVE)  # KEGG PNGs are palette images
+
+
+def vectorized(png_path: str) -> bytes:
+    with Image.open(png_path) as img:
+        img = white_to_transparent(img)
+    buffer = BytesIO()
+    img.save(buffer, 'PNG')
+    return buffer.getvalue()
+
+
+def timed(func, *args) -> (float, bytes):
+    start = time.perf_counter()
+    result = func(*args)
+    return time.perf_counter() - start, result
+
+
+if __name__ == '__main__':
+    with TemporaryDirectory() as tmp:
+        print(f'{"map":>6} {"pixels":>10} {"loop [s]":>9} {"numpy [s]":>9} {"speedup":>8}')
+        for i, (map_id, size) in enumerate(SIZES.items()):
+            png_path = f'{tmp}/{map_id}.png'
+            synthetic_map(size, seed=i).save(png_path)
+            t_loop, loop_png = timed(encode_png_reference, png_path)
+            t_numpy, numpy_png = timed(vectorized, png_path)
+            assert loop_png == numpy_png, f'output differs for {map_id}'
+            print(f'{map_id:>6} {size[0] * size[1]:>10} {t_loop:>9.3f} {t_numpy:>9.3f} {t_loop / t_numpy:>7.1f}x')
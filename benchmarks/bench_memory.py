@@ -0,0 +1,88 @@
+"""
+Measure the memory used by all maps of a KeggMapWizard, and by the same maps in the representation before
+__slots__ and shared annotations: shapes, bboxes and annotations with a __dict__, one annotation object per shape,
+formatted coordinates next to the points.
+
+Usage: KEGG_MAP_WIZARD_DATA=/tmp python benchmarks/bench_memory.py
+"""
+import os
+import sys
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [ROOT, os.path.join(ROOT, 'tests')]
+from kegg_fixture import fake_data_dir, MAPS  # noqa: E402
+from kegg_map_wizard.KeggMapWizard import KeggMapWizard  # noqa: E402
+
+ORGS = ['ko', 'rn', 'ec']
+N_SHAPES = 3000  # per map and organism
+
+
+class LegacyAnnotation:
+    def __init__(self, name: str, anno_type: str, html_class: str, description: str):
+        self.name = name
+        self.anno_type = anno_type
+        self.html_class = html_class
+        self.description = description
+
+
+class LegacyBBox:
+    def __init__(self, bbox):
+        self.x, self.y, self.width, self.height = bbox.x, bbox.y, bbox.width, bbox.height
+        self.x1, self.x2, self.y1, self.y2 = bbox.x1, bbox.x2, bbox.y1, bbox.y2
+
+
+class LegacyShape:
+    def __init__(self, shape):
+        self.type = shape.type
+        self.description = shape.description
+        self.raw_position = shape.raw_position
+        self.annotations = {
+            # every shape parsed its own annotations, the descriptions came from the shared DescriptionCache
+            (anno.anno_type, copy(anno.name)): LegacyAnnotation(copy(anno.name), anno.anno_type, anno.html_class, anno.description)
+            for anno in shape.annotations.values()
+        }
+        self.hash = str(hash(shape.raw_position))
+        self.coords = shape.coords
+        self.points = tuple(shape.points)
+        self.bbox = LegacyBBox(shape.bbox)
+
+
+def copy(text: str) -> str:
+    return text.encode('utf-8').decode('utf-8')  # a new string object, like splitting the .conf line
+
+
+def measure(build) -> (object, int):
+    tracemalloc.start()
+    result = build()
+    current = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return result, current
+
+
+def create_maps(kmw: KeggMapWizard) -> dict:
+    maps = {map_id: kmw.create_map(map_id, use_cache=False) for map_id in MAPS}
+    for map in maps.values():
+        map.shapes  # shapes are created on first access
+        map._png_sidecar = None  # the memory-mapped image is not part of the comparison
+    return maps
+
+
+if __name__ == '__main__':
+    with fake_data_dir(orgs=tuple(ORGS), n_shapes=N_SHAPES):
+        kmw = KeggMapWizard(orgs=ORGS)
+        kmw.create_maps(MAPS)  # warm up: download checks, rest data, caches
+
+        maps, current = measure(lambda: create_maps(kmw))
+        legacy, legacy_current = measure(lambda: {
+            map_id: {raw_position: LegacyShape(shape) for raw_position, shape in map.shapes.items()}
+            for map_id, map in maps.items()
+        })
+
+        n_shapes = sum(len(map.shapes) for map in maps.values())
+        n_annotations = sum(len(shape.annotations) for map in maps.values() for shape in map.shapes.values())
+        n_unique = len({id(anno) for map in maps.values() for shape in map.shapes.values() for anno in shape.annotations.values()})
+        n_legacy = sum(len(shape.annotations) for shapes in legacy.values() for shape in shapes.values())
+        print(f'{len(maps)} maps, {n_shapes} shapes, {n_annotations} annotation references')
+        print(f'before: {legacy_current / 1e6:5.1f} MB ({legacy_current / n_shapes:.0f} bytes per shape), {n_legacy} annotation objects')
+        print(f'now:    {current / 1e6:5.1f} MB ({current / n_shapes:.0f} bytes per shape), {n_unique} annotation objects')
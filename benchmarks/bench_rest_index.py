@@ -0,0 +1,77 @@
+"""
+Compare the single-file REST index with one cdb file per REST list: build, open, lookups, and search.
+
+Usage: KEGG_MAP_WIZARD_DATA=/tmp python benchmarks/bench_rest_index.py
+"""
+import os
+import sys
+import tracemalloc
+from random import Random
+from time import perf_counter
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [ROOT, os.path.join(ROOT, 'tests')]
+from kegg_fixture import fake_data_dir, build_cdb, open_cdb  # noqa: E402
+from kegg_map_wizard.kegg_download import get_description, rest_data_path  # noqa: E402
+from kegg_map_wizard.kegg_rest_index import RestIndex, build_rest_index, rest_list_files  # noqa: E402
+
+N = 200000  # lines per large REST list
+N_LOOKUPS = 100000
+WORDS = ['kinase', 'dehydrogenase', 'synthase', 'transporter', 'reductase', 'protein', 'subunit', 'hexokinase']
+
+
+def write_large_lists() -> [(str, str)]:
+    rnd = Random(0)
+    keys = []
+    for rest_file, prefix in [('ko', 'ko:K'), ('compound', 'cpd:C'), ('eco', 'eco:b'), ('rn', 'rn:R')]:
+        with open(rest_data_path(rest_file), 'w') as f:
+            for i in range(N):
+                words = ' '.join(rnd.choices(WORDS, k=3))
+                f.write(f'{prefix}{i:06d}\tgene{i}; {words} {i}\n')
+        keys.extend((rest_file, f'{prefix}{i:06d}') for i in range(N))
+    return rnd.sample(keys, N_LOOKUPS)
+
+
+def measure(func) -> (object, float):
+    start = perf_counter()
+    result = func()
+    return result, perf_counter() - start
+
+
+def peak_memory(func) -> int:
+    # tracemalloc slows everything down, so memory is measured in a separate run
+    tracemalloc.start()
+    func()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak
+
+
+if __name__ == '__main__':
+    with fake_data_dir():
+        lookups = write_large_lists()
+        files = rest_list_files()
+        print(f'{len(files)} REST lists, {sum(os.path.getsize(path) for path in files.values()) / 1e6:.0f} MB')
+
+        build_cdbs = lambda: [build_cdb(path) for path in files.values()]  # noqa: E731
+        for name, build in [('cdb files', build_cdbs), ('REST index', build_rest_index)]:
+            _, seconds = measure(build)
+            print(f'build {name + ":":13s}{seconds:6.2f} s, peak memory {peak_memory(build) / 1e6:6.1f} MB')
+
+        cdb_readers, seconds = measure(lambda: {rest_file: open_cdb(path) for rest_file, path in files.items()})
+        print(f'open cdb files:     {seconds * 1e3:6.2f} ms')
+        index, seconds = measure(RestIndex)
+        print(f'open REST index:    {seconds * 1e3:6.2f} ms')
+
+        _, seconds = measure(lambda: [get_description(cdb_readers[f], key) for f, key in lookups])
+        print(f'cdb lookups:        {seconds * 1e6 / N_LOOKUPS:6.2f} us/key')
+        _, seconds = measure(lambda: [index.get(f, key) for f, key in lookups])
+        print(f'index lookups:      {seconds * 1e6 / N_LOOKUPS:6.2f} us/key')
+        _, seconds = measure(lambda: index.get_many(lookups))
+        print(f'index batch lookup: {seconds * 1e6 / N_LOOKUPS:6.2f} us/key')
+        _, seconds = measure(lambda: list(index.prefix('ko', 'ko:K0012')))
+        print(f'prefix (1000 keys): {seconds * 1e3:6.2f} ms')
+
+        for query in ['hexokinase', 'kinase subunit', 'dehydro synth']:
+            results, seconds = measure(lambda: index.search(query, limit=50))
+            print(f'search {query!r}: {seconds * 1e3:6.2f} ms ({len(index.search(query))} matches)')
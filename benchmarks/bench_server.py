@@ -0,0 +1,118 @@
+"""
+Load test of the map service (kegg_server) against the synthetic data of the tests, without network access.
+
+Clients with keep-alive connections request random maps: plain, coloured (GET and POST), svgz, and revalidations
+with If-None-Match. Reports throughput, latencies and the share of responses that did not need rendering, compared with rebuilding the
+map for every request (create_map and svg, as before the service).
+
+Usage: python benchmarks/bench_server.py [workers]
+"""
+import os
+import sys
+import json
+import asyncio
+from random import Random
+from urllib.parse import quote
+from collections import Counter
+from time import perf_counter
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [ROOT, os.path.join(ROOT, 'tests')]
+from kegg_fixture import fake_data_dir, MAPS  # noqa: E402
+from kegg_map_wizard.KeggMapWizard import KeggMapWizard  # noqa: E402
+from kegg_map_wizard.kegg_server import MapServer  # noqa: E402
+
+ORG_STRINGS = ['ko+rn+ec', 'eco']
+N_CLIENTS = 32
+N_REQUESTS = 100  # per client
+N_SHAPES = 2000  # per map
+
+
+class Client:
+    """
+    HTTP/1.1 client with one keep-alive connection that remembers the ETags it has seen.
+    """
+
+    def __init__(self, port: int, seed: int):
+        self.port = port
+        self.rnd = Random(seed)
+        self.etags: {str: str} = {}
+        self.statuses = Counter()
+        self.latencies: [float] = []
+
+    def random_request(self) -> (str, str, bytes):
+        org_string, map_id = self.rnd.choice(ORG_STRINGS), self.rnd.choice(list(MAPS))
+        fmt = self.rnd.choice(['svg', 'svg', 'svgz'])
+        path = f'/map/{org_string}/{map_id}.{fmt}'
+        kind = self.rnd.random()
+        if kind < 0.3:
+            return 'GET', path, b''
+        annotations = [f'K{i:05d}' for i in self.rnd.sample(range(100), 5)]
+        coloring = json.dumps(dict(mode='binary', annotations=annotations, color=self.rnd.choice(['red', 'blue'])))
+        if kind < 0.7:
+            return 'GET', f'{path}?coloring={quote(coloring)}', b''
+        numbers = {annotation: self.rnd.random() for annotation in annotations}
+        return 'POST', path, json.dumps(dict(mode='continuous', annotation_to_number=numbers)).encode('utf-8')
+
+    async def run(self, n_requests: int) -> None:
+        reader, writer = await asyncio.open_connection('127.0.0.1', self.port)
+        history = []
+        for _ in range(n_requests):
+            if history and self.rnd.random() < 0.3:
+                method, target, body = self.rnd.choice(history)  # revalidate
+            else:
+                method, target, body = self.random_request()
+                history.append((method, target, body))
+            headers = f'Content-Length: {len(body)}\r\n'
+            if (method, target, body) in self.etags:
+                headers += f'If-None-Match: {self.etags[(method, target, body)]}\r\n'
+
+            start = perf_counter()
+            writer.write(f'{method} {target} HTTP/1.1\r\nHost: localhost\r\n{headers}\r\n'.encode('latin-1') + body)
+            head = (await reader.readuntil(b'\r\n\r\n')).decode('latin-1').split('\r\n')
+            response_headers = dict(line.split(': ', 1) for line in head[1:] if line)
+            await reader.readexactly(int(response_headers.get('Content-Length', 0)))
+            self.latencies.append(perf_counter() - start)
+
+            status = int(head[0].split(' ')[1])
+            self.statuses[status] += 1
+            if status == 200:
+                self.etags[(method, target, body)] = response_headers['ETag']
+        writer.close()
+
+
+def rebuild_per_request(n: int = 20) -> None:
+    wizard = KeggMapWizard(orgs=ORG_STRINGS[0].split('+'), offline=True)
+    start = perf_counter()
+    for i in range(n):
+        map = wizard.create_map(list(MAPS)[i % len(MAPS)])
+        map.svg(color_function=map.color_binary([f'K{i:05d}' for i in range(5)]).color_function)
+    print(f'rebuild per request: {(perf_counter() - start) / n * 1e3:.1f} ms per request')
+
+
+async def load_test(workers: int) -> None:
+    server = MapServer(ORG_STRINGS, workers=workers)
+    start = perf_counter()
+    _, port = await server.start(port=0)
+    print(f'{server}: started in {perf_counter() - start:.2f} s')
+
+    clients = [Client(port, seed) for seed in range(N_CLIENTS)]
+    start = perf_counter()
+    await asyncio.gather(*(client.run(N_REQUESTS) for client in clients))
+    seconds = perf_counter() - start
+    await server.close()
+
+    latencies = sorted(latency for client in clients for latency in client.latencies)
+    statuses = sum((client.statuses for client in clients), Counter())
+    percentile = lambda p: latencies[min(len(latencies) - 1, int(p * len(latencies)))] * 1e3  # noqa: E731
+    print(f'{len(latencies)} requests by {N_CLIENTS} clients in {seconds:.2f} s: {len(latencies) / seconds:.0f} requests/s')
+    print(f'latency: p50 {percentile(.5):.1f} ms, p95 {percentile(.95):.1f} ms, p99 {percentile(.99):.1f} ms')
+    print(f'status codes: {dict(sorted(statuses.items()))}, rendered: {server.n_rendered}, '
+          f'not modified: {server.n_not_modified}')
+
+
+if __name__ == '__main__':
+    with fake_data_dir(orgs=('ko', 'rn', 'ec', 'eco'), n_shapes=N_SHAPES):
+        rebuild_per_request()
+        for workers in [int(sys.argv[1])] if len(sys.argv) > 1 else [0, os.cpu_count()]:
+            asyncio.run(load_test(workers))
@@ -0,0 +1,61 @@
+"""
+Benchmark the SVG serializer and precompiled skeletons against the Jinja templates.
+
+Usage: KEGG_MAP_WIZARD_DATA=/tmp python benchmarks/bench_svg.py
+"""
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [ROOT, os.path.join(ROOT, 'tests')]
+from kegg_fixture import fake_data_dir  # noqa: E402
+from kegg_map_wizard.KeggMapWizard import KeggMapWizard  # noqa: E402
+from kegg_map_wizard.kegg_utils import MAP_TEMPLATE  # noqa: E402
+from kegg_map_wizard.kegg_svg import iter_map_svg  # noqa: E402
+
+# number of shapes per organism, 01100 has about 5000
+SHAPES = [500, 2000, 5000]
+REPEATS = 3
+
+
+def color_function(shape) -> str:
+    return 'red'
+
+
+def template(map) -> str:
+    return ''.join(MAP_TEMPLATE.generate(map=map, color_function=color_function, png_url='map.png'))
+
+
+def serializer(map) -> str:
+    return ''.join(iter_map_svg(map, color_function=color_function, png_url='map.png'))
+
+
+def skeleton(skeleton, fills) -> bytes:
+    return skeleton.render(fills)
+
+
+def best_of(func, *args) -> (float, str):
+    timings = []
+    for _ in range(REPEATS):
+        start = time.perf_counter()
+        result = func(*args)
+        timings.append(time.perf_counter() - start)
+    return min(timings), result
+
+
+if __name__ == '__main__':
+    print(f'{"shapes":>7} {"template [shapes/s]":>20} {"serializer [shapes/s]":>22} {"skeleton [shapes/s]":>20} '
+          f'{"skeleton [us/shape]":>20}')
+    for n_shapes in SHAPES:
+        with fake_data_dir(orgs=('ko', 'rn', 'ec'), n_shapes=n_shapes):
+            map = KeggMapWizard(orgs=['ko', 'rn', 'ec']).create_map('01100')
+            n = len(map.shapes)
+            t_template, expected = best_of(template, map)
+            t_serializer, svg = best_of(serializer, map)
+            compiled = map.compile(png_url='map.png')
+            fills = {shape.hash: color_function(shape) for shape in map.shapes.values()}
+            t_skeleton, svg_bytes = best_of(skeleton, compiled, fills)
+            assert svg == expected == svg_bytes.decode(), f'output differs for {n_shapes=}'
+            print(f'{n:>7} {n / t_template:>20.0f} {n / t_serializer:>22.0f} {n / t_skeleton:>20.0f} '
+                  f'{t_skeleton / n * 1e6:>20.3f}')
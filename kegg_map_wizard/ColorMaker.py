@@ -34,14 +34,11 @@ class ColorMaker:
         return 100 * i / n_colors
 
     @classmethod
-    def svg_gradient(cls, colors: [str], id: str, x1: int, x2: int) -> str:
+    def svg_stops(cls, colors: [str]) -> str:
         """
-        Returns a color gradient in SVG format.
+        Returns the stops of a color gradient in SVG format, see svg_gradient.
 
         :param colors: list of colors
-        :param id: desired id of the gradient
-        :param x1: start position of gradient
-        :param x2: end position of gradient
         :return: string in SVG format
         """
         stops = [
@@ -52,7 +49,20 @@ class ColorMaker:
             )
             for i in range(1, len(colors))]
 
-        return cls.GRADIENT_TEMPLATE.format(id=id, x1=x1, x2=x2, stops=''.join(stops))
+        return ''.join(stops)
+
+    @classmethod
+    def svg_gradient(cls, colors: [str], id: str, x1: int, x2: int) -> str:
+        """
+        Returns a color gradient in SVG format.
+
+        :param colors: list of colors
+        :param id: desired id of the gradient
+        :param x1: start position of gradient
+        :param x2: end position of gradient
+        :return: string in SVG format
+        """
+        return cls.GRADIENT_TEMPLATE.format(id=id, x1=x1, x2=x2, stops=cls.svg_stops(colors))
 
     @staticmethod
     def random_color():
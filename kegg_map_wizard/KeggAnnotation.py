@@ -1,5 +1,7 @@
+import re
 import logging
 from re import Pattern
+from typing import NamedTuple
 from urllib.parse import quote
 from kegg_map_wizard.kegg_download import get_description
 from kegg_map_wizard.kegg_utils import ANNOTATION_SETTINGS
@@ -9,7 +11,32 @@ class InvalidAnnotationException(Exception):
     pass
 
 
+class AnnotationQuery(NamedTuple):
+    """
+    Parsed annotation of a .conf file, everything but the description.
+    """
+    name: str
+    anno_type: str
+    html_class: str
+    rest_file: str  # where to look up the description
+    query: str  # key in rest_file
+
+    @property
+    def description_key(self) -> (str, str):
+        return self.rest_file, self.query
+
+    @property
+    def key(self) -> (str, str):
+        """
+        Key of the resulting KeggAnnotation in KeggShape.annotations: (anno_type, name)
+        """
+        return self.anno_type, f'EC:{self.name}' if self.anno_type == 'EC' else self.name
+
+
 class KeggAnnotation:
+    # instances are shared by all shapes of all maps of a KeggMapWizard, treat them as immutable
+    __slots__ = ('name', 'anno_type', 'html_class', 'description')
+
     def __init__(self, name: str, anno_type: str, html_class: str, description: str):
         if anno_type == 'EC':
             self.name = f'EC:{name}'
@@ -29,9 +56,44 @@ class KeggAnnotation:
             description=quote(self.description)
         )
 
+    @staticmethod
+    def org_pattern(org: str) -> Pattern:
+        """
+        :return: regex that matches the gene annotations of an organism, e.g. 'hsa:1234', 'bsu:BSU_00010'
+        """
+        return re.compile(r'^eco:b[0-9]+$') if org == 'eco' else re.compile(rf'^{org}:[A-Za-z0-9_.\-]+$')
+
     @classmethod
     def create_annos(cls, cdb_readers, url: str, re_org_anno: Pattern, org: str):  # -> {tuple[str, str]: KeggAnnotation}
+        return {
+            anno_query.key: cls.from_query(
+                anno_query, get_description(cdb_readers[anno_query.rest_file], query=anno_query.query)
+            )
+            for anno_query in cls.parse_url(url, re_org_anno, org)
+        }
+
+    @classmethod
+    def create_anno(cls, cdb_readers, anno_query: str, re_org_anno: Pattern, org: str):  # -> KeggAnnotation:
+        anno_query = cls.parse_query(anno_query, re_org_anno, org)
+        return cls.from_query(anno_query, get_description(cdb_readers[anno_query.rest_file], query=anno_query.query))
+
+    @classmethod
+    def from_query(cls, anno_query: AnnotationQuery, description: str):  # -> KeggAnnotation:
+        return cls(
+            name=anno_query.name,
+            anno_type=anno_query.anno_type,
+            html_class=anno_query.html_class,
+            description=description
+        )
+
+    @classmethod
+    def parse_url(cls, url: str, re_org_anno: Pattern, org: str) -> [AnnotationQuery]:
+        """
+        Parse the annotations-url (2nd column of .config files), skip invalid annotations.
 
+        :param url: e.g. '/dbget-bin/www_bget?K00716+K07633+K07634'
+        :returns: list of AnnotationQuery objects
+        """
         url_prefix, annotations_hyperlink = url.split('?', maxsplit=1)
 
         assert url_prefix in ['/dbget-bin/www_bget', '/kegg-bin/show_pathway', '/kegg-bin/search_htext'], \
@@ -44,19 +106,19 @@ class KeggAnnotation:
 
         anno_queries = annotations_hyperlink.split('+')
 
-        annos = {}
+        parsed = {}
         for anno_query in anno_queries:
             try:
-                anno = cls.create_anno(cdb_readers, anno_query, re_org_anno, org)
-                assert (anno.anno_type, anno.name) not in annos, 'error: duplicate annotations in shape'
-                annos[(anno.anno_type, anno.name)] = anno
+                anno_query = cls.parse_query(anno_query, re_org_anno, org)
+                assert anno_query.key not in parsed, 'error: duplicate annotations in shape'
+                parsed[anno_query.key] = anno_query
             except InvalidAnnotationException as e:
                 logging.warning(e)
 
-        return annos
+        return list(parsed.values())
 
     @classmethod
-    def create_anno(cls, cdb_readers, anno_query: str, re_org_anno: Pattern, org: str):  # -> KeggAnnotation:
+    def parse_query(cls, anno_query: str, re_org_anno: Pattern, org: str) -> AnnotationQuery:
         """
         Parse sometimes cryptic 2nd column of .config files
 
@@ -65,52 +127,123 @@ class KeggAnnotation:
           - 'htext=br08003' from '/kegg-bin/search_htext?htext=br08003'
 
         :param anno_query: part of a hyperlink
-        :returns: KeggAnnotation object
+        :returns: AnnotationQuery object
         """
+        return AnnotationClassifier.get(org, re_org_anno).classify(anno_query)
+
+
+class AnnotationClassifier:
+    """
+    Classify the tokens of annotations-urls by their leading characters and length instead of trying the patterns
+    of ANNOTATION_SETTINGS one by one. Results are memoized per token, so a catalogue costs one classification per
+    distinct annotation.
 
+    Organism annotations are recognized by their prefix ('{org}:') and then checked with re_org_anno.
+    """
+    _instances: {(str, Pattern): 'AnnotationClassifier'} = {}
+
+    def __init__(self, org: str, re_org_anno: Pattern):
+        self.org = org
+        self.org_prefix = f'{org}:'
+        self.re_org_anno = re_org_anno
+        self.cache: {str: AnnotationQuery} = {}  # token -> AnnotationQuery, None if invalid
+
+    def __repr__(self):
+        return f'<AnnotationClassifier: {self.org} ({len(self.cache)} tokens)>'
+
+    @classmethod
+    def get(cls, org: str, re_org_anno: Pattern):  # -> AnnotationClassifier
+        """
+        :return: the shared classifier of this organism
+        """
+        key = (org, re_org_anno)
+        if key not in cls._instances:
+            cls._instances[key] = cls(org, re_org_anno)
+        return cls._instances[key]
+
+    def classify(self, token: str) -> AnnotationQuery:
+        """
+        :param token: part of a hyperlink, e.g. 'K00716', 'hsa:1234' or 'htext=br08003'
+        :raises InvalidAnnotationException: if the token does not match any pattern
+        """
+        try:
+            anno_query = self.cache[token]
+        except KeyError:
+            anno_query = self.cache[token] = self._classify(token)
+        if anno_query is None:
+            raise InvalidAnnotationException(f'Annotation {token} does not match any pattern!')
+        return anno_query
+
+    def _classify(self, token: str) -> AnnotationQuery:
         # handle organism annotations
-        if re_org_anno.match(anno_query):
-            return cls(name=anno_query, anno_type=org, html_class='enzyme',
-                                  description=get_description(cdb_readers[org], query=anno_query))
+        if token.startswith(self.org_prefix) and self.re_org_anno.match(token):
+            return AnnotationQuery(name=token, anno_type=self.org, html_class='enzyme', rest_file=self.org, query=token)
 
         # handle most common cases
-        for anno_type, settings in ANNOTATION_SETTINGS.items():
-            if settings['pattern'].match(anno_query):
-                if anno_type == 'MAP':
-                    anno_query = anno_query[-5:]
-                query = f'{settings["descr_prefix"]}{anno_query}'
-                return cls(
-                    name=anno_query,
-                    anno_type=anno_type,
-                    html_class=settings['html_class'],
-                    description=get_description(cdb_readers[settings['rest_file']], query=query)
-                )
+        anno_type = _dispatch(token)
+        if anno_type is not None:
+            return _anno_query(anno_type, token[-5:] if anno_type == 'MAP' else token)
 
         # handle anomalies
-        if anno_query.startswith('dr:D'):
+        if token.startswith('dr:D'):
             # sometimes drugs contain the 'dr:' prefix
             anno_type = 'D'
-            name = anno_query.removeprefix('dr:')
-        elif anno_query.startswith('htext=br'):
+            name = token.removeprefix('dr:')
+        elif token.startswith('htext=br'):
             # strange br: 'htext=br08003&search_string=%22Acridone%20alkaloids%22&option=-n'
             anno_type = 'BR'
-            name = anno_query.removeprefix('htext=br').lstrip(':')
+            name = token.removeprefix('htext=br').lstrip(':')
             name = f'br:{name[:5]}'
-        elif anno_query == 'map4670':
+        elif token == 'map4670':
             # strange anomaly
             anno_type, name = 'MAP', 'map04670'
         else:
-            raise InvalidAnnotationException(f'Annotation {anno_query} does not match any pattern!')
-
-        settings = ANNOTATION_SETTINGS[anno_type]
-        assert settings['pattern'].match(name), f'annotation ({anno_type}) does not match pattern: {name}'
-        if anno_type == 'MAP':
-            name = name[-5:]
-        query = f'{settings["descr_prefix"]}{name}'
-
-        return cls(
-            name=name,
-            anno_type=anno_type,
-            html_class=settings['html_class'],
-            description=get_description(cdb_readers[settings['rest_file']], query=query)
-        )
+            return None
+
+        assert _dispatch(name) == anno_type, f'annotation ({anno_type}) does not match pattern: {name}'
+        return _anno_query(anno_type, name[-5:] if anno_type == 'MAP' else name)
+
+
+def _is_digits(string: str) -> bool:
+    # [0-9]+
+    return string.isascii() and string.isdigit()
+
+
+def _dispatch(token: str) -> str:
+    """
+    Mirrors the patterns of ANNOTATION_SETTINGS: the first one that matches the token wins.
+
+    :return: anno_type, None if no pattern matches
+    """
+    length, first = len(token), token[:1]
+    if length == 6 and first in ONE_LETTER_TYPES and _is_digits(token[1:]):  # K00001, R00001, C00001, G00001, D00001
+        return first
+    if length == 7 and token[:2] in TWO_LETTER_TYPES and _is_digits(token[2:]):  # RC00001, DG00001
+        return token[:2]
+    if _is_digits(first):  # EC: 1.1.1.1, 1.1.1.-
+        parts = token.split('.')
+        if parts[-1] == '-':
+            parts.pop()
+        return 'EC' if len(parts) >= 2 and all(_is_digits(part) for part in parts) else None
+    if length == 8 and token.startswith('br:') and _is_digits(token[3:]):  # br:08003
+        return 'BR'
+    if length in (7, 8) and _is_digits(token[-5:]):  # map00010, ko00010, eco00010
+        prefix = token[:-5]
+        if prefix.isascii() and prefix.isalpha() and prefix.islower():
+            return 'MAP'
+    return None
+
+
+def _anno_query(anno_type: str, name: str) -> AnnotationQuery:
+    settings = ANNOTATION_SETTINGS[anno_type]
+    return AnnotationQuery(
+        name=name,
+        anno_type=anno_type,
+        html_class=settings['html_class'],
+        rest_file=settings['rest_file'],
+        query=f'{settings["descr_prefix"]}{name}'
+    )
+
+
+ONE_LETTER_TYPES = {'K', 'R', 'C', 'G', 'D'}
+TWO_LETTER_TYPES = {'RC', 'DG'}
@@ -1,14 +1,18 @@
 import os
-import re
+import gzip
 import logging
 from tempfile import NamedTemporaryFile
-from typing import Callable
+from typing import Callable, Iterator, TextIO
 
 from kegg_map_wizard.KeggShape import KeggShape, Poly, Circle, Rect, Line
-from kegg_map_wizard.kegg_utils import MAP_TEMPLATE, load_png
-from kegg_map_wizard.kegg_download import encode_png
+from kegg_map_wizard.kegg_utils import load_template, PngSidecar, png_sidecar_path, migrate_png_json
+from kegg_map_wizard.kegg_download import encode_png, file_sha256, DescriptionCache
 from kegg_map_wizard.KeggAnnotation import KeggAnnotation
-from kegg_map_wizard.KeggShape import BBox
+from kegg_map_wizard.KeggShape import BBox, shape_id
+from kegg_map_wizard.kegg_bbox import bounding_boxes
+from kegg_map_wizard.kegg_conf import ShapeAssembly, read_conf_columns
+from kegg_map_wizard.kegg_svg import iter_map_svg, compile_map, SvgSkeleton
+from kegg_map_wizard.kegg_color import Incidence, Coloring, color_binary, color_continuous, color_organisms, color_groups
 from kegg_map_wizard.kegg_download import map_conf_path
 
 default_color_function = lambda shape: 'transparent'
@@ -20,17 +24,55 @@ class KeggMap:
         self.map_id = map_id
         self.title = title
         self.png_path = png_path
-        self.encoded_png_path = self.png_path + '.json'
-        self.shapes: {str: KeggShape} = {}  # raw position -> KeggShape
+        self.sidecar_path = png_sidecar_path(self.png_path)
+        self._shapes: {str: KeggShape} = {}  # raw position -> KeggShape
+        self._assembly: ShapeAssembly = None  # .conf files whose shapes are not materialized yet
+        self._shape_ids: {str} = set()  # shape.hash of all shapes, to detect collisions
+        self.bboxes_loaded = False
+        self._png_hash = None
+        self._incidence = None
 
-        for path in (self.png_path, self.encoded_png_path):
-            assert os.path.isfile(path), f'File does not exist: {path}'
+        assert os.path.isfile(self.png_path), f'File does not exist: {self.png_path}'
 
-        self.encoded_png, self.width, self.height = self._load_png()
+        self._png_sidecar = self._load_png()
+        self.width, self.height = self._png_sidecar.width, self._png_sidecar.height
 
     def __repr__(self):
         return f'<KeggMap: {self.org_string}{self.map_id} - {self.title}>'
 
+    def __getstate__(self):
+        self._materialize_shapes()
+        # do not pickle the memory-mapped image, it is reopened on demand
+        state = self.__dict__.copy()
+        state['_png_sidecar'] = None
+        state['_incidence'] = None
+        return state
+
+    @property
+    def shapes(self) -> {str: KeggShape}:
+        """
+        Dictionary: raw position -> KeggShape. The shapes are created on first access.
+        """
+        if self._assembly is not None:
+            self._materialize_shapes()
+        return self._shapes
+
+    @shapes.setter
+    def shapes(self, shapes: {str: KeggShape}) -> None:
+        self._assembly = None
+        self._shapes = shapes
+        self._shape_ids = {shape.hash for shape in shapes.values()}
+
+    @property
+    def png_sidecar(self) -> PngSidecar:
+        if self._png_sidecar is None:
+            self._png_sidecar = self._load_png()
+        return self._png_sidecar
+
+    @property
+    def encoded_png(self) -> str:
+        return self.png_sidecar.base64()
+
     @property
     def id(self):
         return f'kegg-{self.org_string}-{self.map_id}-png'  # {{ map.kegg_map_wizard.org }}-{{ map.map_id }}
@@ -42,57 +84,236 @@ class KeggMap:
     def color_function(self, shape: KeggShape):
         return 'transparent'
 
-    def svg(self, color_function: Callable = None, calculate_bboxes: bool = True) -> str:
+    def iter_encoded_png(self, chunk_size: int = 1 << 16) -> Iterator[str]:
+        """
+        Yield the base64-encoded PNG in chunks, encoded on the fly.
+        """
+        yield from self.png_sidecar.iter_base64(chunk_size=chunk_size)
+
+    @property
+    def png_hash(self) -> str:
+        """
+        Content hash of the background image, changes whenever KEGG updates the PNG.
+        """
+        if self._png_hash is None:
+            self._png_hash = file_sha256(self.png_path)[:16]
+        return self._png_hash
+
+    @property
+    def png_filename(self) -> str:
+        return f'{self.map_id}.{self.png_hash}.png'
+
+    def static_png_url(self, base_url: str) -> str:
+        """
+        :param base_url: URL or relative path of the directory created by export_png, e.g. '/static/kegg'
+        :return: URL of the background image
+        """
+        return f'{base_url.rstrip("/")}/{self.png_filename}'
+
+    def export_png(self, static_dir: str) -> str:
+        """
+        Write the transparent background image to static_dir. The file name contains the content hash, so the
+        file never changes and can be cached indefinitely.
+
+        :return: file name
+        """
+        out_path = f'{static_dir}/{self.png_filename}'
+        if not os.path.isfile(out_path):
+            tmp_path = f'{out_path}.{os.getpid()}.tmp'
+            with open(tmp_path, 'wb') as f:
+                f.write(self.png_sidecar.png)
+            os.replace(tmp_path, out_path)
+        return self.png_filename
+
+    def iter_svg(
+            self,
+            color_function: Callable = None,
+            calculate_bboxes: bool = True,
+            bbox_engine: str = 'analytic',
+            png_url: str = None
+    ) -> Iterator[str]:
+        """
+        Render the map piece by piece, without ever holding the whole document in memory.
+
+        :param png_url: URL or relative path of the background image, see static_png_url; if None: embed it as base64
+        :return: iterator over the parts of the SVG, ''.join(...) equals svg()
+        """
         if color_function is None:
             color_function = default_color_function
         if calculate_bboxes:
-            self._load_bounding_boxes()
+            self._load_bounding_boxes(engine=bbox_engine)
         try:
-            svg = MAP_TEMPLATE.render(map=self, color_function=color_function)
+            yield from iter_map_svg(self, color_function=color_function, png_url=png_url)
         except Exception as e:
             e.args = tuple([f'Failed to render map: {self}!\n{str(e)}'])
             raise e
-        return svg
 
-    def save_svg(self, out_path: str, color_function: Callable = None, calculate_bboxes: bool = True):
-        svg = self.svg(color_function=color_function, calculate_bboxes=calculate_bboxes)
+    def svg(self, color_function: Callable = None, calculate_bboxes: bool = True, bbox_engine: str = 'analytic', png_url: str = None) -> str:
+        return ''.join(self.iter_svg(color_function=color_function, calculate_bboxes=calculate_bboxes, bbox_engine=bbox_engine, png_url=png_url))
+
+    def write_svg(self, file: TextIO, color_function: Callable = None, calculate_bboxes: bool = True, bbox_engine: str = 'analytic', png_url: str = None):
+        """
+        Stream the SVG into a file-like object that accepts str.
+        """
+        for chunk in self.iter_svg(color_function=color_function, calculate_bboxes=calculate_bboxes, bbox_engine=bbox_engine, png_url=png_url):
+            file.write(chunk)
+
+    def save_svg(self, out_path: str, color_function: Callable = None, calculate_bboxes: bool = True, bbox_engine: str = 'analytic', png_url: str = None):
         with open(out_path, 'w') as out:
-            out.write(svg)
+            self.write_svg(out, color_function=color_function, calculate_bboxes=calculate_bboxes, bbox_engine=bbox_engine, png_url=png_url)
+
+    def save_svgz(self, out_path: str, color_function: Callable = None, calculate_bboxes: bool = True, bbox_engine: str = 'analytic', png_url: str = None):
+        with gzip.open(out_path, 'wt', 9, encoding='utf-8') as out:
+            self.write_svg(out, color_function=color_function, calculate_bboxes=calculate_bboxes, bbox_engine=bbox_engine, png_url=png_url)
+
+    def compile(self, png_url: str = None, default_fill: str = 'transparent', calculate_bboxes: bool = True,
+                bbox_engine: str = 'analytic') -> SvgSkeleton:
+        """
+        Precompile the parts of the SVG that do not depend on the colours: geometry, annotations and background.
+
+        Example: skeleton.render(fills={shape.hash: 'red' for shape in map.shapes.values()})
+
+        :param png_url: URL of the background image, see static_png_url; if None: embed it as base64
+        :param default_fill: colour of shapes that are not in the fills passed to skeleton.render
+        :return: immutable SvgSkeleton, can be pickled
+        """
+        if calculate_bboxes:
+            self._load_bounding_boxes(engine=bbox_engine)
+        return compile_map(self, png_url=png_url, default_fill=default_fill)
+
+    @property
+    def incidence(self) -> Incidence:
+        """
+        Sparse shape x annotation incidence matrix, used by the color_* methods.
+        """
+        if self._incidence is None:
+            self._incidence = Incidence(self.shapes.values())
+        return self._incidence
+
+    def color_binary(self, annotations: [str], color: str = 'red') -> Coloring:
+        """
+        Colour all shapes that have any of the annotations, like highlightBinary in PathwaySvgLib.js.
+
+        :param annotations: e.g. ['K00001', 'EC:1.1.1.1']
+        :return: Coloring, use it like this: map.compile().render(*coloring)
+        """
+        return color_binary(self.incidence, annotations, color=color)
+
+    def color_continuous(self, annotation_to_number: {str: float}, colors: [str] = ('yellow', 'red')) -> Coloring:
+        """
+        Colour shapes by numbers between 0 and 1, like highlightContinuous in PathwaySvgLib.js.
+
+        :param annotation_to_number: e.g. {'C00033': 0.24, 'C00031': 0.53}
+        :param colors: colours for 0 and 1
+        """
+        return color_continuous(self.incidence, annotation_to_number, colors=colors)
+
+    def color_organisms(self, organisms: {str: [str]}, colors: [str] = ('transparent', 'yellow', 'red', 'green')) -> Coloring:
+        """
+        Colour shapes by how many organisms have their annotations, like highlightOrganisms in PathwaySvgLib.js.
 
-    def save_svgz(self, out_path: str, color_function: Callable = None, calculate_bboxes: bool = True):
-        svg = self.svg(color_function=color_function, calculate_bboxes=calculate_bboxes)
-        import gzip
-        with gzip.open(out_path, 'w', 9) as f:
-            f.write(svg.encode('utf-8'))
+        :param organisms: e.g. {'Organism1': ['R09127', 'R01788'], 'Organism2': [...]}
+        :param colors: not covered, scale start, scale end, covered by all organisms
+        """
+        return color_organisms(self.incidence, organisms, colors=colors)
+
+    def color_groups(self, groups: {str: {str: [str]}}, colors: [str] = ('transparent', 'yellow', 'red', 'green'),
+                     bbox_engine: str = 'analytic') -> Coloring:
+        """
+        Colour shapes with one stripe per group of organisms, like highlightGroupsOfOrganisms in PathwaySvgLib.js.
+
+        :param groups: e.g. {'Group1': {'Organism1': ['R09127', 'R01788'], ...}, 'Group2': {...}}
+        :param colors: not covered, scale start, scale end, covered by all organisms of the group
+        """
+        self._load_bounding_boxes(engine=bbox_engine)
+        return color_groups(self.incidence, groups, colors=colors)
 
-    def add_shapes(self, cdb_readers, map_id: str, org: str) -> None:
+    def add_shapes(self, cdb_readers, map_id: str, org: str, description_cache: DescriptionCache = None,
+                   annotation_pool: {(str, str): KeggAnnotation} = None) -> None:
+        """
+        Add the shapes of a .conf file. The shape objects are only created when self.shapes is accessed.
+        The .conf files of all organisms go into one ShapeAssembly: only the geometry of raw positions that are new
+        to this map is parsed, the annotations are aligned by raw position. The descriptions of all new annotations
+        are resolved in one batch.
+
+        :param cdb_readers: dictionary: rest file -> cdb reader
+        :param description_cache: DescriptionCache shared between maps, a temporary one is used if None
+        :param annotation_pool: dictionary: (anno_type, name) -> KeggAnnotation, shared between maps so that
+            every annotation exists only once; a temporary one is used if None
+        """
         config_path = map_conf_path(org, map_id)
 
         if not os.path.isfile(config_path):
             return
 
-        with open(config_path) as f:
-            config_file = f.readlines()
+        re_org_anno = KeggAnnotation.org_pattern(org)
 
-        re_org_anno = re.compile(r'^eco:b[0-9]+$') if org == 'eco' else re.compile(rf'^{org}:[0-9]+$')
+        if description_cache is None:
+            description_cache = DescriptionCache(cdb_readers)
+        if annotation_pool is None:
+            annotation_pool = {}
 
         try:
-            for line in config_file:
-                raw_position, url, description = [l for l in line.rstrip().split('\t')]
-                annotations = KeggAnnotation.create_annos(cdb_readers=cdb_readers, url=url, re_org_anno=re_org_anno, org=org)
-                shape = KeggShape.create_shape(raw_position, description, annotations)
-                self.add_shape(shape)
+            columns = read_conf_columns(config_path)
+            url_queries = [KeggAnnotation.parse_url(url=url, re_org_anno=re_org_anno, org=org) for url in columns.urls]
+
+            new_queries = {
+                anno_query.key: anno_query
+                for anno_queries in url_queries for anno_query in anno_queries
+                if anno_query.key not in annotation_pool
+            }
+            descriptions = description_cache.get_many(anno_query.description_key for anno_query in new_queries.values())
+            for key, anno_query in new_queries.items():
+                annotation_pool[key] = KeggAnnotation.from_query(anno_query, descriptions[anno_query.description_key])
+
+            url_annotations = [
+                [(anno_query.key, annotation_pool[anno_query.key]) for anno_query in anno_queries]
+                for anno_queries in url_queries
+            ]
+            if self._assembly is None:
+                self._assembly = ShapeAssembly()
+            self._assembly.add(columns, url_annotations)
         except Exception as e:
             e.args = tuple([f'Exception occurred in {self}!\n{str(e)}'])
             raise e
 
+        self.bboxes_loaded = False
+        self._incidence = None
+
+    def _materialize_shapes(self) -> None:
+        assembly, self._assembly = self._assembly, None
+        if assembly is None:
+            return
+        for shape in assembly.iter_shapes():
+            self.add_shape(shape)
+
+    def intern_annotations(self, annotation_pool: {(str, str): KeggAnnotation}) -> None:
+        """
+        Replace the annotations of all shapes by the identical instances from annotation_pool, add missing ones
+        to the pool. Used for maps that were loaded from the cache.
+        """
+        for shape in self.shapes.values():
+            shape.annotations = {key: annotation_pool.setdefault(key, anno) for key, anno in shape.annotations.items()}
+
     def add_shape(self, shape: KeggShape):
+        self.bboxes_loaded = False
+        self._incidence = None
         # some shapes may have same position. Example: ko00010, poly (576,199,567,202,567,195)
-        if shape.raw_position in self.shapes:
+        if shape.raw_position in self._shapes:
             # add new annotations to existing shape
-            self.shapes[shape.raw_position].merge(shape)
+            self._shapes[shape.raw_position].merge(shape)
         else:
-            self.shapes[shape.raw_position] = shape
+            shape.hash = self._unique_shape_id(shape.raw_position)
+            self._shapes[shape.raw_position] = shape
+
+    def _unique_shape_id(self, raw_position: str) -> str:
+        # shapes are added in the order of the .conf files, so colliding ids are always resolved the same way
+        salt = 0
+        while (candidate := shape_id(raw_position, map_id=self.map_id, salt=salt)) in self._shape_ids:
+            logging.warning(f'Shape id collision in {self}: {raw_position} -> {candidate}')
+            salt += 1
+        self._shape_ids.add(candidate)
+        return candidate
 
     def circles(self) -> [Circle]:
         return [s for s in self.shapes.values() if type(s) is Circle]
@@ -106,37 +327,69 @@ class KeggMap:
     def polys(self) -> [Poly]:
         return [s for s in self.shapes.values() if type(s) is Poly]
 
-    def _load_png(self):
+    def _load_png(self) -> PngSidecar:
         """
-        Convert white to transparent, return base64-encoded image, width and height.
+        Open the transparent image. Create it if necessary: convert a sidecar of the former .png.json format or
+        convert white to transparent.
         """
-        if not os.path.isfile(self.png_path):
-            encode_png(self.png_path)
-        png_json = load_png(self.png_path)
-        return png_json['image'], png_json['width'], png_json['height']
+        if not os.path.isfile(self.sidecar_path):
+            if os.path.isfile(self.png_path + '.json'):
+                migrate_png_json(self.png_path)
+            else:
+                encode_png(self.png_path)
+        return PngSidecar(self.sidecar_path)
 
-    def _load_bounding_boxes(self) -> None:
+    def _load_bounding_boxes(self, engine: str = 'analytic') -> None:
         """
-        Calculate bounding boxes of all shapes.
+        Calculate bounding boxes of all shapes and add them to the shapes.
+
+        :param engine: 'analytic': compute bounding boxes from the shape coordinates (see kegg_bbox),
+            'cross-check': like 'analytic', but also render the map with PySide6.QtSvg and log deviating shapes
+        """
+        assert engine in ('analytic', 'cross-check'), f'Unknown bbox engine: {engine}'
+        if not self.bboxes_loaded:
+            shapes = list(self.shapes.values())
+            for shape, (x, y, width, height) in zip(shapes, bounding_boxes(shapes).tolist()):
+                shape.bbox = BBox(x=x, y=y, width=width, height=height)
+            self.bboxes_loaded = True
+
+        if engine == 'cross-check':
+            self._cross_check_bounding_boxes()
 
-        1) create a svg map in calculate_bboxes
+    def _cross_check_bounding_boxes(self, tolerance: float = 10) -> {str: (BBox, BBox)}:
+        """
+        Compare the analytic bounding boxes with those calculated by PySide6.QtSvg.
+
+        1) create a svg map in load_bbox_mode
         2) use PySide6.QtSvg to calculate bounding boxes
-        3) add bounding boxes to shapes
+        3) compare with the bounding boxes of the shapes
+
+        QtSvg ignores the stroke of lines in load_bbox_mode, hence the generous default tolerance.
+
+        :param tolerance: maximal accepted deviation in pixels
+        :return: dictionary: raw position -> (analytic bbox, Qt bbox) of all deviating shapes
         """
         from PySide6 import QtSvg
 
+        deviating = {}
         with NamedTemporaryFile(mode='w') as tmp_svg:
-            tmp_svg.write(MAP_TEMPLATE.render(map=self, color_function=default_color_function, load_bbox_mode=True))
+            tmp_svg.write(load_template('map').render(map=self, color_function=default_color_function, load_bbox_mode=True))
             tmp_svg.flush()
             svg_renderer = QtSvg.QSvgRenderer()
             svg_renderer.load(tmp_svg.name)
             for raw_position, shape in self.shapes.items():
                 qrectf = svg_renderer.boundsOnElement(shape.hash)
-                shape.bbox = BBox(
+                qt_bbox = BBox(
                     x=qrectf.x(),
                     y=qrectf.y(),
                     width=qrectf.width(),
                     height=qrectf.height()
                 )
-                if shape.bbox.width == shape.bbox.height == 0:
+                if qt_bbox.width == qt_bbox.height == 0:
                     logging.warning(f'Error in map={self.map_id} shape={shape.raw_position} {shape.description=}: Could not get valid bbox.')
+                deviation = max(abs(getattr(shape.bbox, c) - getattr(qt_bbox, c)) for c in ('x1', 'x2', 'y1', 'y2'))
+                if deviation > tolerance:
+                    logging.warning(f'Bbox mismatch in map={self.map_id} shape={shape.raw_position}: '
+                                    f'analytic={shape.bbox} qt={qt_bbox}')
+                    deviating[raw_position] = (shape.bbox, qt_bbox)
+        return deviating
@@ -1,14 +1,43 @@
 import os
+import time
+from typing import Callable
 
-from kegg_map_wizard.kegg_download import DATA_DIR, download_rest_data, download_map_pngs, download_map_confs, map_png_path, map_conf_path
+from kegg_map_wizard.kegg_download import download_rest_data, download_map_pngs, download_map_confs, map_png_path, map_conf_path, \
+    map_conf_dir, rest_data_path, rest_files, open_rest_data, DescriptionCache, MapAvailability
+from kegg_map_wizard.kegg_link import download_ko_links, import_gene_table, derive_map_confs
 from kegg_map_wizard.KeggMap import KeggMap
+from kegg_map_wizard.KeggAnnotation import KeggAnnotation
+from kegg_map_wizard import kegg_cache
+from kegg_map_wizard.kegg_index import AnnotationIndex, open_annotation_index
+from kegg_map_wizard.kegg_coverage import CoverageCatalogue
 
 
 class KeggMapWizard:
-    def __init__(self, orgs: [str], reload_rest_data=False):
+    def __init__(self, orgs: [str], reload_rest_data=False, offline: bool = False, derived_orgs: {str: str} = None):
+        """
+        :param orgs: organisms whose annotations are merged, e.g. ['ko', 'rn', 'ec']
+        :param reload_rest_data: if True: download the REST lists again
+        :param offline: if True: never download anything, only use the data directory as it is
+        :param derived_orgs: organisms in orgs whose maps are derived locally from the ko maps instead of being
+            downloaded map by map, see kegg_link: org -> path of a local gene -> KO table (for genomes that are not
+            in KEGG) or None (use KEGG's link/{org}/ko table), e.g. {'hsa': None, 'mygenome': 'mygenome.tsv'}
+        """
+        assert not (offline and reload_rest_data), 'Cannot reload REST data in offline mode'
         self.orgs = orgs
-        self.cdb_readers = download_rest_data(orgs=self.orgs, reload=reload_rest_data)
+        self.offline = offline
+        self.derived_orgs: {str: str} = derived_orgs or {}
+        assert set(self.derived_orgs) <= set(orgs), f'Derived organisms must be in {orgs=}: {self.derived_orgs}'
+        for org, tsv_path in self.derived_orgs.items():
+            if tsv_path:
+                import_gene_table(org, tsv_path)
+            elif not offline:
+                download_ko_links(org, reload=reload_rest_data)
+        self.cdb_readers = self._load_rest_data(reload=reload_rest_data)
+        self.description_cache = DescriptionCache(self.cdb_readers)
+        self.annotation_pool: {(str, str): KeggAnnotation} = {}  # every annotation exists only once
         self.all_mapids: {str: str} = self.__load_all_mapids()
+        self._annotation_index: AnnotationIndex = None
+        self._availability: MapAvailability = None
 
     def __repr__(self):
         return f'<KeggMapWizard: {self.org_string}>'
@@ -17,20 +46,50 @@ class KeggMapWizard:
     def org_string(self):
         return "+".join(self.orgs)
 
+    @property
+    def availability(self) -> MapAvailability:
+        """
+        Which PNGs and confs are present, listed once per wizard and updated after downloads.
+        """
+        if self._availability is None:
+            self._availability = MapAvailability(self.orgs)
+        return self._availability
+
     def download_configs(self, map_ids: [str] = None, reload: bool = False):
+        assert not self.offline, f'{self} is offline'
         if map_ids is None:
             map_ids = self.all_mapids.keys()
         if reload:
-            download_rest_data(orgs=self.orgs, reload=False)
+            download_rest_data(orgs=self._kegg_orgs, reload=False)
         for org in self.orgs:
             self._download_maps(org=org, map_ids=map_ids, reload=reload, nonexistent_file=True)
 
-    def create_map(self, map_id: str) -> KeggMap:
+    def create_map(self, map_id: str, use_cache: bool = True) -> KeggMap:
+        """
+        Create a KeggMap with the shapes and annotations of all organisms.
+
+        :param map_id: e.g. '00400'
+        :param use_cache: if True: load the precompiled map from the cache if it is up-to-date, save it otherwise
+        :return: KeggMap with bounding boxes
+        """
         assert map_id in self.all_mapids, f'Map {map_id} does not exist for {self}'
+        if use_cache:
+            map = kegg_cache.load_map(orgs=self.orgs, map_id=map_id)
+            if map is not None:
+                map.intern_annotations(self.annotation_pool)
+                return map
+        if not self.availability.is_complete(map_id):
+            if not self.offline:
+                self.download_configs(map_ids=[map_id])
+            elif self.derived_orgs:
+                self.derive_maps(map_ids=[map_id])  # no network access required
         map = KeggMap(orgs=self.orgs, map_id=map_id, title=self.all_mapids[map_id], png_path=map_png_path(map_id))
-        self.download_configs(map_ids=[map_id])
         for org in self.orgs:
-            map.add_shapes(cdb_readers=self.cdb_readers, map_id=map_id, org=org)
+            map.add_shapes(cdb_readers=self.cdb_readers, map_id=map_id, org=org, description_cache=self.description_cache,
+                           annotation_pool=self.annotation_pool)
+        if use_cache:
+            map._load_bounding_boxes()  # cached maps are ready to render, otherwise shapes and bboxes stay lazy
+            kegg_cache.save_map(map)
         return map
 
     def create_maps(self, map_ids: [str] = None) -> {str: KeggMap}:
@@ -38,37 +97,237 @@ class KeggMapWizard:
             map_ids = self._available_maps()
         return {map_id: self.create_map(map_id) for map_id in map_ids}
 
+    def render_all(
+            self,
+            out_dir: str,
+            map_ids: [str] = None,
+            color_function: Callable = None,
+            fmt: str = 'svg',
+            workers: int = None,
+            calculate_bboxes: bool = True,
+            png_base_url: str = None
+    ) -> [dict]:
+        """
+        Render many maps in parallel and write them to out_dir/{org_string}{map_id}.{fmt}
+
+        Missing maps are downloaded (or derived, if offline) first. Each worker process opens its own wizard and
+        writes its maps directly to disk.
+
+        :param out_dir: existing directory
+        :param map_ids: maps to render, default: all available maps
+        :param color_function: must be picklable, i.e. defined at module level, if workers > 1
+        :param fmt: 'svg' or 'svgz'
+        :param workers: number of processes, default: number of CPUs; if 1: render in this process
+        :param calculate_bboxes: passed on to KeggMap.svg
+        :param png_base_url: if set: reference the background images exported by export_pngs under this URL
+            instead of embedding them
+        :return: report, one dict per map: map_id, status ('success' or 'error'), path, seconds, error
+        """
+        assert fmt in ('svg', 'svgz'), f'Unknown format: {fmt}'
+        assert os.path.isdir(out_dir), f'Directory not found: {out_dir}'
+        if map_ids is None:
+            map_ids = self._available_maps()
+        map_ids = sorted(map_ids)
+
+        # download or derive here, not concurrently in the workers
+        incomplete = [map_id for map_id in map_ids if not self.availability.is_complete(map_id)]
+        if incomplete and not self.offline:
+            self.download_configs(map_ids=incomplete)
+        elif incomplete and self.derived_orgs:
+            self.derive_maps(map_ids=incomplete)
+
+        args_list = [(map_id, out_dir, color_function, fmt, calculate_bboxes, png_base_url) for map_id in map_ids]
+        if workers == 1:
+            return [_render_map(self, *args) for args in args_list]
+
+        import multiprocessing
+        initargs = (self.orgs, self.derived_orgs)
+        with multiprocessing.Pool(processes=workers, initializer=_init_render_worker, initargs=initargs) as pool:
+            report = pool.starmap(_render_in_worker, args_list)
+        return report
+
+    @property
+    def annotation_index(self) -> AnnotationIndex:
+        """
+        Inverted index over the .conf files of all downloaded maps and organisms, built on first use and
+        whenever a .conf file changed.
+        """
+        if self._annotation_index is None:
+            self._annotation_index = open_annotation_index()
+        return self._annotation_index
+
+    def maps_for(self, annotation: str) -> [str]:
+        """
+        Find maps without creating them.
+
+        :param annotation: e.g. 'K01623', 'C00031', 'EC:4.1.2.13'
+        :return: sorted map_ids of all maps where the annotation occurs in a .conf file of self.orgs
+        """
+        return self.annotation_index.maps_for(annotation, orgs=self.orgs)
+
+    def shapes_for(self, annotation: str) -> [(str, str)]:
+        """
+        Find shapes without creating maps.
+
+        :param annotation: e.g. 'K01623', 'C00031', 'EC:4.1.2.13'
+        :return: sorted (map_id, raw_position), where raw_position is the key in KeggMap.shapes
+        """
+        return self.annotation_index.shapes_for(annotation, orgs=self.orgs)
+
+    @property
+    def rest_index(self):  # -> RestIndex
+        """
+        The memory-mapped index over all REST lists that serves self.cdb_readers, see kegg_rest_index.
+        """
+        return next(iter(self.cdb_readers.values())).index
+
+    def search(self, text: str, limit: int = 50) -> [(str, str, str)]:
+        """
+        Find annotations by the words of their descriptions, without scanning the REST lists.
+
+        :param text: e.g. 'glycolysis' or 'hexokinase'; every word must start a word of the description
+        :param limit: maximal number of results
+        :return: list of (rest file, key, description) of the REST lists of self.orgs,
+            e.g. [('ko', 'ko:K00844', 'HK; hexokinase [EC:2.7.1.1]'), ('path', 'path:map00010', 'Glycolysis / ...')]
+        """
+        return self.rest_index.search(text, rest_files=rest_files(self.orgs), limit=limit)
+
+    def coverage_catalogue(self, map_ids: [str] = None, html_class: str = 'enzyme') -> CoverageCatalogue:
+        """
+        Collect the shapes of many maps for genome x map coverage calculations, see CoverageCatalogue.
+
+        Example: kmw.coverage_catalogue().coverage_table(read_genome_annotations('genomes.tsv'), workers=8)
+
+        :param map_ids: maps to include, default: all available maps
+        :param html_class: only count shapes of this class; None: count all shapes
+        """
+        return CoverageCatalogue(self.create_maps(map_ids).values(), html_class=html_class)
+
+    def export_pngs(self, static_dir: str, map_ids: [str] = None) -> {str: str}:
+        """
+        Export the transparent background images into a static directory, see KeggMap.export_png.
+        Use render_all(png_base_url=...) or KeggMap.svg(png_url=...) to create SVGs that reference them.
+
+        :param static_dir: directory to be served, e.g. by a web server
+        :param map_ids: maps whose images to export, default: all available maps
+        :return: dictionary: map_id -> file name
+        """
+        if map_ids is None:
+            map_ids = self._available_maps()
+        os.makedirs(static_dir, exist_ok=True)
+        return {map_id: self.create_map(map_id).export_png(static_dir) for map_id in sorted(map_ids)}
+
     def _available_maps(self) -> {str}:
         for org in self.orgs:
-            data_dir = f'{DATA_DIR}/maps_data/{org}'
-            assert os.path.isdir(data_dir), f'Organism seems not to have been downloaded: {org=}; {data_dir} is empty'
+            conf_dir = map_conf_dir(org)
+            assert os.path.isdir(conf_dir), f'Organism seems not to have been downloaded: {org=}; {conf_dir} is empty'
 
         map_ids = {
             filename.removesuffix('.conf')
             for org in self.orgs
-            for filename in os.listdir(f'{DATA_DIR}/maps_data/{org}')
+            for filename in os.listdir(map_conf_dir(org))
             if filename.endswith('.conf')
         }
         for map_id in map_ids:
             assert len(map_id) == 5 and map_id.isnumeric(), f'Conf file does not start with map_id: {map_id=}'
         return map_ids
 
-    def download_maps(self, map_ids: [str] = None, reload=False):
+    def download_maps(self, map_ids: [str] = None, reload=False, incremental=False) -> {str}:
+        """
+        Download map PNGs and confs of all organisms.
+
+        :param map_ids: maps to download, default: all maps
+        :param reload: if True: download all files again
+        :param incremental: if True: check all files with conditional requests, only rewrite those whose content changed
+        :return: map_ids whose PNG or conf was (re-)downloaded
+        """
+        assert not self.offline, f'{self} is offline'
         if map_ids is None:
             map_ids = self.all_mapids.keys()
 
-        for org in self.orgs:
-            self._download_maps(map_ids=map_ids, org=org, reload=reload)
+        changed = set()
+        for i, org in enumerate(self.orgs):
+            # the PNGs are the same for all organisms, check them only once
+            changed.update(self._download_maps(map_ids=map_ids, org=org, reload=reload, incremental=incremental, check_pngs=i == 0))
+
+        if reload:
+            kegg_cache.clear_cache(map_ids=map_ids)
+        elif incremental:
+            kegg_cache.clear_cache(map_ids=changed)
+        self._annotation_index = None  # reopened on next use, rebuilt if outdated
+
+        return changed
 
-    def _download_maps(self, org: str, map_ids: [str], reload=False, nonexistent_file=True) -> None:
-        os.makedirs(f'{DATA_DIR}/maps_data/{org}', exist_ok=True)
-        download_map_pngs(map_ids, reload=reload)
-        found_maps = set(map.removesuffix('.png') for map in os.listdir(f'{DATA_DIR}/maps_png') if map.endswith('.png'))
-        confs = [map for map in map_ids if map in found_maps]
-        download_map_confs(org, confs, reload=reload, nonexistent_file=nonexistent_file)
+    def refresh(self, map_ids: [str] = None) -> {str}:
+        """
+        Incrementally synchronize REST lists, map PNGs and confs with KEGG.
+
+        Only files whose content changed are rewritten, only their cdb files are rebuilt and only the affected
+        cached maps are invalidated.
+
+        :param map_ids: maps to synchronize, default: all maps
+        :return: map_ids whose PNG or conf changed
+        """
+        assert not self.offline, f'{self} is offline'
+        for org, tsv_path in self.derived_orgs.items():
+            if tsv_path:
+                import_gene_table(org, tsv_path)
+            else:
+                download_ko_links(org, incremental=True)
+        self.cdb_readers = self._load_rest_data(incremental=True)
+        self.description_cache = DescriptionCache(self.cdb_readers)
+        self.annotation_pool = {}
+        self.all_mapids = self.__load_all_mapids()
+        self._availability = None
+        return self.download_maps(map_ids=map_ids, incremental=True)
+
+    def derive_maps(self, map_ids: [str] = None, reload: bool = False) -> {str}:
+        """
+        Derive the .conf files of all derived_orgs from the ko .conf files that are present, see kegg_link.
+        Only outdated files are rewritten. Works offline.
+
+        :param map_ids: maps to derive, default: all maps
+        :param reload: if True: rewrite all files
+        :return: map_ids whose .conf file was (re-)written
+        """
+        if map_ids is None:
+            map_ids = self.all_mapids.keys()
+        statuses = {}
+        for org in self.derived_orgs:
+            statuses.update(derive_map_confs(org, map_ids, reload=reload))
+        self.availability.update(statuses)
+        return {os.path.basename(path).split('.')[0] for path, status in statuses.items() if status == 'success'}
+
+    @property
+    def _kegg_orgs(self) -> [str]:
+        # organisms whose REST lists are downloaded, the lists of local genomes are created by import_gene_table
+        return [org for org in self.orgs if not self.derived_orgs.get(org)]
+
+    def _load_rest_data(self, reload=False, incremental=False) -> dict:
+        if not self.offline:
+            download_rest_data(orgs=self._kegg_orgs, reload=reload, incremental=incremental)
+        return open_rest_data(self.orgs)
+
+    def _download_maps(self, org: str, map_ids: [str], reload=False, nonexistent_file=True, incremental=False, check_pngs=True) -> {str}:
+        os.makedirs(map_conf_dir(org), exist_ok=True)
+        if check_pngs:
+            statuses = download_map_pngs(map_ids, reload=reload, incremental=incremental)
+        else:
+            statuses = download_map_pngs(map_ids)  # only download missing PNGs
+        self.availability.pngs.update(map_ids)  # download_map_pngs asserts that all PNGs exist
+        if org in self.derived_orgs:
+            # only the ko .conf files are downloaded, if ko is in self.orgs they are reloaded in its own turn
+            os.makedirs(map_conf_dir('ko'), exist_ok=True)
+            ko_reload = 'ko' not in self.orgs
+            statuses.update(download_map_confs('ko', map_ids, reload=reload and ko_reload, incremental=incremental and ko_reload))
+            statuses.update(derive_map_confs(org, map_ids, reload=reload))
+        else:
+            statuses.update(download_map_confs(org, map_ids, reload=reload, nonexistent_file=nonexistent_file, incremental=incremental))
+        self.availability.update(statuses)
+        return {os.path.basename(path).split('.')[0] for path, status in statuses.items() if status == 'success'}
 
     def __load_all_mapids(self) -> {str: str}:
-        with open(f'{DATA_DIR}/rest_data/path.tsv', 'r') as f:
+        with open(rest_data_path('path'), 'r') as f:
             path_file = f.readlines()  # ['path:map00010\tGlycolysis / Gluconeogenesis', ...]
         map_id_to_description = {map_id.lstrip('path:map'): title.rstrip() for map_id, title in
                                  (line.split('\t', maxsplit=1) for line in path_file)}  #
@@ -77,3 +336,30 @@ class KeggMapWizard:
             assert len(key) == 5 and key.isnumeric()
 
         return map_id_to_description
+
+
+_worker_wizard: KeggMapWizard = None  # one wizard per render_all worker process
+
+
+def _init_render_worker(orgs: [str], derived_orgs: {str: str}) -> None:
+    global _worker_wizard
+    # render_all downloads and derives everything beforehand
+    _worker_wizard = KeggMapWizard(orgs=orgs, offline=True, derived_orgs=derived_orgs)
+
+
+def _render_in_worker(*args) -> dict:
+    return _render_map(_worker_wizard, *args)
+
+
+def _render_map(wizard: KeggMapWizard, map_id: str, out_dir: str, color_function: Callable, fmt: str, calculate_bboxes: bool,
+                png_base_url: str) -> dict:
+    start = time.perf_counter()
+    path = f'{out_dir}/{wizard.org_string}{map_id}.{fmt}'
+    try:
+        map = wizard.create_map(map_id)
+        save = map.save_svgz if fmt == 'svgz' else map.save_svg
+        png_url = map.static_png_url(png_base_url) if png_base_url else None
+        save(out_path=path, color_function=color_function, calculate_bboxes=calculate_bboxes, png_url=png_url)
+    except Exception as e:
+        return dict(map_id=map_id, status='error', path=None, seconds=time.perf_counter() - start, error=str(e))
+    return dict(map_id=map_id, status='success', path=path, seconds=time.perf_counter() - start, error=None)
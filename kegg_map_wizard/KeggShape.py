@@ -1,14 +1,34 @@
 import os
 import re
 import json
+from hashlib import blake2b
 from abc import ABC, abstractmethod
+from array import array
 from typing import Callable
 
-from kegg_map_wizard.kegg_utils import Template, LINE_TEMPLATE, RECT_TEMPLATE, POLY_TEMPLATE, CIRCLE_TEMPLATE, round_up, round_down
+import numpy as np
+
+from kegg_map_wizard.kegg_utils import load_template, round_up, round_down
 from kegg_map_wizard.KeggAnnotation import KeggAnnotation
 
 
+def shape_id(raw_position: str, map_id: str = '', salt: int = 0) -> str:
+    """
+    Deterministic id of a shape, used as SVG element id and gradient id. Unlike hash(), it does not change between
+    processes, so identical maps always produce identical SVGs.
+
+    :param raw_position: geometry as in the .conf file, e.g. 'rect (259,192) (305,209)'
+    :param map_id: makes the ids of different maps on the same page distinct
+    :param salt: increase to resolve a collision, see KeggMap.add_shape
+    :return: e.g. 's3f2a9c01b7e4'
+    """
+    key = f'{map_id}\t{raw_position}\t{salt}' if salt else f'{map_id}\t{raw_position}'
+    return 's' + blake2b(key.encode('utf-8'), digest_size=6).hexdigest()
+
+
 class BBox:
+    __slots__ = ('x', 'y', 'width', 'height')
+
     def __init__(self, x: float, y: float, width: float, height: float):
         # Some Lines have width=0 -> gradients don't work!
         if width < 0.1:  # make sure the BBox has at least width=10
@@ -22,10 +42,22 @@ class BBox:
         self.y = y
         self.width = width
         self.height = height
-        self.x1 = round_down(x)
-        self.x2 = round_up(x + width)
-        self.y1 = round_down(y)
-        self.y2 = round_up(y + height)
+
+    @property
+    def x1(self) -> float:
+        return round_down(self.x)
+
+    @property
+    def x2(self) -> float:
+        return round_up(self.x + self.width)
+
+    @property
+    def y1(self) -> float:
+        return round_down(self.y)
+
+    @property
+    def y2(self) -> float:
+        return round_up(self.y + self.height)
 
     def serialized(self) -> str:
         return json.dumps({'x1': self.x1, 'x2': self.x2, 'y1': self.y1, 'y2': self.y2})
@@ -35,37 +67,54 @@ class BBox:
 
 
 class KeggShape(ABC):
-    type: str
+    # shapes are numerous: no __dict__, coordinates as compact int arrays, annotations shared per KeggMapWizard
+    __slots__ = ('type', 'description', 'raw_position', 'annotations', 'points', 'bbox', 'definition', 'hash')
     re_geometry: re.Pattern
-    template: Template  # jinja2.Template
-    bbox: BBox = None
-    definition_html: str = None
+    template_name: str  # template/{template_name}.svg
+    stroke_width: int = 0  # must match the stroke-width in the template
 
-    def __init__(self, type, geometry, description, raw_position, annotations: [KeggAnnotation]):
-        self.type = type  # 'rect', 'poly' or 'circle'
+    def __init__(self, type, geometry, description, raw_position, annotations: {(str, str): KeggAnnotation}):
+        self.type = type  # 'rect', 'poly', 'circle', 'line', ... as in the .conf file
         self.description = description
         self.raw_position = raw_position
         self.annotations = annotations
-        self.hash = str(hash(raw_position))
+        self.bbox: BBox = None
+        self.definition: str = None  # may be set by color functions, e.g. a gradient
+        self.hash: str = None  # set by KeggMap.add_shape, the id includes the map id
 
         assert self.re_geometry.match(geometry) is not None, \
             f'Error in {self}: geometry {repr(geometry)} does not match regex!'
 
         try:
-            self.coords = self.calc_geometry(geometry)
+            self.points: array = self.calc_geometry(geometry)  # integer coordinates as rendered
         except Exception as e:
             e.args = tuple([f'Error occurred while parsing geometry: {repr(geometry)}\n{str(e)}'])
             raise e
 
+    @property
+    def template(self):  # -> jinja2.Template
+        return load_template(self.template_name)
+
+    @property
+    def coords(self) -> str:
+        """
+        Geometry as written into the SVG template.
+        """
+        return self.format_coords()
+
     def __repr__(self):
         return f'<KeggShape{type(self).__name__}: {self.description}>'
 
     @abstractmethod
-    def calc_geometry(self, geometry: str):
+    def calc_geometry(self, geometry: str) -> array:
+        raise NotImplementedError('This is an abstract class!')
+
+    @abstractmethod
+    def format_coords(self) -> str:
         raise NotImplementedError('This is an abstract class!')
 
-    def classes(self):
-        classes = set(anno.html_class for anno in self.annotations.values())
+    def classes(self) -> [str]:
+        classes = sorted(set(anno.html_class for anno in self.annotations.values()))  # sorted: deterministic SVGs
         if len(classes) > 1:
             print('Weird. A shape should have only one class.', self, classes)
         return classes
@@ -87,6 +136,29 @@ class KeggShape(ABC):
             if key not in my_annos:
                 self.annotations[key] = other_anno
 
+    @staticmethod
+    def from_points(shape_type: str, points, description: str, raw_position: str, annotations: {(str, str): KeggAnnotation}):
+        """
+        Create a shape from already parsed coordinates (see kegg_conf.ShapeTable), skipping calc_geometry.
+
+        :param points: integer coordinates as rendered, see calc_geometry
+        """
+        if shape_type in ['circle', 'filled_circ', 'circ']:
+            cls = Circle
+        else:
+            cls = SHAPE_CLASSES.get(shape_type)
+            assert cls is not None, f'Line does not match any type: {shape_type}'
+        shape = object.__new__(cls)
+        shape.type = shape_type
+        shape.description = description
+        shape.raw_position = raw_position
+        shape.annotations = annotations
+        shape.bbox = None
+        shape.definition = None
+        shape.hash = None
+        shape.points = array('i', np.asarray(points, dtype=np.int32).tobytes())
+        return shape
+
     @staticmethod
     def create_shape(raw_position: str, description: str, annotations: [KeggAnnotation]):
         try:
@@ -108,35 +180,42 @@ class KeggShape(ABC):
 
 
 class Poly(KeggShape):
-    type = 'poly'
+    __slots__ = ()
     re_geometry = re.compile(r'^([(,][0-9]+)+\)$')  # (341,292,332,295,332,288), (670,909,661,912,664,909,661,905)
-    template = POLY_TEMPLATE
+    template_name = 'poly'
+    stroke_width = 3
 
-    def calc_geometry(self, geometry: str) -> str:
+    def calc_geometry(self, geometry: str) -> array:
         # x1,y1,x2,y2,..,xn,yn 	Specifies the coordinates of the edges of the polygon.
         coords = geometry[1:-1].split(',')
         for c in coords:
             assert c.isdigit(), f'Error in {self}: geometry contains non-integer! {geometry}'
         assert len(coords) % 2 == 0, f'number of polygon coordinates must be odd! {geometry} -> {coords}'
-        return ",".join([str(c) for c in coords])
+        return array('i', [int(c) for c in coords])
+
+    def format_coords(self) -> str:
+        return ','.join(str(c) for c in self.points)
 
 
 class Circle(KeggShape):
-    type = 'circle'
+    __slots__ = ()
     re_geometry = re.compile(r'^\([0-9]+,[0-9]+\) [0-9]+$')  # (246,236) 4
-    template = CIRCLE_TEMPLATE
+    template_name = 'circle'
 
-    def calc_geometry(self, geometry: str) -> str:
-        cx, cy, r = [int(i) for i in geometry[1:].replace(') ', ',').split(',')]
+    def calc_geometry(self, geometry: str) -> array:
+        return array('i', [int(i) for i in geometry[1:].replace(') ', ',').split(',')])  # cx, cy, r
+
+    def format_coords(self) -> str:
+        cx, cy, r = self.points
         return f'cx="{cx}" cy="{cy}" r="{r}"'
 
 
 class Rect(KeggShape):
-    type = 'rect'
+    __slots__ = ()
     re_geometry = re.compile(r'^\([0-9]+,[0-9]+\) \([0-9]+,[0-9]+\)$')  # (259,192) (305,209)
-    template = RECT_TEMPLATE
+    template_name = 'rect'
 
-    def calc_geometry(self, geometry: str) -> str:  # '(620,271) (666,288)' -> []
+    def calc_geometry(self, geometry: str) -> array:  # '(620,271) (666,288)' -> [x, y, w, h]
         coords = geometry[1:-1].replace(') (', ',')
         x, y, rx, ry = [int(i) for i in coords.split(',')]
         w, h = rx - x, ry - y
@@ -145,22 +224,30 @@ class Rect(KeggShape):
         if w > 46 and h > 17:
             x = x + 1
             y = y + 1
-            r = 10
-        else:
-            r = 0
 
+        return array('i', [x, y, w, h])
+
+    def format_coords(self) -> str:
+        x, y, w, h = self.points
+        r = 10 if w > 46 and h > 17 else 0  # rounded corners for adjusted rects
         return f'x="{x}" y="{y}" width="{w}" height="{h}" rx="{r}" ry="{r}"'
 
 
 class Line(Rect):
-    type = 'line'
+    __slots__ = ()
     re_geometry = re.compile(r'^\([0-9]+(,[0-9]+)+\) [0-9]+$')  # '(138,907,158,907) 2' or longer: '(723,2164,775,2164,775,2164) 3'
-    template = LINE_TEMPLATE
+    template_name = 'line'
+    stroke_width = 10
 
-    def calc_geometry(self, geometry: str) -> str:  # '(138,907,158,907) 2' -> 'M 138.0,907.0 L 158.0,907.0'
+    def calc_geometry(self, geometry: str) -> array:  # '(138,907,158,907) 2' -> [138, 907, 158, 907]
         geometry, radius = geometry.rsplit(' ', maxsplit=1)
         coords = [int(i) for i in geometry[1:-1].split(',')]  # convert to int to catch errors
         assert len(coords) % 2 == 0, f'number of polygon coordinates must be odd! {geometry} -> {coords}'
-        points = [(coords[l * 2], coords[l * 2 + 1]) for l in range(len(coords) // 2)]
-        path = 'M ' + ' L '.join(f'{x},{y}' for x, y in points)
-        return path
+        return array('i', coords)
+
+    def format_coords(self) -> str:  # 'M 138,907 L 158,907'
+        points = self.points
+        return 'M ' + ' L '.join(f'{points[i]},{points[i + 1]}' for i in range(0, len(points), 2))
+
+
+SHAPE_CLASSES = {'rect': Rect, 'poly': Poly, 'line': Line}
@@ -1,5 +1,24 @@
-from .KeggMapWizard import KeggMapWizard
-from .KeggMap import KeggMap
-from .KeggShape import KeggShape
-from .KeggAnnotation import KeggAnnotation
-from .ColorMaker import ColorMaker
+from importlib import import_module
+
+# the classes are imported on first access, so that importing the package is cheap and has no side effects
+_CLASSES = dict(
+    KeggMapWizard='.KeggMapWizard',
+    KeggMap='.KeggMap',
+    KeggShape='.KeggShape',
+    KeggAnnotation='.KeggAnnotation',
+    ColorMaker='.ColorMaker',
+)
+
+__all__ = list(_CLASSES)
+
+
+def __getattr__(name: str):
+    if name in _CLASSES:
+        value = getattr(import_module(_CLASSES[name], __name__), name)
+        globals()[name] = value  # later lookups do not call __getattr__
+        return value
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+
+
+def __dir__() -> [str]:
+    return sorted([*globals(), *_CLASSES])
@@ -0,0 +1,105 @@
+import numpy as np
+
+from kegg_map_wizard.KeggShape import KeggShape, Poly, Circle, Rect, Line
+
+MITER_LIMIT = 4  # SVG default for stroke-miterlimit
+
+
+def bounding_boxes(shapes: [KeggShape]) -> np.ndarray:
+    """
+    Calculate the bounding boxes of many shapes at once, straight from their integer coordinates.
+
+    Strokes are included the way an SVG renderer paints them: butt caps and miter joins
+    (stroke-miterlimit=4) with the stroke-width of the shape template.
+
+    :param shapes: list of KeggShapes
+    :return: float array of shape (len(shapes), 4): x, y, width, height
+    """
+    boxes = np.zeros((len(shapes), 4), dtype=float)
+
+    circles = [i for i, s in enumerate(shapes) if type(s) is Circle]
+    rects = [i for i, s in enumerate(shapes) if type(s) is Rect]
+    polys = [i for i, s in enumerate(shapes) if type(s) is Poly]
+    lines = [i for i, s in enumerate(shapes) if type(s) is Line]
+
+    if circles:
+        cx, cy, r = np.array([shapes[i].points for i in circles], dtype=float).T
+        boxes[circles] = np.stack([cx - r, cy - r, 2 * r, 2 * r], axis=1)
+
+    if rects:
+        boxes[rects] = np.array([shapes[i].points for i in rects], dtype=float)
+
+    for indices, shape_type, closed in ((polys, Poly, True), (lines, Line, False)):
+        if indices:
+            boxes[indices] = _stroke_boxes(
+                coords=[shapes[i].points for i in indices],
+                half_width=shape_type.stroke_width / 2,
+                closed=closed
+            )
+
+    return boxes
+
+
+def _stroke_boxes(coords: [(int,)], half_width: float, closed: bool) -> np.ndarray:
+    """
+    Bounding boxes of stroked paths, vectorized over all paths.
+
+    :param coords: one flat coordinate tuple per path: (x1, y1, x2, y2, ...)
+    :param half_width: half of the stroke-width
+    :param closed: if True, the last point connects back to the first point (polygons)
+    :return: float array of shape (len(coords), 4): x, y, width, height
+    """
+    n_paths = len(coords)
+    n_points = np.array([len(c) // 2 for c in coords])
+    owner = np.repeat(np.arange(n_paths), n_points)
+    points = np.fromiter((c for path in coords for c in path), dtype=float, count=2 * n_points.sum()).reshape(-1, 2)
+
+    # drop repeated points, they would create segments without direction
+    first = np.ones(len(points), dtype=bool)
+    first[1:] = owner[1:] != owner[:-1]
+    keep = first.copy()
+    keep[1:] |= np.any(points[1:] != points[:-1], axis=1)
+    points, owner = points[keep], owner[keep]
+    n_points = np.bincount(owner, minlength=n_paths)
+    start = np.cumsum(n_points) - n_points
+    if closed:  # polygon may repeat its first point at the end
+        last = start + n_points - 1
+        repeated = (n_points > 1) & np.all(points[last] == points[start], axis=1)
+        points, owner = np.delete(points, last[repeated], axis=0), np.delete(owner, last[repeated])
+        n_points = np.bincount(owner, minlength=n_paths)
+        start = np.cumsum(n_points) - n_points
+
+    # segment i goes from point i to point nxt[i], -1 means no segment starts at point i
+    index = np.arange(len(points))
+    nxt = index + 1
+    is_last = nxt == (start + n_points)[owner]
+    nxt[is_last] = start[owner[is_last]] if closed else -1
+    nxt[n_points[owner] < 2] = -1
+    seg = np.flatnonzero(nxt >= 0)
+    a, b = points[seg], points[nxt[seg]]
+    direction = b - a
+    normal = np.stack([-direction[:, 1], direction[:, 0]], axis=1) / np.hypot(*direction.T)[:, None]
+
+    # candidate points: vertices, the corners of each segment's stroke and the tips of miter joins
+    candidates = [points, a + half_width * normal, a - half_width * normal, b + half_width * normal, b - half_width * normal]
+    candidate_owner = [owner] + [owner[seg]] * 4
+
+    seg_starting_at = np.full(len(points), -1)
+    seg_starting_at[seg] = np.arange(len(seg))
+    following = seg_starting_at[nxt[seg]]
+    joined = np.flatnonzero(following >= 0)
+    n1, n2 = normal[joined], normal[following[joined]]
+    denominator = 1 + np.einsum('ij,ij->i', n1, n2)
+    # miter length / stroke-width = 1 / sin(theta / 2) = sqrt(2 / denominator)
+    within_limit = denominator > 2 / MITER_LIMIT ** 2
+    joined, n1, n2, denominator = joined[within_limit], n1[within_limit], n2[within_limit], denominator[within_limit]
+    miter = half_width * (n1 + n2) / denominator[:, None]
+    candidates += [b[joined] + miter, b[joined] - miter]
+    candidate_owner += [owner[seg][joined]] * 2
+
+    candidates, candidate_owner = np.concatenate(candidates), np.concatenate(candidate_owner)
+    lower = np.full((n_paths, 2), np.inf)
+    upper = np.full((n_paths, 2), -np.inf)
+    np.minimum.at(lower, candidate_owner, candidates)
+    np.maximum.at(upper, candidate_owner, candidates)
+    return np.concatenate([lower, upper - lower], axis=1)
@@ -0,0 +1,84 @@
+import os
+import pickle
+import logging
+
+from kegg_map_wizard.kegg_utils import png_sidecar_path
+from kegg_map_wizard.kegg_download import rest_files, rest_data_path, map_conf_path, map_png_path, map_cache_path
+
+CACHE_VERSION = 5  # increase whenever KeggMap, KeggShape or KeggAnnotation change in an incompatible way
+
+
+def fingerprint(path: str) -> (int, int):
+    """
+    Cheap fingerprint of a file: modification time and size, None if the file does not exist.
+    """
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+def cache_key(orgs: [str], map_id: str) -> dict:
+    """
+    Everything a cached KeggMap depends on: the versions of the cache format, the map, the organisms and the
+    fingerprints of all source files (map confs, png and the REST files used to look up descriptions).
+    """
+    sources = [map_conf_path(org, map_id) for org in orgs]
+    sources.append(png_sidecar_path(map_png_path(map_id)))
+    sources.extend(rest_data_path(file) for file in rest_files(orgs))
+    return dict(
+        version=CACHE_VERSION,
+        map_id=map_id,
+        orgs=list(orgs),
+        sources={path: fingerprint(path) for path in sources}
+    )
+
+
+def load_map(orgs: [str], map_id: str):  # -> KeggMap or None
+    """
+    Load a precompiled KeggMap from the cache.
+
+    :return: KeggMap if a valid cache entry exists, None otherwise
+    """
+    cache_path = map_cache_path('+'.join(orgs), map_id)
+    if not os.path.isfile(cache_path):
+        return None
+
+    try:
+        with open(cache_path, 'rb') as f:
+            if pickle.load(f) != cache_key(orgs, map_id):
+                return None  # outdated
+            return pickle.load(f)
+    except Exception as e:
+        logging.warning(f'Failed to load cached map {cache_path}: {e}')
+        return None
+
+
+def save_map(map) -> None:
+    """
+    Save a KeggMap to the cache. The cache key is stored first so that outdated entries can be detected
+    without unpickling the map.
+    """
+    cache_path = map_cache_path(map.org_string, map.map_id)
+    os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+    tmp_path = f'{cache_path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'wb') as f:
+        pickle.dump(cache_key(map.orgs, map.map_id), f, protocol=pickle.HIGHEST_PROTOCOL)
+        pickle.dump(map, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, cache_path)  # atomic: parallel workers never read half-written files
+
+
+def clear_cache(map_ids: [str] = None) -> None:
+    """
+    Remove cached maps of all organism combinations.
+
+    :param map_ids: maps to remove, all maps if None
+    """
+    cache_dir = os.path.dirname(os.path.dirname(map_cache_path('org', '00000')))
+    if not os.path.isdir(cache_dir):
+        return
+    for org_string in os.listdir(cache_dir):
+        for filename in os.listdir(f'{cache_dir}/{org_string}'):
+            if map_ids is None or filename.removesuffix('.pickle') in map_ids:
+                os.remove(f'{cache_dir}/{org_string}/{filename}')
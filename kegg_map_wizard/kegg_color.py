@@ -0,0 +1,329 @@
+"""
+Batch colouring of KeggMaps.
+
+All colouring modes of PathwaySvgLib.js (highlightBinary, highlightContinuous, highlightOrganisms and
+highlightGroupsOfOrganisms) are computed server-side in one pass over a sparse shape x annotation incidence
+matrix. Colour scales follow chroma.js 2.1: lch scales (calcColorArray) and lrgb mixing (chroma.mix).
+
+The result is a Coloring: fills and definitions keyed by shape.hash, which can be passed to
+SvgSkeleton.render(*coloring) or used as color_function.
+"""
+from typing import NamedTuple
+
+import numpy as np
+
+from kegg_map_wizard.ColorMaker import ColorMaker
+
+# constants of chroma.js (D65 illuminant)
+LAB_XN, LAB_YN, LAB_ZN = 0.950470, 1., 1.088830
+LAB_T0, LAB_T1, LAB_T2, LAB_T3 = 0.137931034, 0.206896552, 0.12841855, 0.008856452
+
+RGB_TO_XYZ = np.array([
+    [0.4124564, 0.3575761, 0.1804375],
+    [0.2126729, 0.7151522, 0.0721750],
+    [0.0193339, 0.1191920, 0.9503041],
+])
+XYZ_TO_RGB = np.array([
+    [3.2404542, -1.5371385, -0.4985314],
+    [-0.9692660, 1.8760108, 0.0415560],
+    [0.0556434, -0.2040259, 1.0572252],
+])
+
+
+class Coloring(NamedTuple):
+    """
+    Colours of the shapes of a map.
+    """
+    fills: {str: str}  # shape.hash -> colour
+    defs: {str: str}  # shape.hash -> definition, e.g. a linearGradient
+
+    def color_function(self, shape) -> str:
+        """
+        Use the coloring like a regular color_function, e.g. map.svg(color_function=coloring.color_function)
+        """
+        shape.definition = self.defs.get(shape.hash)
+        return self.fills.get(shape.hash, 'transparent')
+
+
+def parse_colors(colors: [str]) -> np.ndarray:
+    """
+    :param colors: CSS colours, e.g. 'red', '#ff0000', 'rgb(255,0,0)' or 'transparent'
+    :return: array of shape (n, 4): red, green, blue (0-255) and alpha (0-1)
+    """
+    from PIL import ImageColor
+    rgba = np.empty((len(colors), 4))
+    for i, color in enumerate(colors):
+        if color == 'transparent':
+            rgba[i] = 0, 0, 0, 0
+            continue
+        try:
+            value = ImageColor.getrgb(color)
+        except ValueError as e:
+            e.args = tuple([f'Unknown color: {color!r}'])
+            raise e
+        rgba[i, :3] = value[:3]
+        rgba[i, 3] = value[3] / 255 if len(value) == 4 else 1.
+    return rgba
+
+
+def to_hex(rgba: np.ndarray) -> [str]:
+    """
+    Format colours like chroma.js' hex(): #rrggbb, or #rrggbbaa if not opaque.
+    """
+    rgb = np.clip(np.round(rgba[:, :3]), 0, 255).astype(int)
+    alpha = np.clip(np.round(rgba[:, 3] * 255), 0, 255).astype(int)
+    return [
+        f'#{r:02x}{g:02x}{b:02x}' if a == 255 else f'#{r:02x}{g:02x}{b:02x}{a:02x}'
+        for (r, g, b), a in zip(rgb.tolist(), alpha.tolist())
+    ]
+
+
+def rgb_to_lch(rgb: np.ndarray) -> np.ndarray:
+    """
+    :param rgb: array of shape (n, 3), 0-255
+    :return: array of shape (n, 3): lightness, chroma and hue (NaN for achromatic colours)
+    """
+    linear = rgb / 255
+    linear = np.where(linear <= 0.04045, linear / 12.92, ((linear + 0.055) / 1.055) ** 2.4)
+    xyz = linear @ RGB_TO_XYZ.T / [LAB_XN, LAB_YN, LAB_ZN]
+    x, y, z = np.where(xyz > LAB_T3, np.cbrt(xyz), xyz / LAB_T2 + LAB_T0).T
+    lightness, a, b = 116 * y - 16, 500 * (x - y), 200 * (y - z)
+    chroma = np.hypot(a, b)
+    hue = (np.degrees(np.arctan2(b, a)) + 360) % 360
+    hue[np.round(chroma * 10000) == 0] = np.nan
+    return np.stack([lightness, chroma, hue], axis=1)
+
+
+def lch_to_rgb(lch: np.ndarray) -> np.ndarray:
+    """
+    Inverse of rgb_to_lch, the result is not clipped.
+    """
+    lightness, chroma, hue = lch.T
+    hue = np.radians(np.nan_to_num(hue))
+    a, b = chroma * np.cos(hue), chroma * np.sin(hue)
+    y = (lightness + 16) / 116
+    xyz = np.stack([y + a / 500, y, y - b / 200], axis=1)
+    xyz = np.where(xyz > LAB_T1, xyz ** 3, LAB_T2 * (xyz - LAB_T0)) * [LAB_XN, LAB_YN, LAB_ZN]
+    linear = xyz @ XYZ_TO_RGB.T
+    return 255 * np.where(linear <= 0.00304, 12.92 * linear, 1.055 * np.abs(linear) ** (1 / 2.4) - 0.055)
+
+
+def interpolate(color_0: str, color_1: str, ratios, mode: str = 'lrgb') -> [str]:
+    """
+    Interpolate between two colours like chroma.mix(color_0, color_1, ratio, mode), for many ratios at once.
+
+    :param ratios: numbers between 0 and 1
+    :param mode: 'rgb', 'lrgb' or 'lch'
+    :return: list of hex colours
+    """
+    ratios = np.clip(np.asarray(ratios, dtype=float), 0, 1)[:, None]
+    rgba_0, rgba_1 = parse_colors([color_0, color_1])
+    alpha = rgba_0[3] + ratios[:, 0] * (rgba_1[3] - rgba_0[3])
+
+    if mode == 'rgb':
+        rgb = rgba_0[:3] + ratios * (rgba_1[:3] - rgba_0[:3])
+    elif mode == 'lrgb':
+        rgb = np.sqrt(rgba_0[:3] ** 2 * (1 - ratios) + rgba_1[:3] ** 2 * ratios)
+    elif mode == 'lch':
+        (l_0, c_0, h_0), (l_1, c_1, h_1) = rgb_to_lch(np.stack([rgba_0[:3], rgba_1[:3]]))
+        if np.isnan(h_0) and np.isnan(h_1):
+            h_0 = h_1 = 0.
+        elif np.isnan(h_0):
+            h_0 = h_1
+            c_0 = c_1 if l_0 in (0, 1) else c_0
+        elif np.isnan(h_1):
+            h_1 = h_0
+            c_1 = c_0 if l_1 in (0, 1) else c_1
+        # take the shorter way around the colour wheel
+        d_hue = h_1 - h_0
+        if d_hue > 180:
+            d_hue -= 360
+        elif d_hue < -180:
+            d_hue += 360
+        lch = np.stack([
+            l_0 + ratios[:, 0] * (l_1 - l_0),
+            c_0 + ratios[:, 0] * (c_1 - c_0),
+            h_0 + ratios[:, 0] * d_hue
+        ], axis=1)
+        rgb = lch_to_rgb(lch)
+    else:
+        raise AssertionError(f'Unknown interpolation mode: {mode!r}')
+
+    return to_hex(np.column_stack([rgb, alpha]))
+
+
+def scale(colors: [str], n: int, mode: str = 'lch') -> [str]:
+    """
+    Equivalent of chroma.scale([color_0, color_1]).mode(mode).colors(n)
+    """
+    assert len(colors) == 2, f'scale only supports two colours: {colors}'
+    ratios = [0.5] if n == 1 else np.linspace(0, 1, n)
+    return interpolate(colors[0], colors[1], ratios, mode=mode)
+
+
+def calc_color_array(n_steps: int, colors: [str]) -> [str]:
+    """
+    Equivalent of calcColorArray in PathwaySvgLib.js.
+
+    :param n_steps: number of organisms
+    :param colors: three or four colours: not covered, first and last step of the scale, (covered by all)
+    :return: list of n_steps + 1 colours, index = number of covering organisms
+    """
+    if n_steps == 1:
+        return [colors[0], colors[-1]]
+    elif len(colors) == 4:
+        return [colors[0]] + scale(colors[1:3], n_steps - 1) + [colors[3]]
+    else:
+        return [colors[0]] + scale(colors[1:3], n_steps)
+
+
+class Incidence:
+    """
+    Sparse shape x annotation incidence matrix of a map.
+
+    matrix[i, j] is the 1-based position of annotation j among the annotations of shape i, 0 if not annotated.
+    """
+
+    def __init__(self, shapes):
+        from scipy import sparse  # imported on first use, it is slow to import
+        self.shapes = list(shapes)
+        self.shape_ids = [shape.hash for shape in self.shapes]
+        self.annotation_index: {str: int} = {}
+        rows, cols, data = [], [], []
+        for row, shape in enumerate(self.shapes):
+            for position, annotation in enumerate(shape.annotations.values(), start=1):
+                rows.append(row)
+                cols.append(self.annotation_index.setdefault(annotation.name, len(self.annotation_index)))
+                data.append(position)
+        self.matrix = sparse.csr_matrix(
+            (np.array(data, dtype=np.int32), (rows, cols)),
+            shape=(len(self.shapes), len(self.annotation_index))
+        )
+        self.binary = (self.matrix > 0).astype(np.int32)
+
+    def __repr__(self):
+        return f'<Incidence: {len(self.shapes)} shapes x {len(self.annotation_index)} annotations>'
+
+    def annotation_vector(self, annotations) -> np.ndarray:
+        """
+        :return: boolean vector over the columns of the matrix, unknown annotations are ignored
+        """
+        vector = np.zeros(len(self.annotation_index), dtype=bool)
+        vector[[self.annotation_index[a] for a in annotations if a in self.annotation_index]] = True
+        return vector
+
+    def organism_matrix(self, organisms: {str: [str]}):  # -> scipy.sparse.csc_matrix
+        """
+        :param organisms: dictionary: organism -> annotations
+        :return: sparse annotation x organism matrix
+        """
+        from scipy import sparse
+        rows, cols = [], []
+        for col, annotations in enumerate(organisms.values()):
+            for annotation in set(annotations):
+                if annotation in self.annotation_index:
+                    rows.append(self.annotation_index[annotation])
+                    cols.append(col)
+        return sparse.csc_matrix(
+            (np.ones(len(rows), dtype=np.int32), (rows, cols)),
+            shape=(len(self.annotation_index), len(organisms))
+        )
+
+    def covering_counts(self, organisms: {str: [str]}) -> np.ndarray:
+        """
+        :return: for each shape, the number of organisms that have at least one of its annotations
+        """
+        covered = self.binary @ self.organism_matrix(organisms)
+        covered.eliminate_zeros()
+        return covered.getnnz(axis=1)
+
+    def fills(self, colors: [str], mask: np.ndarray = None) -> {str: str}:
+        """
+        :param colors: one colour per shape
+        :param mask: boolean vector, only include these shapes
+        """
+        if mask is None:
+            return dict(zip(self.shape_ids, colors))
+        return {shape_id: color for shape_id, color, m in zip(self.shape_ids, colors, mask) if m}
+
+
+def color_binary(incidence: Incidence, annotations: [str], color: str = 'red', default: str = 'transparent') -> Coloring:
+    """
+    Equivalent of highlightBinary: colour shapes that have any of the annotations.
+    """
+    covered = incidence.binary @ incidence.annotation_vector(annotations).astype(np.int32) > 0
+    palette = np.array([default, color], dtype=object)
+    return Coloring(fills=incidence.fills(palette[covered.astype(int)]), defs={})
+
+
+def color_continuous(incidence: Incidence, annotation_to_number: {str: float}, colors: [str] = ('yellow', 'red'),
+                     mode: str = 'lrgb') -> Coloring:
+    """
+    Equivalent of highlightContinuous: colour shapes by a number between 0 and 1.
+    If a shape has several annotations with a number, the last one counts. Other shapes are not coloured.
+    """
+    if not incidence.annotation_index:
+        return Coloring(fills={}, defs={})
+
+    from scipy import sparse
+    values = np.full(len(incidence.annotation_index), np.nan)
+    for annotation, number in annotation_to_number.items():
+        if annotation in incidence.annotation_index:
+            values[incidence.annotation_index[annotation]] = number
+
+    # keep only annotations with numbers, then pick the one with the highest position in each shape
+    matrix = incidence.matrix @ sparse.diags((~np.isnan(values)).astype(np.int32), dtype=np.int32)
+    matrix.eliminate_zeros()
+    has_value = matrix.getnnz(axis=1) > 0
+    last = np.asarray(matrix.argmax(axis=1)).ravel()
+
+    shape_colors = np.empty(len(incidence.shapes), dtype=object)
+    shape_colors[has_value] = interpolate(colors[0], colors[1], values[last[has_value]], mode=mode)
+    return Coloring(fills=incidence.fills(shape_colors, mask=has_value), defs={})
+
+
+def color_organisms(incidence: Incidence, organisms: {str: [str]},
+                    colors: [str] = ('transparent', 'yellow', 'red', 'green')) -> Coloring:
+    """
+    Equivalent of highlightOrganisms: colour shapes by how many organisms have their annotations.
+
+    :param organisms: dictionary: organism -> annotations
+    """
+    palette = np.array(calc_color_array(len(organisms), list(colors)), dtype=object)
+    return Coloring(fills=incidence.fills(palette[incidence.covering_counts(organisms)]), defs={})
+
+
+def color_groups(incidence: Incidence, groups: {str: {str: [str]}},
+                 colors: [str] = ('transparent', 'yellow', 'red', 'green')) -> Coloring:
+    """
+    Equivalent of highlightGroupsOfOrganisms: colour shapes by how many organisms of each group have their
+    annotations, with one horizontal stripe per group. Requires bounding boxes.
+
+    :param groups: dictionary: group -> organism -> annotations
+    """
+    if len(groups) == 1:
+        return color_organisms(incidence, next(iter(groups.values())), colors=colors)
+
+    palettes = [calc_color_array(len(organisms), list(colors)) for organisms in groups.values()]
+    counts = np.column_stack([incidence.covering_counts(organisms) for organisms in groups.values()])
+
+    # shapes with the same counts share their colours: compute each combination once
+    combinations, inverse = np.unique(counts, axis=0, return_inverse=True)
+    combination_colors = [[palette[c] for palette, c in zip(palettes, row)] for row in combinations.tolist()]
+    combination_stops = [
+        None if len(set(group_colors)) == 1 else ColorMaker.svg_stops(group_colors)
+        for group_colors in combination_colors
+    ]
+
+    fills, defs = {}, {}
+    for shape, shape_id, i in zip(incidence.shapes, incidence.shape_ids, inverse.ravel().tolist()):
+        stops = combination_stops[i]
+        if stops is None:  # all groups have the same colour, no gradient necessary
+            fills[shape_id] = combination_colors[i][0]
+            continue
+        assert shape.bbox is not None, f'Bounding box of {shape} is not loaded!'
+        fills[shape_id] = f'url(#{shape_id})'
+        defs[shape_id] = ColorMaker.GRADIENT_TEMPLATE.format(
+            id=shape_id, x1=shape.bbox.x1, x2=shape.bbox.x2, stops=stops
+        )
+    return Coloring(fills=fills, defs=defs)
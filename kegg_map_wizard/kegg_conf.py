@@ -0,0 +1,278 @@
+"""
+Columnar parser for KEGG .conf files.
+
+A .conf file has one shape per line: geometry, annotations-url and description, separated by tabs:
+
+    rect (259,192) (305,209)	/dbget-bin/www_bget?K00844+K12407	K00844...
+    circ (246,236) 4	/dbget-bin/www_bget?C00031	C00031 (D-Glucose)
+
+parse_conf tokenizes the whole file at once into a ShapeTable: typed NumPy arrays (shape kind, offsets into a flat
+int32 coordinate buffer, radius) plus an annotation-reference column that points into the unique urls of the file.
+KeggShape objects are only created on demand, see ShapeTable.shape.
+
+The .conf files of the organisms of a map mostly contain the same geometry. ShapeAssembly parses it only once and
+aligns the annotation columns of the other files by raw position.
+"""
+import re
+from typing import Iterator, NamedTuple
+
+import numpy as np
+
+CIRCLE, RECT, POLY, LINE = range(4)
+
+_GEOMETRY = r'(?:(?:circle|filled_circ|circ) \(\d+,\d+\) \d+' \
+            r'|rect \(\d+,\d+\) \(\d+,\d+\)' \
+            r'|poly \(\d+(?:,\d+)*\)' \
+            r'|line \(\d+(?:,\d+)+\) \d+)'
+RE_GEOMETRY = re.compile(_GEOMETRY)
+RE_GEOMETRIES = re.compile(rf'{_GEOMETRY}(?:\n{_GEOMETRY})*')  # all raw positions of a file, joined by newlines
+KIND_BY_FIRST_CHAR = np.zeros(256, dtype=np.uint8)
+KIND_BY_FIRST_CHAR[[ord('c'), ord('f'), ord('r'), ord('p'), ord('l')]] = CIRCLE, CIRCLE, RECT, POLY, LINE
+NON_DIGITS = str.maketrans({c: ' ' for c in '(),abcdefghijklmnopqrstuvwxyz_'})
+
+
+class ShapeTable:
+    """
+    The shapes of a .conf file as columns.
+
+    Coordinates are stored as rendered (see KeggShape.points):
+      - circle: cx, cy, r
+      - rect: x, y, width, height (rects larger than 46x17 are moved by 1 pixel, like in Rect.calc_geometry)
+      - poly/line: x1, y1, x2, y2, ...
+    The trailing number of lines (e.g. the 2 in 'line (138,907,158,907) 2') is stored in radius,
+    as is the radius of circles.
+    """
+
+    def __init__(self, kinds: np.ndarray, offsets: np.ndarray, coords: np.ndarray, radius: np.ndarray,
+                 url_index: np.ndarray, urls: [str], raw_positions: [str], descriptions: [str]):
+        self.kinds = kinds  # uint8, see CIRCLE, RECT, POLY, LINE
+        self.offsets = offsets  # int64, len(self) + 1: coordinates of shape i are coords[offsets[i]:offsets[i + 1]]
+        self.coords = coords  # int32, flat coordinate buffer
+        self.radius = radius  # int32
+        self.url_index = url_index  # int32: annotations-url of shape i is urls[url_index[i]]
+        self.urls = urls  # unique annotations-urls, in order of appearance
+        self.raw_positions = raw_positions
+        self.descriptions = descriptions
+
+    def __repr__(self):
+        return f'<ShapeTable: {len(self)} shapes, {len(self.urls)} urls>'
+
+    def __len__(self):
+        return len(self.kinds)
+
+    def points(self, i: int) -> np.ndarray:
+        return self.coords[self.offsets[i]:self.offsets[i + 1]]
+
+    def shape(self, i: int, annotations: {(str, str): object}):  # -> KeggShape
+        """
+        Materialize shape i.
+
+        :param annotations: annotations of the shape, e.g. resolved from urls[url_index[i]]
+        """
+        from kegg_map_wizard.KeggShape import KeggShape
+        raw_position = self.raw_positions[i]
+        return KeggShape.from_points(
+            shape_type=raw_position.split(' ', maxsplit=1)[0],
+            points=self.points(i),
+            description=self.descriptions[i],
+            raw_position=raw_position,
+            annotations=annotations
+        )
+
+    def iter_shapes(self, url_annotations: [{(str, str): object}]) -> Iterator:
+        """
+        :param url_annotations: annotations of each url in urls
+        :return: iterator over all shapes, materialized one by one
+        """
+        for i, url in enumerate(self.url_index.tolist()):
+            yield self.shape(i, annotations=dict(url_annotations[url]))
+
+
+class ConfColumns(NamedTuple):
+    """
+    The columns of a .conf file as strings, without parsing the geometry.
+    """
+    raw_positions: [str]
+    url_index: np.ndarray  # int32: annotations-url of line i is urls[url_index[i]]
+    urls: [str]  # unique annotations-urls, in order of appearance
+    descriptions: [str]
+
+    def __len__(self):
+        return len(self.raw_positions)
+
+    def select(self, lines: [int]):  # -> ConfColumns
+        """
+        :return: ConfColumns with only these lines, urls are kept as they are
+        """
+        return ConfColumns(
+            raw_positions=[self.raw_positions[i] for i in lines],
+            url_index=self.url_index[lines],
+            urls=self.urls,
+            descriptions=[self.descriptions[i] for i in lines]
+        )
+
+
+class ShapeAssembly:
+    """
+    The shapes of a map, assembled from the .conf files of several organisms.
+
+    Every distinct raw position is parsed once: the first .conf file is parsed into a ShapeTable, later files only
+    add the lines with new raw positions to the geometry. Their annotation columns are stored as layers, aligned by
+    raw position, and merged when the shapes are materialized.
+    """
+
+    def __init__(self):
+        self.tables: [ShapeTable] = []  # geometry of all distinct raw positions
+        self.rows: {str: int} = {}  # raw position -> row, in order of appearance
+        self.locations: [(int, int)] = []  # row -> (table, line)
+        self.layers: [(np.ndarray, np.ndarray, [list])] = []  # per .conf file: row and url of each line, url annotations
+
+    def __repr__(self):
+        return f'<ShapeAssembly: {len(self)} shapes from {len(self.layers)} files>'
+
+    def __len__(self):
+        return len(self.rows)
+
+    def add(self, columns: ConfColumns, url_annotations: [[((str, str), object)]]) -> None:
+        """
+        :param columns: see read_conf_columns
+        :param url_annotations: annotations of each url in columns.urls, as (key, annotation) pairs
+        """
+        rows = np.empty(len(columns), dtype=np.int64)
+        new_lines = []
+        for i, raw_position in enumerate(columns.raw_positions):
+            row = self.rows.get(raw_position)
+            if row is None:
+                row = self.rows[raw_position] = len(self.rows)
+                new_lines.append(i)
+            rows[i] = row
+
+        if new_lines:
+            table = shape_table(columns if len(new_lines) == len(columns) else columns.select(new_lines))
+            self.locations.extend((len(self.tables), line) for line in range(len(table)))
+            self.tables.append(table)
+
+        self.layers.append((rows, columns.url_index, url_annotations))
+
+    def iter_shapes(self) -> Iterator:
+        """
+        :return: iterator over all shapes in order of appearance; the annotations of shapes with the same raw
+            position are merged, the first file wins
+        """
+        annotations = [{} for _ in self.locations]
+        for rows, url_index, url_annotations in self.layers:
+            for row, url in zip(rows.tolist(), url_index.tolist()):
+                row_annotations = annotations[row]
+                for key, annotation in url_annotations[url]:
+                    row_annotations.setdefault(key, annotation)
+
+        for (table, line), row_annotations in zip(self.locations, annotations):
+            yield self.tables[table].shape(line, annotations=row_annotations)
+
+
+def parse_conf(path: str) -> ShapeTable:
+    """
+    Parse a .conf file into a ShapeTable. Malformed files raise an AssertionError that names the offending line.
+    """
+    return shape_table(read_conf_columns(path))
+
+
+def parse_conf_text(text: str) -> ShapeTable:
+    return shape_table(conf_columns(text))
+
+
+def read_conf_columns(path: str) -> ConfColumns:
+    with open(path) as f:
+        return conf_columns(f.read())
+
+
+def conf_columns(text: str) -> ConfColumns:
+    """
+    Split a .conf file into its columns. Only the structure of the file is checked, not the geometry.
+    """
+    text = text.rstrip('\n')
+
+    # every line must have exactly three columns: the separators must be tab, tab, newline, tab, tab, newline, ...
+    separators = np.frombuffer(text.encode('utf-8'), dtype=np.uint8)
+    separators = separators[(separators == ord('\t')) | (separators == ord('\n'))]
+    expected = np.resize(np.array([ord('\t'), ord('\t'), ord('\n')], dtype=np.uint8), len(separators) // 3 * 3 + 2)
+    if text and not np.array_equal(separators, expected):
+        bad = next(line for line in text.split('\n') if line.count('\t') != 2)
+        raise AssertionError(f'Line does not have three tab-separated columns: {bad!r}')
+
+    fields = text.replace('\n', '\t').split('\t') if text else []
+    raw_positions, urls = fields[0::3], fields[1::3]
+    unique_urls = {url: i for i, url in enumerate(dict.fromkeys(urls))}
+
+    return ConfColumns(
+        raw_positions=raw_positions,
+        url_index=np.fromiter(map(unique_urls.__getitem__, urls), dtype=np.int32, count=len(urls)),
+        urls=list(unique_urls),
+        descriptions=[description.rstrip() for description in fields[2::3]]
+    )
+
+
+def shape_table(columns: ConfColumns) -> ShapeTable:
+    """
+    Parse the geometry of ConfColumns into a ShapeTable.
+    """
+    raw_positions = columns.raw_positions
+    n = len(raw_positions)
+
+    geometries = '\n'.join(raw_positions)
+    if RE_GEOMETRIES.fullmatch(geometries) is None and n:
+        bad = next(p for p in raw_positions if RE_GEOMETRY.fullmatch(p) is None)
+        raise AssertionError(f'Line does not match any type: {bad!r}')
+
+    # per-character view of all raw positions, separated by newlines
+    chars = np.frombuffer(geometries.encode('ascii'), dtype=np.uint8)
+    line_starts = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum(np.fromiter(map(len, raw_positions), dtype=np.int64, count=n) + 1, out=line_starts[1:])
+    kinds = KIND_BY_FIRST_CHAR[chars[line_starts[:-1]]] if n else np.zeros(0, dtype=np.uint8)
+    commas = np.zeros(len(chars) + 1, dtype=np.int64)
+    np.cumsum(chars == ord(','), out=commas[1:])
+    tokens = np.fromstring(geometries.translate(NON_DIGITS), dtype=np.int32, sep=' ') if n else np.zeros(0, np.int32)
+
+    # number of integers per raw position: commas + 1 for polys, commas + 2 for all others
+    n_tokens = np.diff(commas[np.minimum(line_starts, len(chars))]) + np.where(kinds == POLY, 1, 2)
+    token_offsets = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum(n_tokens, out=token_offsets[1:])
+    assert token_offsets[-1] == len(tokens), 'Failed to tokenize conf file'
+
+    odd = ((kinds == POLY) | (kinds == LINE)) & ((n_tokens - (kinds == LINE)) % 2 == 1)
+    if odd.any():
+        raise AssertionError(f'number of polygon coordinates must be even! {raw_positions[int(np.argmax(odd))]}')
+
+    # the trailing number of lines goes to radius, as does the radius of circles
+    radius = np.zeros(n, dtype=np.int32)
+    last_token = token_offsets[1:] - 1
+    is_line = kinds == LINE
+    radius[is_line] = tokens[last_token[is_line]]
+    is_circle = kinds == CIRCLE
+    radius[is_circle] = tokens[last_token[is_circle]]
+    keep = np.ones(len(tokens), dtype=bool)
+    keep[last_token[is_line]] = False
+    coords = tokens[keep]
+
+    offsets = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum(n_tokens - is_line, out=offsets[1:])
+
+    # rects: (x1, y1) (x2, y2) -> x, y, width, height
+    rects = np.flatnonzero(kinds == RECT)
+    if len(rects):
+        index = offsets[rects][:, None] + np.arange(4)
+        x, y, x2, y2 = coords[index].T
+        width, height = x2 - x, y2 - y
+        adjust = (width > 46) & (height > 17)  # minor adjustment, see Rect.calc_geometry
+        coords[index] = np.stack([x + adjust, y + adjust, width, height], axis=1)
+
+    return ShapeTable(
+        kinds=kinds,
+        offsets=offsets,
+        coords=coords,
+        radius=radius,
+        url_index=columns.url_index,
+        urls=columns.urls,
+        raw_positions=raw_positions,
+        descriptions=columns.descriptions
+    )
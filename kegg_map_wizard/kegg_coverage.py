@@ -0,0 +1,179 @@
+"""
+Genome x map coverage: the fraction of the (enzyme) shapes of each map that are covered by the annotations of a
+genome, i.e. what highlightOrganisms in PathwaySvgLib.js shows for one map at a time, for many genomes at once.
+
+A CoverageCatalogue holds a sparse annotation x shape matrix of all maps and a shape x map matrix. The coverage of
+a chunk of genomes is then two sparse matrix products:
+
+    covered shapes = (genomes x annotations) @ (annotations x shapes) > 0
+    coverage = (covered shapes @ (shapes x maps)) / shapes per map
+"""
+import os
+import pickle
+from itertools import islice, groupby
+from typing import Iterable, Iterator
+
+import numpy as np
+
+
+class CoverageCatalogue:
+    def __init__(self, maps: Iterable, html_class: str = 'enzyme'):
+        """
+        :param maps: KeggMaps, e.g. from KeggMapWizard.create_maps
+        :param html_class: only count shapes of this class ('enzyme', 'compound', ...); None: count all shapes
+        """
+        from scipy import sparse  # imported on first use, it is slow to import
+        self.html_class = html_class
+        self.map_ids: [str] = []
+        self.shape_keys: [(str, str)] = []  # (map_id, raw_position)
+        self.annotation_index: {str: int} = {}
+
+        rows, cols, shape_maps = [], [], []
+        for map in sorted(maps, key=lambda m: m.map_id):
+            shapes = [
+                shape for shape in map.shapes.values()
+                if shape.annotations and (html_class is None or html_class in shape.classes())
+            ]
+            if not shapes:
+                continue  # coverage would be undefined
+            map_index = len(self.map_ids)
+            self.map_ids.append(map.map_id)
+            for shape in shapes:
+                shape_index = len(self.shape_keys)
+                self.shape_keys.append((map.map_id, shape.raw_position))
+                shape_maps.append(map_index)
+                for annotation in shape.annotations.values():
+                    rows.append(self.annotation_index.setdefault(annotation.name, len(self.annotation_index)))
+                    cols.append(shape_index)
+
+        n_annotations, n_shapes, n_maps = len(self.annotation_index), len(self.shape_keys), len(self.map_ids)
+        self.annotation_shapes = sparse.csr_matrix(
+            (np.ones(len(rows), dtype=np.int32), (rows, cols)), shape=(n_annotations, n_shapes)
+        )
+        self.annotation_shapes.sum_duplicates()
+        self.shape_maps = sparse.csr_matrix(
+            (np.ones(n_shapes, dtype=np.int32), (np.arange(n_shapes), shape_maps)), shape=(n_shapes, n_maps)
+        )
+        self.shapes_per_map = np.bincount(shape_maps, minlength=n_maps)
+
+    def __repr__(self):
+        return f'<CoverageCatalogue: {len(self.map_ids)} maps, {len(self.shape_keys)} shapes, ' \
+               f'{len(self.annotation_index)} annotations>'
+
+    def genome_matrix(self, genomes: [(str, Iterable[str])]):  # -> scipy.sparse.csr_matrix
+        """
+        :param genomes: list of (genome name, annotations), annotations that occur on no map are ignored
+        :return: sparse genome x annotation matrix
+        """
+        from scipy import sparse
+        rows, cols = [], []
+        for row, (_, annotations) in enumerate(genomes):
+            for annotation in set(annotations):
+                col = self.annotation_index.get(annotation)
+                if col is not None:
+                    rows.append(row)
+                    cols.append(col)
+        return sparse.csr_matrix(
+            (np.ones(len(rows), dtype=np.int32), (rows, cols)), shape=(len(genomes), len(self.annotation_index))
+        )
+
+    def coverage(self, genomes: [(str, Iterable[str])]) -> np.ndarray:
+        """
+        :param genomes: list of (genome name, annotations), e.g. [('genome1', ['K00001', 'K00002', ...]), ...]
+        :return: array of shape (len(genomes), len(map_ids)): fraction of covered shapes
+        """
+        covered = self.genome_matrix(genomes) @ self.annotation_shapes
+        covered.data[:] = 1  # a shape is covered if any of its annotations is present
+        counts = (covered @ self.shape_maps).toarray()
+        return (counts / self.shapes_per_map).astype(np.float32)
+
+    def iter_coverage(
+            self,
+            genomes: Iterable[tuple],
+            chunk_size: int = 1000,
+            workers: int = 1
+    ) -> Iterator[tuple]:
+        """
+        Compute the coverage of a stream of genomes chunk by chunk, optionally in parallel.
+
+        :param genomes: iterable of (genome name, annotations), e.g. from read_genome_annotations
+        :param chunk_size: number of genomes per chunk
+        :param workers: number of processes; None: number of CPUs
+        :return: iterator over (genome names, coverage array), in input order
+        """
+        chunks = _chunks(genomes, chunk_size)
+        if workers == 1:
+            for chunk in chunks:
+                yield [name for name, _ in chunk], self.coverage(chunk)
+            return
+
+        import multiprocessing
+        with multiprocessing.Pool(processes=workers, initializer=_init_coverage_worker, initargs=(self,)) as pool:
+            yield from pool.imap(_coverage_worker, chunks)
+
+    def coverage_table(self, genomes: Iterable[tuple], chunk_size: int = 1000, workers: int = 1) -> ([str], np.ndarray):
+        """
+        :return: genome names and array of shape (n_genomes, len(map_ids)), see iter_coverage
+        """
+        names, tables = [], []
+        for chunk_names, table in self.iter_coverage(genomes, chunk_size=chunk_size, workers=workers):
+            names.extend(chunk_names)
+            tables.append(table)
+        if not tables:
+            return names, np.zeros((0, len(self.map_ids)), dtype=np.float32)
+        return names, np.vstack(tables)
+
+    def write_tsv(self, out_path: str, genomes: Iterable[tuple], chunk_size: int = 1000, workers: int = 1) -> None:
+        """
+        Stream the coverage table into a TSV file: one row per genome, one column per map.
+        """
+        with open(out_path, 'w') as f:
+            f.write('\t'.join(['genome', *self.map_ids]) + '\n')
+            for names, table in self.iter_coverage(genomes, chunk_size=chunk_size, workers=workers):
+                for name, row in zip(names, table):
+                    f.write('\t'.join([name, *(f'{value:.4g}' for value in row)]) + '\n')
+
+    def save(self, path: str) -> None:
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(self, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str):  # -> CoverageCatalogue
+        with open(path, 'rb') as f:
+            catalogue = pickle.load(f)
+        assert isinstance(catalogue, cls), f'{path} does not contain a {cls.__name__}'
+        return catalogue
+
+
+def read_genome_annotations(path: str) -> Iterator[tuple]:
+    """
+    Stream a TSV file with two columns, genome and annotation (e.g. 'genome1\\tK00001'). The rows of a genome
+    must be consecutive. Additional columns are ignored.
+
+    :return: iterator over (genome name, [annotations])
+    """
+    with open(path) as f:
+        rows = (line.rstrip('\n').split('\t', maxsplit=2)[:2] for line in f if line.strip())
+        for genome, group in groupby(rows, key=lambda row: row[0]):
+            yield genome, [annotation for _, annotation in group]
+
+
+def _chunks(iterable: Iterable, chunk_size: int) -> Iterator[list]:
+    assert chunk_size > 0, f'chunk_size must be positive: {chunk_size}'
+    iterator = iter(iterable)
+    while chunk := list(islice(iterator, chunk_size)):
+        yield chunk
+
+
+_worker_catalogue: CoverageCatalogue = None  # one catalogue per iter_coverage worker process
+
+
+def _init_coverage_worker(catalogue: CoverageCatalogue) -> None:
+    global _worker_catalogue
+    _worker_catalogue = catalogue
+
+
+def _coverage_worker(chunk: list) -> ([str], np.ndarray):
+    return [name for name, _ in chunk], _worker_catalogue.coverage(chunk)
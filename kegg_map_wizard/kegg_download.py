@@ -1,25 +1,93 @@
 import os
-import base64
 from io import BytesIO
-from PIL import Image  # pip install Pillow
 import json
-import cdblib
-import requests
+import hashlib
 import time
-from random import randint
-import multiprocessing
+import threading
 import logging
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from collections import OrderedDict
+from typing import Callable, Iterable, NamedTuple
 
-N_PARALLEL_DOWNLOADS = os.environ.get('KEGG_MAP_WIZARD_PARALLEL', '6')
-assert N_PARALLEL_DOWNLOADS.isdecimal(), f'The environment variable KEGG_MAP_WIZARD_PARALLEL must be decimal. ' \
-                                         f'KEGG_MAP_WIZARD_PARALLEL={N_PARALLEL_DOWNLOADS}'
-N_PARALLEL_DOWNLOADS = int(N_PARALLEL_DOWNLOADS)
+from kegg_map_wizard.kegg_utils import PngSidecar, png_sidecar_path, migrate_png_json
 
-assert 'KEGG_MAP_WIZARD_DATA' in os.environ, \
-    f'Please set the environment variable KEGG_MAP_WIZARD_DATA to the directory where KEGG data will be stored'
-DATA_DIR = os.environ['KEGG_MAP_WIZARD_DATA']
-assert os.path.isdir(DATA_DIR), f'Directory not found: KEGG_MAP_WIZARD_DATA={DATA_DIR}'
-logging.warning(f'Setup: KEGG_MAP_WIZARD_DATA={DATA_DIR}; KEGG_MAP_WIZARD_PARALLEL={N_PARALLEL_DOWNLOADS}')
+# numpy, PIL, requests and multiprocessing are imported where they are needed: importing this module must be cheap
+
+RETRY_STATUS_CODES = {403, 429, 500, 502, 503, 504}
+TIMEOUT = (10, 60)  # seconds to connect and to wait for data of a response, see requests
+KEGG_REST_URL = 'http://rest.kegg.jp'
+KEGG_PNG_URL = 'https://www.genome.jp/kegg/pathway/map'
+
+
+class Settings(NamedTuple):
+    data_dir: str  # KEGG_MAP_WIZARD_DATA
+    n_parallel_downloads: int  # KEGG_MAP_WIZARD_PARALLEL
+    download_rate: float  # KEGG_MAP_WIZARD_RATE
+
+
+_settings: Settings = None  # resolved on first use, see settings()
+_rate_limiter = None  # shared by all downloads of this process, see shared_rate_limiter()
+
+
+def configure(data_dir: str = None, n_parallel_downloads: int = None, download_rate: float = None) -> Settings:
+    """
+    Set up kegg_map_wizard. Arguments that are not given are read from the environment variables
+    KEGG_MAP_WIZARD_DATA, KEGG_MAP_WIZARD_PARALLEL (default: 6) and KEGG_MAP_WIZARD_RATE (default: 2).
+
+    Called automatically the first time a setting is needed, not at import.
+
+    :param data_dir: directory where KEGG data is stored
+    :param n_parallel_downloads: maximal number of concurrent downloads
+    :param download_rate: maximal number of requests per second
+    """
+    global _settings, _rate_limiter
+
+    if data_dir is None:
+        assert 'KEGG_MAP_WIZARD_DATA' in os.environ, \
+            f'Please set the environment variable KEGG_MAP_WIZARD_DATA to the directory where KEGG data will be stored'
+        data_dir = os.environ['KEGG_MAP_WIZARD_DATA']
+    assert os.path.isdir(data_dir), f'Directory not found: KEGG_MAP_WIZARD_DATA={data_dir}'
+
+    if n_parallel_downloads is None:
+        n_parallel_downloads = os.environ.get('KEGG_MAP_WIZARD_PARALLEL', '6')
+        assert n_parallel_downloads.isdecimal(), f'The environment variable KEGG_MAP_WIZARD_PARALLEL must be decimal. ' \
+                                                 f'KEGG_MAP_WIZARD_PARALLEL={n_parallel_downloads}'
+    n_parallel_downloads = int(n_parallel_downloads)
+
+    if download_rate is None:
+        download_rate = os.environ.get('KEGG_MAP_WIZARD_RATE', '2')
+        assert download_rate.replace('.', '', 1).isdecimal() and float(download_rate) > 0, \
+            f'The environment variable KEGG_MAP_WIZARD_RATE must be a positive number (requests per second). ' \
+            f'KEGG_MAP_WIZARD_RATE={download_rate}'
+    download_rate = float(download_rate)
+
+    logging.warning(f'Setup: KEGG_MAP_WIZARD_DATA={data_dir}; KEGG_MAP_WIZARD_PARALLEL={n_parallel_downloads}; '
+                    f'KEGG_MAP_WIZARD_RATE={download_rate}')
+
+    _settings = Settings(data_dir=data_dir, n_parallel_downloads=n_parallel_downloads, download_rate=download_rate)
+    _rate_limiter = None
+    return _settings
+
+
+def settings() -> Settings:
+    return _settings or configure()
+
+
+def data_dir() -> str:
+    return settings().data_dir
+
+
+def __getattr__(name: str):
+    # former module constants, now resolved on first use
+    if name == 'DATA_DIR':
+        return settings().data_dir
+    if name == 'N_PARALLEL_DOWNLOADS':
+        return settings().n_parallel_downloads
+    if name == 'DOWNLOAD_RATE':
+        return settings().download_rate
+    if name == 'RATE_LIMITER':
+        return shared_rate_limiter()
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
 
 
 def split(line: str) -> (str, str):
@@ -29,101 +97,203 @@ def split(line: str) -> (str, str):
         return line, ''
 
 
-def mk_cdb(file: str):
-    cdb_file = file + '.cdb'
-    with open(file) as in_f, open(cdb_file, 'wb') as out_f, cdblib.Writer(out_f) as writer:
-        for line in in_f.readlines():
-            k, v = split(line.strip())
-            writer.put(k.encode('utf-8'), v.encode('utf-8'))
-
+def white_to_transparent(img):  # -> PIL.Image.Image
+    """
+    Make all opaque white pixels of an image fully transparent.
 
-def get_cdb(file: str):
-    cdb_file = file + '.cdb'
-    reader = cdblib.Reader.from_file_path(cdb_file)
-    return reader
+    :param img: PIL Image
+    :return: new PIL Image in RGBA mode
+    """
+    import numpy as np
+    from PIL import Image  # pip install Pillow
+    pixels = np.array(img.convert('RGBA'))
+    pixels[np.all(pixels == 255, axis=2), 3] = 0
+    return Image.fromarray(pixels, 'RGBA')
 
 
-def encode_png(png_path: str) -> None:
-    img = Image.open(png_path)
-    img = img.convert('RGBA')
+def encode_png(png_path: str, sidecar_path: str = None) -> None:
+    """
+    Convert white to transparent and save the result as PngSidecar next to the PNG.
 
-    pixdata = img.load()
+    :param sidecar_path: default: next to png_path
+    """
+    from PIL import Image
+    with Image.open(png_path) as img:
+        img = white_to_transparent(img)
 
     width, height = img.size
 
-    for y in range(height):
-        for x in range(width):
-            if pixdata[x, y] == (255, 255, 255, 255):
-                pixdata[x, y] = (255, 255, 255, 0)
-
     buffer = BytesIO()
     img.save(buffer, 'PNG')
     img.close()
 
-    with open(png_path + '.json', 'w') as f:
-        json.dump(dict(
-            width=width,
-            height=height,
-            image=base64.b64encode(buffer.getvalue()).decode()), f
-        )
+    PngSidecar.write(sidecar_path or png_sidecar_path(png_path), buffer.getvalue(), width, height)
+
+
+def migrate_png_sidecars() -> int:
+    """
+    Convert all sidecars of the former format (maps_png/*.png.json) to PngSidecars.
+
+    :return: number of converted files
+    """
+    png_dir = os.path.dirname(map_png_path('00000'))
+    if not os.path.isdir(png_dir):
+        return 0
+    legacy = [file.removesuffix('.json') for file in os.listdir(png_dir) if file.endswith('.png.json')]
+    for png_file in legacy:
+        migrate_png_json(f'{png_dir}/{png_file}')
+    return len(legacy)
+
+
+class RateLimiter:
+    """
+    Thread-safe token bucket that limits the number of requests per second.
+
+    The rate is adaptive: penalize() halves it (e.g. after the server answered 429), every successful request
+    recovers it step by step until the configured rate is reached again.
+    """
+
+    def __init__(self, rate: float, burst: int = 1, min_rate: float = 0.05):
+        """
+        :param rate: maximal number of requests per second
+        :param burst: maximal number of requests that may be sent at once after idling
+        :param min_rate: penalize() never reduces the rate below this value
+        """
+        assert rate > 0 and burst >= 1, f'Invalid rate limit: {rate=} {burst=}'
+        self.max_rate = self.rate = rate
+        self.min_rate = min(min_rate, rate)
+        self.burst = burst
+        self.tokens = burst
+        self.last = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self) -> None:
+        """ Block until a request may be sent. """
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+                self.last = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def penalize(self) -> None:
+        with self.lock:
+            self.rate = max(self.min_rate, self.rate / 2)
+
+    def reward(self) -> None:
+        with self.lock:
+            self.rate = min(self.max_rate, self.rate + self.max_rate / 10)
+
+
+def shared_rate_limiter() -> RateLimiter:
+    """
+    :return: RateLimiter with KEGG_MAP_WIZARD_RATE requests per second, shared by all downloads of this process
+    """
+    global _rate_limiter
+    if _rate_limiter is None:
+        _rate_limiter = RateLimiter(rate=settings().download_rate)
+    return _rate_limiter
 
 
 def fetch(
-        session: requests.Session,
+        session,
         url: str,
         save_path: str,
         raw: bool = False,
-        make_cdb: bool = False,
         convert_png: bool = False,
-        timeout: tuple = (2, 5),
+        rate_limiter: RateLimiter = None,
+        retries: int = 4,
+        backoff: float = 2,
+        manifest_entry: dict = None,
+        timeout: float = None,
         verbose: bool = True
 ) -> str:
     """
     Download a file and save it to disk.
 
-    :param session: requests.Session()
+    :param session: requests.Session(), may be shared between threads
     :param url: target url
     :param save_path: target path
     :param raw: if False: write in 'w'-mode, if True: write in 'wb'-mode,
-    :param sort: if True: sort file using C/Python logic after download
-    :param timeout: wait between timeout[0] and timeout[1] seconds before attempting download, to avoid overloading API
+    :param convert_png: if True: encode png after download
+    :param rate_limiter: RateLimiter shared by all downloads, None to send requests immediately
+    :param retries: number of retries after 403, 429 and 5xx responses, connection errors and timeouts
+    :param backoff: wait backoff * 2 ** attempt seconds before retrying (or as long as the Retry-After header demands)
+    :param manifest_entry: validators of the previous download (etag, last_modified, sha256), enables incremental mode:
+        send a conditional request and only overwrite save_path if the content changed. Updated in place.
+    :param timeout: seconds, or (connect, read) like in requests, default: TIMEOUT
     :param verbose: if True: print messages
-    :returns: status of the download: if 200: success, if 404 and empty: non-existent, 'error' otherwise
+    :returns: status of the download: if 200: success, if 404 and empty: non-existent, 'error' otherwise;
+        in incremental mode also 'not-modified' (304) and 'unchanged' (same content)
     """
-    print(save_path)
-    if timeout:
-        timeout = randint(*timeout)
-        if verbose: print(f'Downloading: {url} (after sleeping for {timeout} s)')
-        time.sleep(timeout)
-    else:
+    import requests
+    headers = {}
+    if manifest_entry and os.path.isfile(save_path):
+        if 'etag' in manifest_entry:
+            headers['If-None-Match'] = manifest_entry['etag']
+        if 'last_modified' in manifest_entry:
+            headers['If-Modified-Since'] = manifest_entry['last_modified']
+
+    for attempt in range(retries + 1):
+        if rate_limiter:
+            rate_limiter.acquire()
         if verbose: print(f'Downloading: {url}')
 
-    with session.get(url) as response:
-        if raw:
-            data = response.content
-            mode = 'wb'
-        else:
-            data = response.text
-            mode = 'w'
-
-        if response.status_code != 200:
-            if data == '' and response.status_code == 404:
-                if verbose: print(f'Non-existent found! :: {url}')
-                return 'non-existent'
-            else:
-                if verbose: print(f'FAILURE ({response.status_code}) :: {url}\nDATA:\n\n{data}')
-                return 'error'
-
-        with open(save_path, mode) as out:
+        try:
+            with session.get(url, headers=headers, timeout=TIMEOUT if timeout is None else timeout) as response:
+                status_code, retry_after = response.status_code, response.headers.get('Retry-After')
+                validators = {'etag': response.headers.get('ETag'), 'last_modified': response.headers.get('Last-Modified')}
+                data = response.content if raw else response.text
+        except requests.RequestException as e:  # e.g. connection errors, timeouts, truncated responses
+            status_code, retry_after, data = None, None, f'{type(e).__name__}: {e}'
+
+        if status_code == 304 and headers:
+            if rate_limiter:
+                rate_limiter.reward()
+            return 'not-modified'
+        if status_code == 200:
+            break
+        if status_code == 404 and data in ('', b''):
+            if verbose: print(f'Non-existent found! :: {url}')
+            return 'non-existent'
+        if status_code is not None and status_code not in RETRY_STATUS_CODES or attempt == retries:
+            if verbose: print(f'FAILURE ({status_code}) :: {url}\nDATA:\n\n{data}')
+            return 'error'
+
+        if rate_limiter:
+            rate_limiter.penalize()
+        wait = float(retry_after) if retry_after and retry_after.isdecimal() else backoff * 2 ** attempt
+        if verbose: print(f'Retrying ({status_code}) in {wait} s :: {url}')
+        time.sleep(wait)
+
+    if rate_limiter:
+        rate_limiter.reward()
+
+    if manifest_entry is not None:
+        previous_sha256 = manifest_entry.get('sha256') or (os.path.isfile(save_path) and file_sha256(save_path))
+        manifest_entry.clear()
+        manifest_entry.update({key: value for key, value in validators.items() if value is not None})
+        manifest_entry['sha256'] = hashlib.sha256(data if raw else data.encode('utf-8')).hexdigest()
+        if manifest_entry['sha256'] == previous_sha256 and os.path.isfile(save_path):
+            return 'unchanged'
+
+    # atomic: an interrupted download must not leave a truncated file that later runs consider present
+    tmp_path = f'{save_path}.{os.getpid()}.{threading.get_ident()}.tmp'
+    try:
+        with open(tmp_path, 'wb' if raw else 'w') as out:
             out.write(data)
-
-        if make_cdb:
-            mk_cdb(save_path)
-
         if convert_png:
-            encode_png(save_path)
+            encode_png(tmp_path, sidecar_path=png_sidecar_path(save_path))  # before the PNG, see MapAvailability
+        os.replace(tmp_path, save_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
 
-        return 'success'
+    return 'success'
 
 
 def fetch_all(
@@ -131,16 +301,24 @@ def fetch_all(
         n_parallel: int,
         reload: bool,
         nonexistent_file: str = None,
+        rate_limiter: RateLimiter = None,
+        progress: Callable = None,
+        incremental: bool = False,
         verbose: bool = True
-) -> None:
+) -> {str: str}:
     """
-    Multiprocess the fetch function.
+    Download files in parallel threads that share one connection pool.
 
-    :param args_list: List of arguments for fetch function, excluding session: [(url, save_path, raw, sort), ...]
-    :param n_parallel: Number of parallel downloads
+    :param args_list: List of arguments for fetch function, excluding session: [(url, save_path, raw, ...), ...]
+    :param n_parallel: Maximal number of concurrent downloads
     :param reload: if True: overwrite existing files, if False: only download non-existing files
     :param nonexistent_file: path to json-file that conains list of non-existent files
+    :param rate_limiter: RateLimiter, default: shared limiter with KEGG_MAP_WIZARD_RATE requests per second
+    :param progress: function that is called after each download: progress(n_done, n_total, url, status)
+    :param incremental: if True: check all files with conditional requests, only overwrite files whose content
+        changed; the validators are stored in a manifest.json next to the files
     :param verbose: if True: print summary
+    :returns: dictionary: save_path -> status of all attempted downloads
     """
     non_existent = []  # his list holds urls that did not lead to a real file
 
@@ -149,21 +327,47 @@ def fetch_all(
         with open(nonexistent_file) as f:
             non_existent = json.load(f)
 
-    if not reload:
+    if incremental:
+        # check all files, except for previous non_existent
+        args_list = [args for args in args_list if args[0] not in non_existent]
+    elif not reload:
         # download only files that do not exist yet and do not try to download previous non_existent again
         args_list = [args for args in args_list if not os.path.isfile(args[1]) and args[0] not in non_existent]  # args[0] url, args[1]: save_path
 
     if len(args_list) == 0:
         # no files to download
-        return
-
-    with requests.Session() as session:
-        # download
-        statuses = process_all(
-            func=fetch,
-            args_list=[tuple([session, *args]) for args in args_list],  # add session to arguments
-            n_parallel=n_parallel
-        )
+        return {}
+
+    manifests = {}  # directory -> {filename: validators}
+    if incremental:
+        for args in args_list:
+            directory = os.path.dirname(args[1])
+            if directory not in manifests:
+                manifests[directory] = load_manifest(directory)
+
+    if rate_limiter is None:
+        rate_limiter = shared_rate_limiter()
+    if progress is None and verbose:
+        progress = print_progress
+
+    import requests
+    statuses = [None] * len(args_list)
+    with requests.Session() as session, ThreadPoolExecutor(max_workers=n_parallel) as executor:
+        adapter = requests.adapters.HTTPAdapter(pool_connections=n_parallel, pool_maxsize=n_parallel)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        futures = {
+            executor.submit(
+                fetch, session, *args, rate_limiter=rate_limiter, verbose=verbose,
+                manifest_entry=manifests[os.path.dirname(args[1])].setdefault(os.path.basename(args[1]), {}) if incremental else None
+            ): i
+            for i, args in enumerate(args_list)
+        }
+        for n_done, future in enumerate(as_completed(futures), start=1):
+            i = futures[future]
+            statuses[i] = future.result()
+            if progress:
+                progress(n_done, len(args_list), args_list[i][0], statuses[i])
 
     summary = {status: [] for status in set(statuses)}
     for args, status in zip(args_list, statuses):
@@ -180,6 +384,40 @@ def fetch_all(
         with open(nonexistent_file, 'w') as f:
             json.dump(non_existent, f)
 
+    for directory, manifest in manifests.items():
+        save_manifest(directory, {filename: entry for filename, entry in manifest.items() if entry})
+
+    return {args[1]: status for args, status in zip(args_list, statuses)}
+
+
+def file_sha256(path: str) -> str:
+    sha256 = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+def load_manifest(directory: str) -> {str: dict}:
+    """
+    Load the validators (etag, last_modified, sha256) of the files in a directory.
+    """
+    manifest_path = f'{directory}/manifest.json'
+    if not os.path.isfile(manifest_path):
+        return {}
+    with open(manifest_path) as f:
+        return json.load(f)
+
+
+def save_manifest(directory: str, manifest: {str: dict}) -> None:
+    manifest = {**load_manifest(directory), **manifest}
+    with open(f'{directory}/manifest.json', 'w') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+
+
+def print_progress(n_done: int, n_total: int, url: str, status: str) -> None:
+    print(f'[{n_done}/{n_total}] {status}: {url}')
+
 
 def process_all(func, args_list: [tuple], n_parallel: int) -> list:
     """
@@ -190,6 +428,7 @@ def process_all(func, args_list: [tuple], n_parallel: int) -> list:
     :param n_parallel: number of parallel tasks
     :return: list of return values
     """
+    import multiprocessing
     with multiprocessing.Pool(processes=n_parallel) as pool:
         result = pool.starmap(func=func, iterable=args_list)
 
@@ -198,51 +437,104 @@ def process_all(func, args_list: [tuple], n_parallel: int) -> list:
 
 def rest_data_path(key: str, url=False) -> str:
     if url:
-        return f'http://rest.kegg.jp/list/{key}'
+        return f'{KEGG_REST_URL}/list/{key}'
     else:
-        return f'{DATA_DIR}/rest_data/{key}.tsv'
+        return f'{data_dir()}/rest_data/{key}.tsv'
 
 
 def map_conf_path(org: str, map_id: str, url=False) -> str:
     if url:
-        return f'http://rest.kegg.jp/get/{org}{map_id}/conf'
+        return f'{KEGG_REST_URL}/get/{org}{map_id}/conf'
+    else:
+        return f'{data_dir()}/maps_data/{org}/{map_id}.conf'
+
+
+def ko_link_path(org: str, url=False) -> str:
+    if url:
+        return f'{KEGG_REST_URL}/link/{org}/ko'
     else:
-        return f'{DATA_DIR}/maps_data/{org}/{map_id}.conf'
+        return f'{data_dir()}/rest_data/{org}_ko.tsv'
+
+
+def map_conf_dir(org: str) -> str:
+    return f'{data_dir()}/maps_data/{org}'
+
+
+def nonexistent_path(org: str) -> str:
+    return f'{data_dir()}/maps_data/{org}/non-existent.json'
+
+
+def derivation_stamp_path(org: str) -> str:
+    return f'{data_dir()}/maps_data/{org}/derived.json'
+
+
+def rest_index_path() -> str:
+    return f'{data_dir()}/rest_data/rest_index.bin'
+
+
+def annotation_index_path() -> str:
+    return f'{data_dir()}/rest_data/annotation_index.cdb'
 
 
 def map_png_path(map_id: str, url=False) -> str:
     if url:
-        return f'https://www.genome.jp/kegg/pathway/map/map{map_id}.png'
+        return f'{KEGG_PNG_URL}/map{map_id}.png'
     else:
-        return f'{DATA_DIR}/maps_png/{map_id}.png'
+        return f'{data_dir()}/maps_png/{map_id}.png'
+
+
+def rest_files(orgs: [str]) -> [str]:
+    return ['path', 'rn', 'compound', 'drug', 'glycan', 'dgroup', 'enzyme', 'br', 'rc', *orgs]
+
+
+def map_cache_path(org_string: str, map_id: str) -> str:
+    return f'{data_dir()}/maps_cache/{org_string}/{map_id}.pickle'
 
 
-def download_rest_data(orgs: [str], reload=False) -> {str: cdblib.Reader}:
-    os.makedirs(f'{DATA_DIR}/rest_data', exist_ok=True)
-    os.makedirs(f'{DATA_DIR}/maps_png/', exist_ok=True)
+def download_rest_data(orgs: [str], reload=False, incremental=False) -> dict:
+    """
+    Download the REST lists and open them, see open_rest_data.
+
+    :param orgs: organisms whose gene lists are required
+    :param reload: if True: download all files again
+    :param incremental: if True: only re-download lists that changed
+    :return: dictionary: rest file -> RestReader
+    """
+    os.makedirs(f'{data_dir()}/rest_data', exist_ok=True)
+    os.makedirs(f'{data_dir()}/maps_png/', exist_ok=True)
 
-    files = ['path', 'rn', 'compound', 'drug', 'glycan', 'dgroup', 'enzyme', 'br', 'rc', *orgs]
+    files = rest_files(orgs)
 
     to_download = [
         (  # parameters for fetch function (except for session)
             rest_data_path(file, url=True),  # url
             rest_data_path(file, url=False),  # save_path
-            False,  # raw
-            True  # create cdb
+            False  # raw, the lists are indexed together by kegg_rest_index
         )
         # dict(url=f'http://rest.kegg.jp/list/{file}', save_path=F'{self.KEGG_REST_PATH}/{file}.tsv', raw=False)
         for file in files
     ]
 
-    fetch_all(args_list=to_download, n_parallel=N_PARALLEL_DOWNLOADS, reload=reload)
+    fetch_all(args_list=to_download, n_parallel=settings().n_parallel_downloads, reload=reload, incremental=incremental)
 
     for args in to_download:
         assert os.path.isfile(args[1]), f'failed to download {args}'
 
-    return {file: get_cdb(rest_data_path(file)) for file in files}
+    return open_rest_data(orgs)
+
 
+def open_rest_data(orgs: [str]) -> dict:
+    """
+    Open the REST lists without checking for downloads. All lists are served by one memory-mapped index, which is
+    rebuilt first if a list changed, see kegg_rest_index.
+
+    :return: dictionary: rest file -> RestReader, which can be used like a cdb reader
+    """
+    from kegg_map_wizard.kegg_rest_index import open_rest_index
+    return open_rest_index().readers(rest_files(orgs))
 
-def download_map_pngs(map_ids: [str], reload: bool = False) -> None:
+
+def download_map_pngs(map_ids: [str], reload: bool = False, incremental: bool = False) -> {str: str}:
     to_download = []
     for map_id in map_ids:
         to_download.append(
@@ -250,37 +542,97 @@ def download_map_pngs(map_ids: [str], reload: bool = False) -> None:
                 map_png_path(map_id, url=True),  # url
                 map_png_path(map_id, url=False),  # save_path
                 True,  # raw
-                False,  # create cdb
                 True  # encode png
             )
         )
 
-    fetch_all(args_list=to_download, n_parallel=N_PARALLEL_DOWNLOADS, reload=reload)
+    statuses = fetch_all(args_list=to_download, n_parallel=settings().n_parallel_downloads, reload=reload, incremental=incremental)
 
     for args in to_download:
         assert os.path.isfile(args[1]), f'failed to download {args}'
 
+    return statuses
+
 
-def download_map_confs(org: str, map_ids: [str], reload: bool = False, nonexistent_file=True):
+def download_map_confs(org: str, map_ids: [str], reload: bool = False, nonexistent_file=True, incremental: bool = False) -> {str: str}:
     to_download = []
     for map_id in map_ids:
         to_download.append(
             (
                 map_conf_path(org, map_id, url=True),  # url
                 map_conf_path(org, map_id, url=False),  # save_path
-                False,  # raw
-                False  # create cdb
+                False  # raw
             )
         )
 
     if nonexistent_file:
-        nonexistent_file = f'{DATA_DIR}/maps_data/{org}/non-existent.json'
+        nonexistent_file = nonexistent_path(org)
+
+    return fetch_all(args_list=to_download, n_parallel=settings().n_parallel_downloads, reload=reload,
+                     nonexistent_file=nonexistent_file, incremental=incremental)
+
+
+class MapAvailability:
+    """
+    In-memory index of the map PNGs and confs in the data directory.
 
-    fetch_all(args_list=to_download, n_parallel=N_PARALLEL_DOWNLOADS, reload=reload,
-              nonexistent_file=nonexistent_file)
+    It is built with one listdir per directory and kept up to date with the statuses returned by the download
+    functions. This lets KeggMapWizard.create_map skip the download checks for maps that are complete.
+    """
 
+    def __init__(self, orgs: [str]):
+        self.orgs = orgs
+        png_dir = os.path.dirname(map_png_path('00000'))
+        self.pngs: {str} = {
+            file.removesuffix('.png') for file in os.listdir(png_dir) if file.endswith('.png')
+        } if os.path.isdir(png_dir) else set()
+        self.confs: {str: {str}} = {}  # org -> map_ids
+        self.nonexistent: {str: {str}} = {}  # org -> map_ids that KEGG does not have
+        for org in orgs:
+            conf_dir = map_conf_dir(org)
+            files = os.listdir(conf_dir) if os.path.isdir(conf_dir) else []
+            self.confs[org] = {file.removesuffix('.conf') for file in files if file.endswith('.conf')}
+            self.nonexistent[org] = set()
+            if 'non-existent.json' in files:
+                with open(nonexistent_path(org)) as f:
+                    self.nonexistent[org] = {self._conf_url_map_id(org, url) for url in json.load(f)}
+
+    def __repr__(self):
+        return f'<MapAvailability: {len(self.pngs)} PNGs, ' \
+               f'{", ".join(f"{org}: {len(confs)}" for org, confs in self.confs.items())} confs>'
+
+    @staticmethod
+    def _conf_url_map_id(org: str, url: str) -> str:
+        # '{KEGG_REST_URL}/get/{org}{map_id}/conf' -> map_id
+        return url.rstrip('/').rsplit('/', 2)[-2].removeprefix(org)
+
+    def is_complete(self, map_id: str) -> bool:
+        """
+        :return: True if the PNG exists and the conf of every organism either exists or does not exist on KEGG
+        """
+        return map_id in self.pngs and all(
+            map_id in self.confs[org] or map_id in self.nonexistent[org] for org in self.orgs
+        )
 
-def get_description(cdb_reader: cdblib.Reader, query: str) -> str:
+    def update(self, statuses: {str: str}) -> None:
+        """
+        :param statuses: dictionary: save_path -> status, as returned by download_map_pngs and download_map_confs
+        """
+        for path, status in statuses.items():
+            file = os.path.basename(path)
+            if status in ('success', 'unchanged', 'not-modified') and file.endswith('.png'):
+                self.pngs.add(file.removesuffix('.png'))
+            elif file.endswith('.conf'):
+                org = os.path.basename(os.path.dirname(path))
+                if org not in self.confs:
+                    continue
+                if status in ('success', 'unchanged', 'not-modified'):
+                    self.confs[org].add(file.removesuffix('.conf'))
+                elif status == 'non-existent':
+                    self.nonexistent[org].add(file.removesuffix('.conf'))
+
+
+def get_description(cdb_reader, query: str) -> str:
     """
     Use rest data to get the description of an annotation.
 
@@ -289,3 +641,70 @@ def get_description(cdb_reader: cdblib.Reader, query: str) -> str:
     :return: description. If none is found, an empty string is returned and a warning is printed.
     """
     return cdb_reader.get(query.encode('utf-8'), default=b'').decode('utf-8')
+
+
+class DescriptionCache:
+    """
+    Bounded LRU cache of descriptions, keyed by (rest_file, query), shared by all maps of a KeggMapWizard.
+    """
+
+    def __init__(self, cdb_readers: dict, maxsize: int = 1 << 16):
+        """
+        :param cdb_readers: dictionary: rest file -> RestReader (see open_rest_data) or cdb reader
+        :param maxsize: maximal number of cached descriptions
+        """
+        self.cdb_readers = cdb_readers
+        self.maxsize = maxsize
+        self._cache = OrderedDict()
+        self.hits = self.misses = 0
+
+    def __repr__(self):
+        return f'<DescriptionCache: {self.stats()}>'
+
+    def get(self, rest_file: str, query: str) -> str:
+        return self.get_many([(rest_file, query)])[(rest_file, query)]
+
+    def get_many(self, keys: Iterable[tuple]) -> {(str, str): str}:
+        """
+        Resolve many descriptions in one pass: duplicates are looked up once, misses are read from
+        the readers in one batch per rest file.
+
+        :param keys: iterable of (rest_file, query)
+        :return: dictionary: (rest_file, query) -> description
+        """
+        result, missing = {}, set()
+        for key in keys:
+            if key in result or key in missing:
+                continue
+            description = self._cache.get(key)
+            if description is None:
+                missing.add(key)
+            else:
+                self._cache.move_to_end(key)
+                result[key] = description
+                self.hits += 1
+
+        self.misses += len(missing)
+        by_rest_file = {}
+        for rest_file, query in sorted(missing):
+            by_rest_file.setdefault(rest_file, []).append(query)
+        for rest_file, queries in by_rest_file.items():
+            reader = self.cdb_readers[rest_file]
+            if hasattr(reader, 'get_many'):
+                descriptions = reader.get_many(queries)
+            else:
+                descriptions = {query: get_description(reader, query=query) for query in sorted(queries)}
+            for query, description in descriptions.items():
+                result[(rest_file, query)] = self._cache[(rest_file, query)] = description
+
+        while len(self._cache) > self.maxsize:
+            self._cache.popitem(last=False)
+
+        return result
+
+    def stats(self) -> dict:
+        return dict(hits=self.hits, misses=self.misses, size=len(self._cache), maxsize=self.maxsize)
+
+    def clear(self) -> None:
+        self._cache.clear()
+        self.hits = self.misses = 0
@@ -0,0 +1,122 @@
+"""
+Persistent inverted index: annotation -> shapes of all downloaded maps.
+
+The index is a cdb file next to the rest data (rest_data/annotation_index.cdb). It is built directly from the .conf
+files, without creating KeggMaps, and maps each annotation name (e.g. 'K01623', 'C00031', 'EC:4.1.2.13') to
+all (org, map_id, raw_position) where it occurs. raw_position is the key of the shape in KeggMap.shapes.
+"""
+import os
+import json
+import hashlib
+
+from kegg_map_wizard import kegg_download
+from kegg_map_wizard.kegg_download import map_conf_dir, map_conf_path, annotation_index_path
+from kegg_map_wizard.kegg_cache import fingerprint
+from kegg_map_wizard.KeggAnnotation import KeggAnnotation
+
+INDEX_VERSION = 1  # increase whenever the format of the index changes
+SOURCES_KEY = b'\x00sources'  # cannot collide with annotation names
+
+
+def conf_files() -> {(str, str): str}:
+    """
+    :return: dictionary: (org, map_id) -> path of all downloaded .conf files
+    """
+    maps_data = os.path.dirname(map_conf_dir('org'))
+    if not os.path.isdir(maps_data):
+        return {}
+    return {
+        (org, filename.removesuffix('.conf')): map_conf_path(org, filename.removesuffix('.conf'))
+        for org in sorted(os.listdir(maps_data)) if os.path.isdir(map_conf_dir(org))
+        for filename in sorted(os.listdir(map_conf_dir(org))) if filename.endswith('.conf')
+    }
+
+
+def sources_fingerprint(confs: {(str, str): str}) -> bytes:
+    """
+    Fingerprint of all .conf files, stored in the index to detect when it is outdated.
+    """
+    sources = [INDEX_VERSION, kegg_download.data_dir(), sorted((path, fingerprint(path)) for path in confs.values())]
+    return hashlib.sha256(json.dumps(sources).encode('utf-8')).hexdigest().encode('utf-8')
+
+
+def iter_conf_annotations(org: str, map_id: str):  # -> Iterator[(str, str)]
+    """
+    :return: iterator over (annotation name, raw_position) of a .conf file
+    """
+    re_org_anno = KeggAnnotation.org_pattern(org)
+    with open(map_conf_path(org, map_id)) as f:
+        for line in f:
+            raw_position, url, _ = line.rstrip().split('\t')
+            for anno_query in KeggAnnotation.parse_url(url=url, re_org_anno=re_org_anno, org=org):
+                yield anno_query.key[1], raw_position
+
+
+def build_annotation_index() -> None:
+    """
+    (Re-)build the index over all downloaded .conf files of all organisms.
+    """
+    import cdblib
+    confs = conf_files()
+    index_path = annotation_index_path()
+    tmp_path = f'{index_path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'wb') as f, cdblib.Writer(f) as writer:
+        writer.put(SOURCES_KEY, sources_fingerprint(confs))
+        for (org, map_id), path in confs.items():
+            seen = set()
+            for name, raw_position in iter_conf_annotations(org, map_id):
+                if (name, raw_position) in seen:
+                    continue  # some shapes occur twice, see KeggMap.add_shape
+                seen.add((name, raw_position))
+                writer.put(name.encode('utf-8'), f'{org}\t{map_id}\t{raw_position}'.encode('utf-8'))
+    os.replace(tmp_path, index_path)
+
+
+class AnnotationIndex:
+    """
+    Read-only view of rest_data/annotation_index.cdb. Every lookup is a single hash table probe.
+    """
+
+    def __init__(self, path: str = None):
+        import cdblib
+        self.path = annotation_index_path() if path is None else path
+        self.reader = cdblib.Reader.from_file_path(self.path)
+
+    def __repr__(self):
+        return f'<AnnotationIndex: {self.path}>'
+
+    def is_current(self) -> bool:
+        return self.reader.get(SOURCES_KEY) == sources_fingerprint(conf_files())
+
+    def get(self, annotation: str, orgs: [str] = None) -> [(str, str, str)]:
+        """
+        :param annotation: e.g. 'K01623', 'C00031', 'EC:4.1.2.13'
+        :param orgs: only return shapes from the .conf files of these organisms, default: all
+        :return: list of (org, map_id, raw_position)
+        """
+        entries = (value.decode('utf-8').split('\t', maxsplit=2) for value in self.reader.gets(annotation.encode('utf-8')))
+        return [tuple(entry) for entry in entries if orgs is None or entry[0] in orgs]
+
+    def maps_for(self, annotation: str, orgs: [str] = None) -> [str]:
+        """
+        :return: sorted map_ids of maps that contain the annotation
+        """
+        return sorted({map_id for org, map_id, raw_position in self.get(annotation, orgs)})
+
+    def shapes_for(self, annotation: str, orgs: [str] = None) -> [(str, str)]:
+        """
+        :return: sorted (map_id, raw_position) of all shapes that contain the annotation
+        """
+        return sorted({(map_id, raw_position) for org, map_id, raw_position in self.get(annotation, orgs)})
+
+
+def open_annotation_index(rebuild: bool = False) -> AnnotationIndex:
+    """
+    Open the index, build it first if it does not exist, is outdated or if rebuild is True.
+    """
+    if not rebuild and os.path.isfile(annotation_index_path()):
+        index = AnnotationIndex()
+        if index.is_current():
+            return index
+    build_annotation_index()
+    return AnnotationIndex()
@@ -0,0 +1,189 @@
+"""
+Derive the maps of an organism from the ko reference maps and a KO -> gene link table, instead of downloading
+one .conf file per map and organism.
+
+The link table is either KEGG's link/{org}/ko list (one request per organism, see download_ko_links) or a local
+gene -> KO table of a genome that is not in KEGG (see import_gene_table), tab-separated, with an optional
+description:
+
+    gene_0001	K00001
+    gene_0002	K00002	alcohol dehydrogenase
+
+derive_map_confs replaces the KO annotations of each ko .conf file by the genes of the organism and writes the
+result to maps_data/{org}/{map_id}.conf, where KeggMap.add_shapes, the cache and the annotation index expect it.
+Maps in which the organism has no genes are recorded in non-existent.json, like maps that KEGG does not have.
+The mtimes of the sources of each derived map are recorded in derived.json, see derive_map_confs.
+"""
+import os
+import json
+
+from kegg_map_wizard.kegg_download import fetch_all, ko_link_path, rest_data_path, \
+    map_conf_path, map_conf_dir, nonexistent_path, derivation_stamp_path
+from kegg_map_wizard.kegg_utils import ANNOTATION_SETTINGS
+
+RE_KO = ANNOTATION_SETTINGS['K']['pattern']
+
+
+def download_ko_links(org: str, reload: bool = False, incremental: bool = False) -> {str: str}:
+    """
+    Download KEGG's link/{org}/ko table.
+
+    :return: dictionary: save_path -> status, see fetch_all
+    """
+    to_download = [(ko_link_path(org, url=True), ko_link_path(org), False)]
+    statuses = fetch_all(args_list=to_download, n_parallel=1, reload=reload, incremental=incremental)
+    assert os.path.isfile(ko_link_path(org)), f'failed to download {to_download}'
+    return statuses
+
+
+def import_gene_table(org: str, tsv_path: str) -> None:
+    """
+    Import the gene -> KO table of a local genome. It is converted into the files KEGG would provide:
+    rest_data/{org}_ko.tsv (like link/{org}/ko) and rest_data/{org}.tsv (like list/{org}).
+    Genes without description are described by their KOs. Nothing is done if both files are newer than tsv_path.
+
+    :param org: organism code, must not be a KEGG organism
+    :param tsv_path: tab-separated file: gene, KO (with or without 'ko:' prefix), optional description
+    """
+    link_path, list_path = ko_link_path(org), rest_data_path(org)
+    if all(os.path.isfile(path) and os.path.getmtime(path) >= os.path.getmtime(tsv_path)
+           for path in (link_path, list_path)):
+        return
+
+    links, descriptions, gene_kos = [], {}, {}
+    with open(tsv_path) as f:
+        for i, line in enumerate(f, start=1):
+            if not line.strip() or line.startswith('#'):
+                continue
+            gene, ko, *description = line.rstrip('\n').split('\t')
+            ko = ko.removeprefix('ko:')
+            assert RE_KO.match(ko), f'Error in {tsv_path}, line {i}: not a KO: {ko!r}'
+            gene = gene if gene.startswith(f'{org}:') else f'{org}:{gene}'
+            links.append(f'ko:{ko}\t{gene}\n')
+            gene_kos.setdefault(gene, []).append(ko)
+            if description and description[0].strip():
+                descriptions.setdefault(gene, description[0].strip())
+    descriptions = {gene: descriptions.get(gene, ', '.join(kos)) for gene, kos in gene_kos.items()}
+
+    os.makedirs(os.path.dirname(link_path), exist_ok=True)
+    for path, lines in [(link_path, links), (list_path, [f'{gene}\t{d}\n' for gene, d in descriptions.items()])]:
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'w') as f:
+            f.writelines(lines)
+        os.replace(tmp_path, path)
+
+
+def read_ko_links(org: str) -> {str: [str]}:
+    """
+    Read rest_data/{org}_ko.tsv, see download_ko_links and import_gene_table.
+
+    :return: dictionary: KO -> genes, e.g. {'K00001': ['hsa:124', 'hsa:125']}
+    """
+    ko_to_genes = {}
+    with open(ko_link_path(org)) as f:
+        for line in f:
+            if not line.strip():
+                continue
+            a, b = line.rstrip('\n').split('\t')[:2]
+            ko, gene = (a, b) if a.startswith('ko:') else (b, a)  # KEGG answers with the source database first
+            ko_to_genes.setdefault(ko.removeprefix('ko:'), {})[gene] = None
+    return {ko: list(genes) for ko, genes in ko_to_genes.items()}
+
+
+def derive_conf_text(ko_conf_text: str, ko_to_genes: {str: [str]}) -> str:
+    """
+    Replace the KO annotations of a ko .conf file by genes.
+
+    Lines with KOs keep their geometry and description and link to the genes of all their KOs, lines whose KOs
+    have no genes are dropped. Lines without KOs (compounds, maps, ...) are kept as they are.
+
+    :return: text of the .conf file of the organism, empty if it has no genes in this map
+    """
+    lines = []
+    has_genes = False
+    for line in ko_conf_text.splitlines():
+        raw_position, url, description = line.split('\t')
+        url_prefix, annotations_hyperlink = url.split('?', maxsplit=1)
+        kos = [anno for anno in annotations_hyperlink.split('+') if RE_KO.match(anno)]
+        if kos:
+            genes = dict.fromkeys(gene for ko in kos for gene in ko_to_genes.get(ko, ()))
+            if not genes:
+                continue
+            has_genes = True
+            url = f'/dbget-bin/www_bget?{"+".join(genes)}'
+        lines.append(f'{raw_position}\t{url}\t{description}\n')
+    return ''.join(lines) if has_genes else ''
+
+
+def derive_map_confs(org: str, map_ids: [str], reload: bool = False) -> {str: str}:
+    """
+    Derive the .conf files of an organism from the ko .conf files and rest_data/{org}_ko.tsv.
+
+    A map is only derived again if the mtime of its ko .conf file or of the link table differs from the one recorded
+    in derived.json, or if reload is True. Derived files whose content did not change are left alone, so their cached
+    maps stay valid. Maps without ko .conf file are skipped.
+
+    :return: dictionary: save_path -> status ('success', 'unchanged' or 'non-existent'), like fetch_all
+    """
+    os.makedirs(map_conf_dir(org), exist_ok=True)
+    link_mtime = os.stat(ko_link_path(org)).st_mtime_ns
+    ko_to_genes = None
+
+    nonexistent = []
+    if os.path.isfile(nonexistent_path(org)):
+        with open(nonexistent_path(org)) as f:
+            nonexistent = json.load(f)
+    previous_nonexistent = list(nonexistent)
+
+    stamps = {}  # map_id -> [mtime of the ko .conf file, mtime of the link table] it was derived from
+    if os.path.isfile(derivation_stamp_path(org)):
+        with open(derivation_stamp_path(org)) as f:
+            stamps = json.load(f)
+    previous_stamps = dict(stamps)
+
+    statuses = {}
+    for map_id in map_ids:
+        ko_path, save_path, url = map_conf_path('ko', map_id), map_conf_path(org, map_id), map_conf_path(org, map_id, url=True)
+        if not os.path.isfile(ko_path):
+            continue
+        sources = [os.stat(ko_path).st_mtime_ns, link_mtime]
+        if not reload and stamps.get(map_id) == sources and (os.path.isfile(save_path) or url in nonexistent):
+            continue
+        stamps[map_id] = sources
+
+        if ko_to_genes is None:
+            ko_to_genes = read_ko_links(org)
+        with open(ko_path) as f:
+            text = derive_conf_text(f.read(), ko_to_genes)
+
+        if not text:
+            if os.path.isfile(save_path):
+                os.remove(save_path)
+            if url not in nonexistent:
+                nonexistent.append(url)
+            statuses[save_path] = 'non-existent'
+            continue
+
+        if url in nonexistent:
+            nonexistent.remove(url)
+        if os.path.isfile(save_path):
+            with open(save_path) as f:
+                if f.read() == text:  # do not touch the file, cached maps stay valid
+                    statuses[save_path] = 'unchanged'
+                    continue
+        _write(save_path, text)
+        statuses[save_path] = 'success'
+
+    if nonexistent != previous_nonexistent or not os.path.isfile(nonexistent_path(org)):
+        _write(nonexistent_path(org), json.dumps(nonexistent))
+    if stamps != previous_stamps:
+        _write(derivation_stamp_path(org), json.dumps(stamps, indent=1, sort_keys=True))
+
+    return statuses
+
+
+def _write(path: str, text: str) -> None:
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'w') as f:
+        f.write(text)
+    os.replace(tmp_path, path)
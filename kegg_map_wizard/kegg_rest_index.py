@@ -0,0 +1,540 @@
+"""
+Single-file index over all REST lists: (rest file, key) -> description, e.g. ('ko', 'ko:K00844') -> 'HK; hexokinase'.
+
+The index (rest_data/rest_index.bin) replaces one cdb file per REST list. It is memory-mapped: opening it does not
+depend on its size, lookups only read the pages they touch and forked workers share the pages of their parent.
+Layout (native byte order, sections aligned to 8 bytes):
+
+    MAGIC
+    values           descriptions in the order of the REST lists, addressed by value_spans
+    keys             sorted b'{rest file}\t{key}', addressed by key_offsets (uint64, n + 1)
+    value_spans      start and end of the description of each key (uint64, 2 n)
+    hash_table       open addressing with linear probing: crc32(key) -> entry (uint32, power of two >= 2 n)
+    tokens           sorted lower-case words of all descriptions, addressed by token_offsets (uint64, m + 1)
+    postings         entries of each token (uint32, sorted), addressed by posting_offsets (uint64, m + 1)
+    footer           JSON: version, sources fingerprint, entry range of each rest file, sections
+    footer length (uint64), MAGIC
+
+The index is built by streaming over the REST lists, keys and postings are sorted on disk, see build_rest_index.
+It is rebuilt whenever a REST list changed, see open_rest_index.
+"""
+import os
+import re
+import json
+import mmap
+import zlib
+import heapq
+import hashlib
+from array import array
+from itertools import groupby
+from operator import itemgetter
+from tempfile import TemporaryDirectory
+from typing import Iterable, Iterator
+
+import numpy as np
+
+from kegg_map_wizard.kegg_download import rest_data_path, rest_index_path, split
+from kegg_map_wizard.kegg_cache import fingerprint
+
+INDEX_VERSION = 1  # increase whenever the format of the index changes
+MAGIC = b'KMWREST\x00'
+RE_TOKEN = re.compile(r'[a-z0-9]{2,}')
+EMPTY = 0xFFFFFFFF  # empty slot of the hash table
+CHUNK_SIZE = 1 << 20  # bytes per read when copying temporary files into the index
+RUN_SIZE = 100000  # keys or postings per sorted run of build_rest_index, bounds its memory
+RUN_BUFFER = 1 << 16  # bytes per read from a sorted run
+
+
+def rest_list_files() -> {str: str}:
+    """
+    :return: dictionary: rest file -> path of all REST lists in rest_data, without the link tables of kegg_link
+    """
+    directory = os.path.dirname(rest_data_path('path'))
+    if not os.path.isdir(directory):
+        return {}
+    return {
+        file.removesuffix('.tsv'): f'{directory}/{file}'
+        for file in sorted(os.listdir(directory)) if file.endswith('.tsv') and not file.endswith('_ko.tsv')
+    }
+
+
+def sources_fingerprint(files: {str: str}) -> str:
+    """
+    Fingerprint of all REST lists, stored in the index to detect when it is outdated.
+    """
+    sources = [INDEX_VERSION, sorted((path, fingerprint(path)) for path in files.values())]
+    return hashlib.sha256(json.dumps(sources).encode('utf-8')).hexdigest()
+
+
+def tokenize(text: str) -> [str]:
+    return RE_TOKEN.findall(text.lower())
+
+
+def build_rest_index() -> None:
+    """
+    (Re-)build the index over all REST lists.
+
+    Keys and postings are sorted externally: sorted runs of RUN_SIZE keys or postings are written to a temporary
+    directory next to the index and merged. Besides the runs, only the hash table and the rank of each entry are
+    kept in memory (up to 20 bytes per entry): the peak memory is 26 MB for 800,000 entries (192 MB when all keys
+    and postings were kept in memory), see benchmarks/bench_rest_index.py.
+    """
+    files = rest_list_files()
+    index_path = rest_index_path()
+    tmp_path = f'{index_path}.{os.getpid()}.tmp'
+    namespaces, sections = {}, {}
+
+    with TemporaryDirectory(dir=os.path.dirname(index_path)) as tmp_dir, open(tmp_path, 'wb') as f:
+        key_runs = KeyRuns(os.path.join(tmp_dir, 'keys'))
+        posting_runs = PostingRuns(os.path.join(tmp_dir, 'postings'))
+        value_offsets = SpillArray(os.path.join(tmp_dir, 'value_offsets'), 'Q')
+        position = f.write(MAGIC)
+        for rest_file, path in files.items():
+            prefix = f'{rest_file}\t'.encode('utf-8')
+            with open(path, encoding='utf-8') as tsv:
+                for line in tsv:
+                    key, description = split(line.strip())
+                    posting_runs.add(tokenize(description), entry=key_runs.n_keys)
+                    key_runs.add(prefix + key.encode('utf-8'))
+                    value_offsets.buffer.append(position)
+                    value_offsets.flush()
+                    position += f.write(description.encode('utf-8'))
+        value_offsets.buffer.append(position)
+        n_entries = key_runs.n_keys
+
+        def write_section(name: str, chunks: Iterable) -> None:
+            nonlocal position
+            position += f.write(b'\x00' * (-position % 8))
+            start = position
+            for chunk in chunks:
+                position += f.write(chunk)
+            sections[name] = [start, position - start]
+
+        # sort the keys, renumber the entries in key order
+        table = HashTable(n_entries)
+        key_offsets = SpillArray(os.path.join(tmp_dir, 'key_offsets'), 'Q', first=0)
+        order = SpillArray(os.path.join(tmp_dir, 'order'), 'I')  # entry of each sorted key
+
+        def sorted_keys() -> Iterator[bytes]:
+            previous, end = None, 0
+            append_offset, append_entry = key_offsets.buffer.append, order.buffer.append
+            for i, (key, entry) in enumerate(key_runs.merged()):
+                if key != previous:  # of duplicate keys only the first is found, like in a cdb file
+                    table.add(key, i)
+                    previous = key
+                    namespaces.setdefault(key[:key.index(b'\t')].decode('utf-8'), [i, i])[1] = i + 1
+                else:
+                    namespaces[key[:key.index(b'\t')].decode('utf-8')][1] = i + 1
+                end += len(key)
+                append_offset(end)
+                append_entry(entry)
+                if i % RUN_SIZE == 0:
+                    key_offsets.flush()
+                    order.flush()
+                yield key
+
+        write_section('keys', sorted_keys())
+        write_section('key_offsets', key_offsets.chunks())
+        rank = np.empty(n_entries, dtype=np.uint32)
+
+        def sorted_value_spans() -> Iterator[bytes]:
+            offsets = value_offsets.numpy()
+            start = 0
+            for chunk in order.chunks():
+                entries = np.frombuffer(chunk, dtype=np.uint32)
+                rank[entries] = np.arange(start, start + len(entries), dtype=np.uint32)
+                start += len(entries)
+                yield np.stack([offsets[entries], offsets[entries + 1]], axis=1).tobytes()
+
+        write_section('value_spans', sorted_value_spans())
+        write_section('hash_table', [table.table.tobytes()])
+        del table
+
+        # the postings are written to a temporary file while the tokens are written to the index
+        token_offsets = SpillArray(os.path.join(tmp_dir, 'token_offsets'), 'Q', first=0)
+        posting_offsets = SpillArray(os.path.join(tmp_dir, 'posting_offsets'), 'Q', first=0)
+        with open(os.path.join(tmp_dir, 'sorted_postings'), 'w+b') as postings:
+            def sorted_tokens() -> Iterator[bytes]:
+                token_end, posting_end = 0, 0
+                append_token_offset, append_posting_offset = token_offsets.buffer.append, posting_offsets.buffer.append
+                for i, (token, entries) in enumerate(posting_runs.merged()):
+                    entries = np.sort(rank[entries])
+                    postings.write(entries.tobytes())
+                    token_end += len(token)
+                    posting_end += len(entries)
+                    append_token_offset(token_end)
+                    append_posting_offset(posting_end)
+                    if i % RUN_SIZE == 0:
+                        token_offsets.flush()
+                        posting_offsets.flush()
+                    yield token
+
+            write_section('tokens', sorted_tokens())
+            write_section('token_offsets', token_offsets.chunks())
+            postings.seek(0)
+            write_section('postings', iter(lambda: postings.read(CHUNK_SIZE), b''))
+        write_section('posting_offsets', posting_offsets.chunks())
+
+        footer = json.dumps(dict(
+            version=INDEX_VERSION,
+            sources=sources_fingerprint(files),
+            rest_files=list(files),
+            namespaces=namespaces,
+            sections=sections
+        )).encode('utf-8')
+        f.write(footer + len(footer).to_bytes(8, 'little') + MAGIC)
+    os.replace(tmp_path, index_path)
+
+
+class KeyRuns:
+    """
+    Sorts keys that do not fit into memory: sorted runs of RUN_SIZE keys and their entries are written to temporary
+    files, merged reads them in parallel. The entry of a key is the number of keys added before it.
+    """
+
+    def __init__(self, path_prefix: str):
+        self.path_prefix = path_prefix
+        self.runs: [str] = []
+        self.keys: [bytes] = []
+        self.n_keys = 0
+
+    def add(self, key: bytes) -> None:
+        self.keys.append(key)
+        self.n_keys += 1
+        if len(self.keys) >= RUN_SIZE:
+            self._spill()
+
+    def _spill(self) -> None:
+        order = sorted(range(len(self.keys)), key=self.keys.__getitem__)  # stable: duplicate keys keep their order
+        path = f'{self.path_prefix}.{len(self.runs)}'
+        with open(path, 'wb') as f:
+            f.writelines(self.keys[i] + b'\n' for i in order)
+        (np.array(order, dtype=np.uint32) + (self.n_keys - len(self.keys))).tofile(f'{path}.entries')
+        self.runs.append(path)
+        self.keys = []
+
+    def merged(self) -> Iterator[tuple]:
+        """
+        :return: iterator of (key, entry), sorted by key, then by entry
+        """
+        if self.keys:
+            self._spill()
+        return heapq.merge(*(self._read(path) for path in self.runs))  # entries are unique, they break ties
+
+    @staticmethod
+    def _read(path: str) -> Iterator[tuple]:
+        with open(path, 'rb', buffering=RUN_BUFFER) as keys, open(f'{path}.entries', 'rb') as entries:
+            yield from zip((key[:-1] for key in keys), iter_numbers(entries, 'I'))
+
+
+class PostingRuns:
+    """
+    Collects the postings (token -> entries) of up to RUN_SIZE entries in memory and writes them to temporary files
+    as sorted runs, merged reads them in parallel. Entries must be added in increasing order.
+    """
+
+    def __init__(self, path_prefix: str):
+        self.path_prefix = path_prefix
+        self.runs: [str] = []
+        self.postings: {str: array} = {}
+        self.n_postings = 0
+
+    def add(self, tokens: Iterable[str], entry: int) -> None:
+        tokens = set(tokens)
+        for token in tokens:
+            if token not in self.postings:
+                self.postings[token] = array('I')
+            self.postings[token].append(entry)
+        self.n_postings += len(tokens)
+        if self.n_postings >= RUN_SIZE:
+            self._spill()
+
+    def _spill(self) -> None:
+        path = f'{self.path_prefix}.{len(self.runs)}'
+        with open(path, 'w', encoding='utf-8') as tokens, open(f'{path}.entries', 'wb') as entries:
+            for token in sorted(self.postings):
+                tokens.write(f'{token}\t{len(self.postings[token])}\n')
+                self.postings[token].tofile(entries)
+        self.runs.append(path)
+        self.postings, self.n_postings = {}, 0
+
+    def merged(self) -> Iterator[tuple]:
+        """
+        :return: iterator of (token, entries), sorted by token; entries are sorted
+        """
+        if self.postings:
+            self._spill()
+        # the index of the run breaks ties, so the entries of a token stay sorted
+        runs = heapq.merge(*(self._read(path, i) for i, path in enumerate(self.runs)))
+        for token, group in groupby(runs, key=itemgetter(0)):
+            entries = [entries for _, _, entries in group]
+            yield token, entries[0] if len(entries) == 1 else np.concatenate(entries)
+
+    @staticmethod
+    def _read(path: str, run: int) -> Iterator[tuple]:
+        with open(path, 'rb', buffering=RUN_BUFFER) as tokens, open(f'{path}.entries', 'rb', buffering=RUN_BUFFER) as entries:
+            for line in tokens:
+                token, count = line.split(b'\t')
+                yield token, run, np.frombuffer(entries.read(4 * int(count)), dtype=np.uint32)
+
+
+class SpillArray:
+    """
+    Append-only array of numbers, buffered in a temporary file.
+    Append to buffer (the object never changes, its bound append method can be kept) and call flush now and then.
+    """
+
+    def __init__(self, path: str, typecode: str, first: int = None):
+        self.path = path
+        self.typecode = typecode
+        self.file = open(path, 'w+b')
+        self.buffer = array(typecode, [] if first is None else [first])
+
+    def flush(self, force: bool = False) -> None:
+        """
+        Move the buffer to the file if it holds RUN_SIZE numbers or more.
+        """
+        if force or len(self.buffer) >= RUN_SIZE:
+            self.buffer.tofile(self.file)
+            del self.buffer[:]
+
+    def chunks(self) -> Iterator[bytes]:
+        self.flush(force=True)
+        self.file.seek(0)
+        with self.file:
+            yield from iter(lambda: self.file.read(CHUNK_SIZE), b'')
+
+    def numpy(self) -> np.ndarray:
+        """
+        :return: read-only memory map of the file, the array can no longer be appended to
+        """
+        self.flush(force=True)
+        self.file.close()
+        return np.memmap(self.path, dtype=np.dtype(self.typecode), mode='r')
+
+
+def iter_numbers(f, typecode: str) -> Iterator[int]:
+    while chunk := f.read(RUN_BUFFER):
+        yield from array(typecode, chunk)
+
+
+class HashTable:
+    """
+    Open addressing hash table with linear probing: crc32(key) -> entry.
+    """
+
+    def __init__(self, n_keys: int):
+        size = 1 << max(1, (2 * n_keys - 1).bit_length())
+        self.mask = size - 1
+        self.table = array('I', [EMPTY]) * size
+
+    def add(self, key: bytes, entry: int) -> None:
+        slot = zlib.crc32(key) & self.mask
+        while self.table[slot] != EMPTY:
+            slot = (slot + 1) & self.mask
+        self.table[slot] = entry
+
+
+class RestIndex:
+    """
+    Read-only view of rest_data/rest_index.bin. Lookups go through the hash table, prefix queries and searches
+    are binary searches over the sorted keys and tokens.
+    Instances can be pickled (the file is reopened) and shared with forked processes.
+    """
+
+    def __init__(self, path: str = None):
+        self.path = rest_index_path() if path is None else path
+        with open(self.path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        assert self._mmap[:8] == self._mmap[-8:] == MAGIC, f'Not a REST index: {self.path}'
+        footer_length = int.from_bytes(self._mmap[-16:-8], 'little')
+        self.footer = json.loads(self._mmap[-16 - footer_length:-16])
+        self.rest_files: [str] = self.footer['rest_files']  # including empty lists
+        self.namespaces: {str: (int, int)} = {name: tuple(bounds) for name, bounds in self.footer['namespaces'].items()}
+        # scalar reads go through memoryviews, they are much faster than indexing numpy arrays
+        self._key_offsets = self._view('key_offsets', 'Q')
+        self._value_spans = self._view('value_spans', 'Q')
+        self._hash_table = self._view('hash_table', 'I')
+        self._token_offsets = self._view('token_offsets', 'Q')
+        self._mask = len(self._hash_table) - 1
+        self._postings = self._section('postings', np.uint32)
+        self._posting_offsets = self._section('posting_offsets', np.uint64)
+        self._keys_start = self.footer['sections']['keys'][0]
+        self._tokens_start = self.footer['sections']['tokens'][0]
+        self.n_entries = len(self._key_offsets) - 1
+
+    def __repr__(self):
+        return f'<RestIndex: {self.path} ({self.n_entries} entries)>'
+
+    def __len__(self):
+        return self.n_entries
+
+    def __getstate__(self):
+        return dict(path=self.path)
+
+    def __setstate__(self, state):
+        self.__init__(state['path'])
+
+    def _section(self, name: str, dtype) -> np.ndarray:
+        offset, length = self.footer['sections'][name]
+        return np.frombuffer(self._mmap, dtype=dtype, count=length // np.dtype(dtype).itemsize, offset=offset)
+
+    def _view(self, name: str, fmt: str) -> memoryview:
+        offset, length = self.footer['sections'][name]
+        return memoryview(self._mmap)[offset:offset + length].cast(fmt)
+
+    def is_current(self) -> bool:
+        return self.footer['version'] == INDEX_VERSION and self.footer['sources'] == sources_fingerprint(rest_list_files())
+
+    def _key(self, i: int) -> bytes:
+        start, end = self._key_offsets[i], self._key_offsets[i + 1]
+        return self._mmap[self._keys_start + start:self._keys_start + end]
+
+    def _value(self, i: int) -> str:
+        start, end = self._value_spans[2 * i], self._value_spans[2 * i + 1]
+        return self._mmap[start:end].decode('utf-8')
+
+    def _token(self, i: int) -> bytes:
+        start, end = self._token_offsets[i], self._token_offsets[i + 1]
+        return self._mmap[self._tokens_start + start:self._tokens_start + end]
+
+    def _bisect(self, target: bytes, lo: int = 0, hi: int = None, item=None) -> int:
+        # leftmost position where target could be inserted, like bisect.bisect_left
+        item = self._key if item is None else item
+        hi = self.n_entries if hi is None else hi
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if item(mid) < target:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def _find(self, target: bytes) -> int:
+        # entry of target, -1 if target does not exist
+        slot = zlib.crc32(target) & self._mask
+        while (entry := self._hash_table[slot]) != EMPTY:
+            if self._key(entry) == target:
+                return entry
+            slot = (slot + 1) & self._mask
+        return -1
+
+    def get(self, rest_file: str, key: str, default: str = None) -> str:
+        """
+        :param rest_file: e.g. 'ko'
+        :param key: e.g. 'ko:K00844'
+        :return: description, default if key does not exist
+        """
+        i = self._find(f'{rest_file}\t{key}'.encode('utf-8'))
+        return default if i < 0 else self._value(i)
+
+    def get_many(self, items: Iterable[tuple], default: str = None) -> {(str, str): str}:
+        """
+        :param items: iterable of (rest file, key)
+        :return: dictionary: (rest file, key) -> description or default
+        """
+        return {item: self.get(*item, default=default) for item in items}
+
+    def prefix(self, rest_file: str, prefix: str = '') -> Iterator[tuple]:
+        """
+        :param prefix: e.g. 'ko:K008' or 'path:map000'
+        :return: iterator over all (key, description) of rest_file whose key starts with prefix, sorted by key
+        """
+        target = f'{rest_file}\t{prefix}'.encode('utf-8')
+        start = len(rest_file) + 1
+        for i in range(self._bisect(target), self.n_entries):
+            key = self._key(i)
+            if not key.startswith(target):
+                break
+            yield key[start:].decode('utf-8'), self._value(i)
+
+    def _token_postings(self, word: str) -> np.ndarray:
+        # entries of all tokens that start with word
+        target = word.encode('utf-8')
+        n_tokens = len(self._token_offsets) - 1
+        first = self._bisect(target, hi=n_tokens, item=self._token)
+        last = first
+        while last < n_tokens and self._token(last).startswith(target):
+            last += 1
+        start, end = int(self._posting_offsets[first]), int(self._posting_offsets[last])
+        entries = self._postings[start:end]
+        return np.unique(entries) if last - first > 1 else entries
+
+    def search(self, text: str, rest_files: [str] = None, limit: int = None) -> [(str, str, str)]:
+        """
+        Find entries by the words of their descriptions: every word of text must start a word of the description.
+        Case and punctuation are ignored, words of one character are ignored.
+
+        Example: search('hexokinase') -> [('ko', 'ko:K00844', 'HK; hexokinase [EC:2.7.1.1]'), ...]
+
+        :param rest_files: only search these REST lists, default: all
+        :param limit: maximal number of results
+        :return: list of (rest file, key, description), sorted by rest file and key
+        """
+        words = tokenize(text)
+        if not words:
+            return []
+        entries = None
+        for word in sorted(set(words), key=len, reverse=True):  # long words have short postings
+            postings = self._token_postings(word)
+            entries = postings if entries is None else np.intersect1d(entries, postings, assume_unique=True)
+            if len(entries) == 0:
+                return []
+
+        if rest_files is not None:
+            keep = np.zeros(len(entries), dtype=bool)
+            for rest_file in rest_files:
+                lo, hi = self.namespaces.get(rest_file, (0, 0))
+                keep |= (entries >= lo) & (entries < hi)
+            entries = entries[keep]
+
+        result = []
+        for i in entries[:limit].tolist():
+            rest_file, key = self._key(i).decode('utf-8').split('\t', maxsplit=1)
+            result.append((rest_file, key, self._value(i)))
+        return result
+
+    def readers(self, rest_files: [str]):  # -> {str: RestReader}
+        """
+        :return: dictionary: rest file -> RestReader, a drop-in replacement for the former cdb readers
+        """
+        for rest_file in rest_files:
+            assert rest_file in self.rest_files, f'REST list missing in {self}: {rest_file}'
+        return {rest_file: RestReader(self, rest_file) for rest_file in rest_files}
+
+
+class RestReader:
+    """
+    The entries of one REST list, with the interface of cdblib.Reader.get used by get_description.
+    """
+    __slots__ = ('index', 'rest_file')
+
+    def __init__(self, index: RestIndex, rest_file: str):
+        self.index = index
+        self.rest_file = rest_file
+
+    def __repr__(self):
+        return f'<RestReader: {self.rest_file}>'
+
+    def get(self, key: bytes, default: bytes = None) -> bytes:
+        description = self.index.get(self.rest_file, key.decode('utf-8'))
+        return default if description is None else description.encode('utf-8')
+
+    def get_many(self, keys: Iterable[str]) -> {str: str}:
+        """
+        :return: dictionary: key -> description, '' if the key does not exist
+        """
+        return {key: description for (_, key), description in
+                self.index.get_many(((self.rest_file, key) for key in keys), default='').items()}
+
+
+def open_rest_index(rebuild: bool = False) -> RestIndex:
+    """
+    Open the index, build it first if it does not exist, is outdated or if rebuild is True.
+    """
+    if not rebuild and os.path.isfile(rest_index_path()):
+        index = RestIndex()
+        if index.is_current():
+            return index
+    build_rest_index()
+    return RestIndex()
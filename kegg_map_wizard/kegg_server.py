@@ -0,0 +1,508 @@
+"""
+Local HTTP service that renders maps on request, e.g. behind a web app that colours maps for its users.
+
+    python -m kegg_map_wizard.kegg_server ko+rn+ec eco --port 8080
+
+    GET  /map/{org_string}/{map_id}.svg                    the map without colours
+    GET  /map/{org_string}/{map_id}.svgz?coloring={json}   coloured and gzip-compressed
+    POST /map/{org_string}/{map_id}.svg                    coloured, the coloring is the JSON body
+
+A coloring selects one of the KeggMap.color_* methods and passes its arguments, e.g.
+{"mode": "binary", "annotations": ["K00001", "K00002"], "color": "red"} or
+{"mode": "continuous", "annotation_to_number": {"C00033": 0.24}, "colors": ["yellow", "red"]}.
+
+The event loop only parses requests and answers If-None-Match. Maps are built, coloured and rendered in worker
+processes: each worker opens the wizards once and keeps an LRU of compiled maps (KeggMap and SvgSkeleton) within its
+share of the memory budget. Requests are routed to the workers by map, so each map is compiled by one worker only.
+The ETag of a response is derived from the sources of the map (see kegg_cache.cache_key), the format and the
+coloring, so it is known before anything is rendered. The sources are fingerprinted in a thread and reused for
+SOURCES_TTL seconds, so changes to the data directory are picked up with this delay.
+"""
+import os
+import re
+import gzip
+import json
+import zlib
+import pickle
+import asyncio
+import time
+import hashlib
+import logging
+from http import HTTPStatus
+from collections import OrderedDict
+from concurrent.futures import Executor, ThreadPoolExecutor, ProcessPoolExecutor
+from typing import NamedTuple
+from urllib.parse import urlsplit, parse_qs
+
+from kegg_map_wizard import kegg_download
+from kegg_map_wizard.kegg_download import Settings
+from kegg_map_wizard.kegg_cache import cache_key
+from kegg_map_wizard.kegg_color import Coloring
+from kegg_map_wizard.kegg_svg import SvgSkeleton
+from kegg_map_wizard.KeggMap import KeggMap
+from kegg_map_wizard.KeggMapWizard import KeggMapWizard
+
+RE_MAP_PATH = re.compile(r'^/map/([A-Za-z0-9_\-]+(?:\+[A-Za-z0-9_\-]+)*)/([0-9]{5})\.(svgz?)$')
+COLORING_MODES = ('binary', 'continuous', 'organisms', 'groups')  # see KeggMap.color_*
+GZIP_LEVEL = 6  # svgz is compressed on every request: much faster than level 9 of save_svgz, hardly larger
+MAX_BODY = 16 << 20  # bytes
+DEFAULT_MAX_BYTES = 1 << 30  # memory budget of the compiled maps of all workers
+SOURCES_TTL = 1.0  # seconds the sources of a map are reused for its ETags
+
+
+class RequestError(Exception):
+    """
+    Error that is reported to the client with an HTTP status.
+    """
+
+    def __init__(self, status: int, message: str):
+        super().__init__(status, message)  # can be pickled, i.e. raised in worker processes
+        self.status = status
+        self.message = message
+
+
+class CompiledMap(NamedTuple):
+    map: KeggMap
+    skeleton: SvgSkeleton
+    sources: dict  # kegg_cache.cache_key when the map was compiled
+    nbytes: int  # estimated memory
+
+
+class CompiledMapCache:
+    """
+    LRU of compiled maps. The least recently used maps are evicted when the estimated size of all maps exceeds
+    max_bytes; the most recent map is always kept, even if it alone exceeds max_bytes.
+    """
+
+    def __init__(self, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self._maps: OrderedDict = OrderedDict()  # (org_string, map_id) -> CompiledMap
+        self.hits = self.misses = self.evictions = 0
+
+    def __repr__(self):
+        return f'<CompiledMapCache: {len(self)} maps, {self.nbytes / 1e6:.1f} of {self.max_bytes / 1e6:.1f} MB>'
+
+    def __len__(self):
+        return len(self._maps)
+
+    def __contains__(self, key: (str, str)):
+        return key in self._maps
+
+    def get(self, key: (str, str), sources: dict) -> CompiledMap:
+        """
+        :param key: (org_string, map_id)
+        :param sources: current kegg_cache.cache_key of the map
+        :return: CompiledMap, None if it is not cached or outdated
+        """
+        compiled = self._maps.get(key)
+        if compiled is None or compiled.sources != sources:
+            self.misses += 1
+            return None
+        self._maps.move_to_end(key)
+        self.hits += 1
+        return compiled
+
+    def put(self, key: (str, str), compiled: CompiledMap) -> None:
+        previous = self._maps.pop(key, None)
+        if previous is not None:
+            self.nbytes -= previous.nbytes
+        self._maps[key] = compiled
+        self.nbytes += compiled.nbytes
+        while self.nbytes > self.max_bytes and len(self._maps) > 1:
+            _, evicted = self._maps.popitem(last=False)
+            self.nbytes -= evicted.nbytes
+            self.evictions += 1
+
+
+def estimate_nbytes(map: KeggMap, skeleton: SvgSkeleton) -> int:
+    """
+    Estimated memory of a compiled map: the chunks of the skeleton and the pickled size of the map.
+    """
+    skeleton_nbytes = sum(len(chunk) for chunk in skeleton.chunks) + len(skeleton.footer)
+    return skeleton_nbytes + len(pickle.dumps(map, protocol=pickle.HIGHEST_PROTOCOL))
+
+
+def color(map: KeggMap, coloring: dict) -> Coloring:
+    """
+    :param coloring: mode and arguments of a KeggMap.color_* method, e.g. {'mode': 'binary', 'annotations': ['K00001']}
+    """
+    arguments = dict(coloring)
+    mode = arguments.pop('mode', None)
+    if mode not in COLORING_MODES:
+        raise RequestError(400, f'Unknown coloring mode: {mode!r}, expected one of {list(COLORING_MODES)}')
+    try:
+        return getattr(map, f'color_{mode}')(**arguments)
+    except (TypeError, ValueError, AttributeError) as e:
+        raise RequestError(400, f'Invalid {mode} coloring: {e}')
+
+
+class MapRenderer:
+    """
+    Builds, compiles, colours and renders maps. There is one instance per worker, see MapServer.
+    """
+
+    def __init__(self, org_strings: [str], max_bytes: int = DEFAULT_MAX_BYTES, png_base_url: str = None, offline: bool = True):
+        """
+        :param org_strings: organism combinations that are served, e.g. ['ko+rn+ec', 'eco']
+        :param max_bytes: memory budget of the compiled maps
+        :param png_base_url: if set: reference the background images exported by KeggMapWizard.export_pngs under
+            this URL instead of embedding them
+        :param offline: passed on to KeggMapWizard; if False, missing maps are downloaded while a request waits
+        """
+        self.wizards = {org_string: KeggMapWizard(orgs=org_string.split('+'), offline=offline) for org_string in org_strings}
+        self.cache = CompiledMapCache(max_bytes=max_bytes)
+        self.png_base_url = png_base_url
+
+    def __repr__(self):
+        return f'<MapRenderer: {", ".join(self.wizards)}>'
+
+    def compiled(self, org_string: str, map_id: str) -> CompiledMap:
+        wizard = self.wizards.get(org_string)
+        if wizard is None:
+            raise RequestError(404, f'Organisms are not served: {org_string}')
+        if map_id not in wizard.all_mapids:
+            raise RequestError(404, f'Map {map_id} does not exist for {wizard}')
+        key, sources = (org_string, map_id), cache_key(wizard.orgs, map_id)
+        compiled = self.cache.get(key, sources)
+        if compiled is None:
+            map = wizard.create_map(map_id)
+            png_url = map.static_png_url(self.png_base_url) if self.png_base_url else None
+            skeleton = map.compile(png_url=png_url)
+            compiled = CompiledMap(map=map, skeleton=skeleton, sources=sources, nbytes=estimate_nbytes(map, skeleton))
+            self.cache.put(key, compiled)
+        return compiled
+
+    def render(self, org_string: str, map_id: str, fmt: str = 'svg', coloring: dict = None) -> bytes:
+        """
+        :param fmt: 'svg' or 'svgz'
+        :param coloring: see color, None: no colours
+        :return: the SVG, gzip-compressed if fmt is 'svgz'
+        """
+        compiled = self.compiled(org_string, map_id)
+        fills, defs = color(compiled.map, coloring) if coloring else ({}, None)
+        svg = compiled.skeleton.render(fills, defs)
+        return gzip.compress(svg, GZIP_LEVEL) if fmt == 'svgz' else svg
+
+
+_renderer: MapRenderer = None  # one renderer per worker
+
+
+def _init_worker(settings: Settings, org_strings: [str], max_bytes: int, png_base_url: str, offline: bool) -> None:
+    global _renderer
+    if kegg_download._settings != settings:  # e.g. spawned processes
+        kegg_download.configure(data_dir=settings.data_dir, n_parallel_downloads=settings.n_parallel_downloads,
+                                download_rate=settings.download_rate)
+    _renderer = MapRenderer(org_strings, max_bytes=max_bytes, png_base_url=png_base_url, offline=offline)
+
+
+def _ping() -> int:
+    return os.getpid()
+
+
+def _map_ids() -> {str: [str]}:
+    return {org_string: list(wizard.all_mapids) for org_string, wizard in _renderer.wizards.items()}
+
+
+def _render(org_string: str, map_id: str, fmt: str, coloring: dict) -> bytes:
+    return _renderer.render(org_string, map_id, fmt=fmt, coloring=coloring)
+
+
+def parse_coloring(raw) -> dict:
+    """
+    :param raw: JSON (str or bytes), None or empty if the map is not coloured
+    :return: coloring, see color
+    """
+    if not raw:
+        return None
+    try:
+        coloring = json.loads(raw)
+    except ValueError as e:
+        raise RequestError(400, f'Coloring is not valid JSON: {e}')
+    if not isinstance(coloring, dict) or coloring.get('mode') not in COLORING_MODES:
+        raise RequestError(400, f'Coloring must be a JSON object with a "mode" in {list(COLORING_MODES)}')
+    return coloring
+
+
+def make_etag(sources: dict, fmt: str, coloring: dict, png_base_url: str = None) -> str:
+    """
+    Strong ETag of a response, changes whenever one of the sources of the map changes.
+
+    :param sources: kegg_cache.cache_key of the map
+    """
+    key = [sources, fmt, coloring, png_base_url]
+    return '"' + hashlib.sha256(json.dumps(key, sort_keys=True).encode('utf-8')).hexdigest()[:32] + '"'
+
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    if not if_none_match:
+        return False
+    candidates = [candidate.strip().removeprefix('W/') for candidate in if_none_match.split(',')]
+    return '*' in candidates or etag in candidates
+
+
+class Request(NamedTuple):
+    method: str
+    target: str  # path and query
+    version: str
+    headers: {str: str}  # lower-case names
+    body: bytes
+
+    @property
+    def keep_alive(self) -> bool:
+        connection = self.headers.get('connection', '').lower()
+        return connection != 'close' if self.version == 'HTTP/1.1' else connection == 'keep-alive'
+
+
+class Response(NamedTuple):
+    status: int
+    headers: {str: str}
+    body: bytes = b''
+
+
+def error_response(status: int, message: str) -> Response:
+    return Response(status, {'Content-Type': 'text/plain; charset=utf-8'}, f'{message}\n'.encode('utf-8'))
+
+
+async def read_request(reader: asyncio.StreamReader) -> Request:
+    """
+    :return: Request, None if the client closed the connection
+    """
+    try:
+        head = await reader.readuntil(b'\r\n\r\n')
+    except asyncio.IncompleteReadError as e:
+        if not e.partial:
+            return None
+        raise RequestError(400, 'Incomplete request')
+    except asyncio.LimitOverrunError:
+        raise RequestError(431, 'Request header too large')
+
+    request_line, *header_lines = head.decode('latin-1').split('\r\n')
+    try:
+        method, target, version = request_line.split(' ')
+    except ValueError:
+        raise RequestError(400, f'Malformed request line: {request_line!r}')
+    headers = {}
+    for line in header_lines:
+        if line:
+            name, _, value = line.partition(':')
+            headers[name.strip().lower()] = value.strip()
+
+    if 'transfer-encoding' in headers:
+        raise RequestError(411, 'Chunked request bodies are not supported, send Content-Length')
+    try:
+        length = int(headers.get('content-length', 0))
+    except ValueError:
+        raise RequestError(400, f'Invalid Content-Length: {headers["content-length"]!r}')
+    if length > MAX_BODY:
+        raise RequestError(413, f'Request body too large: {length} > {MAX_BODY} bytes')
+    try:
+        body = await reader.readexactly(length) if length else b''
+    except asyncio.IncompleteReadError:
+        raise RequestError(400, 'Incomplete request body')
+    return Request(method, target, version, headers, body)
+
+
+async def write_response(writer: asyncio.StreamWriter, response: Response, keep_alive: bool = True, head: bool = False) -> None:
+    headers = dict(response.headers)
+    if response.status != 304:
+        headers['Content-Length'] = str(len(response.body))
+    headers['Connection'] = 'keep-alive' if keep_alive else 'close'
+    lines = [f'HTTP/1.1 {response.status} {HTTPStatus(response.status).phrase}']
+    lines.extend(f'{name}: {value}' for name, value in headers.items())
+    writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1'))
+    if not head and response.status != 304:
+        writer.write(response.body)
+    await writer.drain()
+
+
+class MapServer:
+    """
+    asyncio HTTP server that renders maps in a pool of workers, see the module docstring.
+
+    Example:
+        server = MapServer(['ko+rn+ec'], workers=4)
+        host, port = await server.start(port=8080)
+        ...
+        await server.close()
+    """
+
+    def __init__(self, org_strings: [str], workers: int = None, max_bytes: int = DEFAULT_MAX_BYTES,
+                 png_base_url: str = None, offline: bool = True, sources_ttl: float = SOURCES_TTL):
+        """
+        :param org_strings: organism combinations that are served, e.g. ['ko+rn+ec', 'eco']
+        :param workers: number of worker processes, default: number of CPUs;
+            if 0: render in one thread of this process
+        :param max_bytes: memory budget of the compiled maps, shared equally by the workers
+        :param png_base_url: see MapRenderer
+        :param offline: see MapRenderer; the data directory should be complete, e.g. after KeggMapWizard.download_maps
+        :param sources_ttl: seconds the sources of a map are reused for its ETags, 0: check them on every request
+        """
+        assert org_strings, 'No organisms to serve'
+        self.org_strings = list(org_strings)
+        self.workers = os.cpu_count() if workers is None else workers
+        self.max_bytes = max_bytes
+        self.png_base_url = png_base_url
+        self.offline = offline
+        self.sources_ttl = sources_ttl
+        self._executors: [Executor] = []
+        self._map_ids: {str: {str}} = {}  # org string -> map ids, from the wizards of the workers
+        self._sources: {(str, str): (float, dict)} = {}  # (org string, map id) -> (expiry, kegg_cache.cache_key)
+        self._pending: {str: asyncio.Future} = {}  # ETag -> rendering in progress, shared by identical requests
+        self._server: asyncio.AbstractServer = None
+        self.n_requests = self.n_not_modified = self.n_rendered = 0
+
+    def __repr__(self):
+        return f'<MapServer: {", ".join(self.org_strings)} ({self.workers} workers)>'
+
+    async def start(self, host: str = '127.0.0.1', port: int = 8080) -> (str, int):
+        """
+        Start the workers, wait until they have opened their wizards, then accept connections.
+
+        :param port: 0: any free port
+        :return: (host, port) the server listens on
+        """
+        from kegg_map_wizard.kegg_rest_index import open_rest_index
+        open_rest_index()  # (re-)build the index here, not concurrently in every worker
+
+        n_executors = max(self.workers, 1)
+        initargs = (kegg_download.settings(), self.org_strings, self.max_bytes // n_executors, self.png_base_url, self.offline)
+        if self.workers == 0:
+            self._executors = [ThreadPoolExecutor(max_workers=1, initializer=_init_worker, initargs=initargs)]
+        else:
+            self._executors = [ProcessPoolExecutor(max_workers=1, initializer=_init_worker, initargs=initargs)
+                               for _ in range(n_executors)]
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(*(loop.run_in_executor(executor, _ping) for executor in self._executors))
+        map_ids = await loop.run_in_executor(self._executors[0], _map_ids)
+        self._map_ids = {org_string: set(ids) for org_string, ids in map_ids.items()}
+
+        self._server = await asyncio.start_server(self._handle, host, port)
+        return self._server.sockets[0].getsockname()[:2]
+
+    async def close(self) -> None:
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+        for executor in self._executors:
+            executor.shutdown()
+        self._executors = []
+
+    def _executor(self, org_string: str, map_id: str) -> Executor:
+        # the same map always goes to the same worker
+        return self._executors[zlib.crc32(f'{org_string}/{map_id}'.encode('utf-8')) % len(self._executors)]
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            while True:
+                try:
+                    request = await read_request(reader)
+                except RequestError as e:
+                    await write_response(writer, error_response(e.status, e.message), keep_alive=False)
+                    break
+                if request is None:
+                    break
+                response = await self.respond(request)
+                await write_response(writer, response, keep_alive=request.keep_alive, head=request.method == 'HEAD')
+                if not request.keep_alive:
+                    break
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def respond(self, request: Request) -> Response:
+        self.n_requests += 1
+        try:
+            return await self._respond(request)
+        except RequestError as e:
+            return error_response(e.status, e.message)
+        except Exception as e:
+            logging.exception(f'Failed to answer {request.method} {request.target}')
+            return error_response(500, f'{type(e).__name__}: {e}')
+
+    async def _respond(self, request: Request) -> Response:
+        url = urlsplit(request.target)
+        match = RE_MAP_PATH.match(url.path)
+        if match is None:
+            raise RequestError(404, f'Not found: {url.path}, expected /map/{{org_string}}/{{map_id}}.svg[z]')
+        if request.method not in ('GET', 'HEAD', 'POST'):
+            raise RequestError(405, f'Method not allowed: {request.method}')
+        org_string, map_id, fmt = match.groups()
+        if org_string not in self.org_strings:
+            raise RequestError(404, f'Organisms are not served: {org_string}')
+        if map_id not in self._map_ids[org_string]:  # before the ETag: If-None-Match: * must not match
+            raise RequestError(404, f'Map {map_id} does not exist for {org_string}')
+
+        if request.method == 'POST':
+            coloring = parse_coloring(request.body)
+        else:
+            coloring = parse_coloring(parse_qs(url.query).get('coloring', [None])[-1])
+
+        etag = make_etag(await self.sources(org_string, map_id), fmt, coloring, self.png_base_url)
+        headers = {'Content-Type': 'image/svg+xml', 'ETag': etag, 'Cache-Control': 'no-cache'}
+        if fmt == 'svgz':
+            headers['Content-Encoding'] = 'gzip'
+        if etag_matches(request.headers.get('if-none-match'), etag):
+            self.n_not_modified += 1
+            return Response(304, headers)
+        return Response(200, headers, await self._render(etag, org_string, map_id, fmt, coloring))
+
+    async def sources(self, org_string: str, map_id: str) -> dict:
+        """
+        :return: kegg_cache.cache_key of the map, at most sources_ttl seconds old; it stats every source file,
+            so it is computed in a thread
+        """
+        expiry, sources = self._sources.get((org_string, map_id), (0, None))
+        if time.monotonic() >= expiry:
+            loop = asyncio.get_running_loop()
+            sources = await loop.run_in_executor(None, cache_key, org_string.split('+'), map_id)
+            self._sources[(org_string, map_id)] = (time.monotonic() + self.sources_ttl, sources)
+        return sources
+
+    async def _render(self, etag: str, org_string: str, map_id: str, fmt: str, coloring: dict) -> bytes:
+        future = self._pending.get(etag)
+        if future is None:
+            loop = asyncio.get_running_loop()
+            future = loop.run_in_executor(self._executor(org_string, map_id), _render, org_string, map_id, fmt, coloring)
+            self._pending[etag] = future
+            future.add_done_callback(lambda _: self._pending.pop(etag, None))
+            self.n_rendered += 1
+        return await asyncio.shield(future)  # a client that disconnects does not cancel the others
+
+
+async def serve(org_strings: [str], host: str = '127.0.0.1', port: int = 8080, **kwargs) -> None:
+    """
+    Run a MapServer until the task is cancelled, see MapServer for kwargs.
+    """
+    server = MapServer(org_strings, **kwargs)
+    host, port = await server.start(host=host, port=port)
+    logging.warning(f'{server} listening on http://{host}:{port}/map/{{org_string}}/{{map_id}}.svg')
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await server.close()
+
+
+def main(argv: [str] = None) -> None:
+    import argparse
+    parser = argparse.ArgumentParser(description='Render KEGG maps over HTTP.')
+    parser.add_argument('org_strings', nargs='+', help="organism combinations, e.g. 'ko+rn+ec' 'eco'")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--workers', type=int, default=None, help='default: number of CPUs, 0: no worker processes')
+    parser.add_argument('--max-mb', type=float, default=DEFAULT_MAX_BYTES / 1e6, help='memory budget of the compiled maps')
+    parser.add_argument('--png-base-url', default=None, help='reference the PNGs exported by export_pngs under this URL')
+    parser.add_argument('--online', action='store_true', help='download missing maps while a request waits')
+    args = parser.parse_args(argv)
+    try:
+        asyncio.run(serve(
+            args.org_strings, host=args.host, port=args.port, workers=args.workers, max_bytes=int(args.max_mb * 1e6),
+            png_base_url=args.png_base_url, offline=not args.online
+        ))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,256 @@
+"""
+Fast SVG serializer for KeggMaps.
+
+Produces exactly the same output as template/map.svg (and the shape templates) without setting up a
+Jinja render context per shape: every shape is written as static fragments around the fill/stroke colour,
+the shapes are bucketed by type in a single pass and each bucket is emitted with a single join.
+
+The templates remain the reference: tests/test_kegg_svg.py checks that both produce identical bytes.
+
+For repeated recolouring, compile_map turns a map into an SvgSkeleton whose static parts are rendered once.
+"""
+import os
+import pickle
+from typing import Callable, Iterator
+
+from markupsafe import escape
+
+from kegg_map_wizard.KeggShape import KeggShape, Poly, Circle, Rect, Line
+
+SHAPE_SEPARATOR = '\n        '
+
+# shapes are drawn in this order: lines in background (they sometimes go through polys),
+# smallest objects in foreground
+DRAW_ORDER = (Line, Poly, Rect, Circle)
+
+MAP_HEADER = '''<svg id="kegg-svg-{map_id}" title="{title}" width="{width}" height="{height}" version="1.1" baseProfile="full"
+     xmlns="http://www.w3.org/2000/svg" xmlns:xlink="http://www.w3.org/1999/xlink">
+    <style>.shape {{ cursor: pointer }}</style>
+    <g name="shapes">
+        '''
+
+BACKGROUND_HEADER = '''
+    </g>
+    <defs>
+        <pattern id="{id}"
+                 width="{width}" height="{height}" patternUnits="userSpaceOnUse"
+                 style="pointer-events: none">
+            <image x="0" y="0" width="{width}" height="{height}" style="pointer-events: none"
+                   xlink:href="'''
+
+BACKGROUND_FOOTER = '''"/>
+        </pattern>
+    </defs>
+    <rect fill="url(#{id})"
+          width="{width}" height="{height}"
+          style="pointer-events: none"/>
+    <defs id="shape-color-defs">'''
+
+MAP_FOOTER = '''
+    </defs>
+
+</svg>'''
+
+
+def _common_attributes(shape: KeggShape, extra: str = '') -> str:
+    """
+    Attributes every shape template writes from title="..." up to data-annotations (inclusive).
+    """
+    bbox = f" data-bbox='{shape.bbox.serialized()}'" if shape.bbox else ''
+    classes = ' '.join(shape.classes())
+    return f'title="{shape.description}" class="shape {classes}"{extra}{bbox} ' \
+           f"data-annotations='{shape.annotations_serialized()}' "
+
+
+def shape_fragments(shape: KeggShape) -> (str, str):
+    """
+    Split the SVG of a shape into the static parts before and after its colour.
+
+    :return: (head, tail) such that head + color + tail == shape.svg(color_function)
+    """
+    if type(shape) is Line:
+        attributes = _common_attributes(shape, extra=' data-apply-color-to="stroke"')
+        return '<path  stroke="', f'"  {attributes}fill="none" stroke-width="10" d="{shape.coords}"/>'
+    attributes = _common_attributes(shape)
+    if type(shape) is Poly:
+        return '<polygon fill="', f'"  {attributes}stroke="transparent" stroke-width="3" points="{shape.coords}"/>'
+    if type(shape) is Rect:
+        return '<rect fill="', f'" {attributes}{shape.coords}/>'
+    if type(shape) is Circle:
+        return '<circle fill="', f'" {attributes}{shape.coords}/>'
+    raise AssertionError(f'Cannot serialize shape of type {type(shape)}: {shape}')
+
+
+def shapes_svg(shapes: [KeggShape], color_function: Callable) -> str:
+    """
+    Serialize shapes of one type, separated like in template/map.svg.
+    """
+    parts = []
+    for shape in shapes:
+        try:
+            head, tail = shape_fragments(shape)
+            parts.append(f'{head}{color_function(shape)}{tail}{SHAPE_SEPARATOR}')
+        except Exception as e:
+            e.args = tuple([f'Failed to render shape: {shape}!\n{str(e)}'])
+            raise e
+    return ''.join(parts)
+
+
+def sort_shapes(shapes: [KeggShape]) -> {type: [KeggShape]}:
+    """
+    Bucket shapes by type in a single pass, keeping their order.
+    """
+    buckets = {shape_type: [] for shape_type in DRAW_ORDER}
+    for shape in shapes:
+        if type(shape) in buckets:
+            buckets[type(shape)].append(shape)
+    return buckets
+
+
+def iter_map_svg(map, color_function: Callable, png_url: str = None) -> Iterator[str]:
+    """
+    Serialize a KeggMap piece by piece, byte-identical to MAP_TEMPLATE.generate(map=map, ...).
+
+    :param map: KeggMap
+    :param color_function: function that receives a KeggShape and returns a colour
+    :param png_url: URL of the background image, see KeggMap.static_png_url; if None: embed it as base64
+    """
+    yield MAP_HEADER.format(map_id=map.map_id, title=map.title, width=map.width, height=map.height)
+
+    buckets = sort_shapes(map.shapes.values())
+    yield SHAPE_SEPARATOR.join(shapes_svg(buckets[shape_type], color_function) for shape_type in DRAW_ORDER)
+
+    yield BACKGROUND_HEADER.format(id=map.id, width=map.width, height=map.height)
+    if png_url:
+        yield str(escape(png_url))
+    else:
+        yield 'data:image/png;base64,'
+        yield from map.iter_encoded_png()
+    yield BACKGROUND_FOOTER.format(id=map.id, width=map.width, height=map.height)
+
+    yield ''.join(
+        f'{SHAPE_SEPARATOR}{shape.definition}'
+        for shape in map.shapes.values() if getattr(shape, 'definition', None)
+    )
+    yield MAP_FOOTER
+
+
+class SvgSkeleton:
+    """
+    Immutable, precompiled SVG of a KeggMap: static byte chunks interleaved with one fill slot per shape,
+    followed by a slot for the colour definitions (e.g. gradients). Create it with KeggMap.compile().
+
+    Rendering only concatenates, so recolouring a map costs a dictionary lookup per shape.
+    Skeletons are plain Python objects and can be pickled (see save/load).
+    """
+
+    def __init__(self, map_id: str, chunks: [bytes], shape_ids: [str], definition_order: [str], footer: bytes,
+                 default_fill: str = 'transparent'):
+        assert len(chunks) == len(shape_ids) + 1, f'{len(chunks)=} does not match {len(shape_ids)=}'
+        self.map_id = map_id
+        self.chunks = tuple(chunks)
+        self.shape_ids = tuple(shape_ids)  # in draw order
+        self.definition_order = tuple(definition_order)  # order of definitions in the original template
+        self.footer = footer
+        self.default_fill = default_fill
+
+    def __repr__(self):
+        return f'<SvgSkeleton: {self.map_id} ({len(self.shape_ids)} shapes)>'
+
+    def __setattr__(self, key, value):
+        if key in self.__dict__:
+            raise AttributeError(f'{self} is immutable')
+        super().__setattr__(key, value)
+
+    def iter_render(self, fills: {str: str}, defs: {str: str} = None) -> Iterator[bytes]:
+        """
+        Fill the slots of the skeleton.
+
+        :param fills: dictionary: shape id (shape.hash) -> colour; missing shapes get default_fill
+        :param defs: dictionary: shape id -> definition, e.g. ColorMaker.svg_gradient(...)
+        :return: iterator over the parts of the SVG, b''.join(...) equals map.svg(...).encode()
+        """
+        default_fill = self.default_fill
+        encoded = {}  # there are typically only few distinct colours
+        parts = [b''] * (2 * len(self.shape_ids) + 1)
+        parts[0::2] = self.chunks
+        colors = [fills.get(shape_id, default_fill) for shape_id in self.shape_ids]
+        for color in set(colors):
+            encoded[color] = str(color).encode('utf-8')
+        parts[1::2] = [encoded[color] for color in colors]
+        yield from parts
+        if defs:
+            yield ''.join(
+                f'{SHAPE_SEPARATOR}{defs[shape_id]}'
+                for shape_id in self.definition_order if defs.get(shape_id)
+            ).encode('utf-8')
+        yield self.footer
+
+    def render(self, fills: {str: str}, defs: {str: str} = None) -> bytes:
+        return b''.join(self.iter_render(fills, defs))
+
+    def render_function(self, map, color_function: Callable) -> bytes:
+        """
+        Render with a regular color_function, like map.svg(color_function).encode().
+
+        :param map: the KeggMap this skeleton was compiled from
+        """
+        fills = {shape.hash: color_function(shape) for shape in map.shapes.values()}
+        defs = {shape.hash: getattr(shape, 'definition', None) for shape in map.shapes.values()}
+        return self.render(fills, defs)
+
+    def save(self, path: str) -> None:
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(self, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str):  # -> SvgSkeleton
+        with open(path, 'rb') as f:
+            skeleton = pickle.load(f)
+        assert isinstance(skeleton, cls), f'{path} does not contain a {cls.__name__}'
+        return skeleton
+
+
+def compile_map(map, png_url: str = None, default_fill: str = 'transparent') -> SvgSkeleton:
+    """
+    Compile a KeggMap into an SvgSkeleton, see KeggMap.compile.
+    """
+    chunks, shape_ids = [], []
+    current = [MAP_HEADER.format(map_id=map.map_id, title=map.title, width=map.width, height=map.height)]
+
+    buckets = sort_shapes(map.shapes.values())
+    for i, shape_type in enumerate(DRAW_ORDER):
+        for shape in buckets[shape_type]:
+            try:
+                head, tail = shape_fragments(shape)
+            except Exception as e:
+                e.args = tuple([f'Failed to compile shape: {shape}!\n{str(e)}'])
+                raise e
+            current.append(head)
+            chunks.append(''.join(current).encode('utf-8'))
+            shape_ids.append(shape.hash)
+            current = [tail, SHAPE_SEPARATOR]
+        if i < len(DRAW_ORDER) - 1:
+            current.append(SHAPE_SEPARATOR)
+
+    current.append(BACKGROUND_HEADER.format(id=map.id, width=map.width, height=map.height))
+    if png_url:
+        current.append(str(escape(png_url)))
+    else:
+        current.append('data:image/png;base64,')
+        current.extend(map.iter_encoded_png())
+    current.append(BACKGROUND_FOOTER.format(id=map.id, width=map.width, height=map.height))
+    chunks.append(''.join(current).encode('utf-8'))
+
+    assert len(set(shape_ids)) == len(shape_ids), f'Shape ids of {map} are not unique!'
+
+    return SvgSkeleton(
+        map_id=map.map_id,
+        chunks=chunks,
+        shape_ids=shape_ids,
+        definition_order=[shape.hash for shape in map.shapes.values()],
+        footer=MAP_FOOTER.encode('utf-8'),
+        default_fill=default_fill
+    )
@@ -1,8 +1,12 @@
 import os
 import re
 import json
+import mmap
+import base64
+import struct
+from functools import lru_cache
 from math import floor, ceil
-from jinja2 import Template
+from typing import Iterator
 
 ROOT = os.path.dirname(__file__)
 
@@ -15,22 +19,100 @@ def round_down(number: float, digits: int = 5) -> float:
     return floor((10 ** digits) * number) / (10 ** digits)
 
 
-def load_template(name: str) -> Template:
+@lru_cache(maxsize=None)
+def load_template(name: str):  # -> jinja2.Template
+    """
+    Read and compile template/{name}.svg on first use.
+    """
+    from jinja2 import Template
     with open(f'{ROOT}/template/{name}.svg') as f:
         template = f.read()
         return Template(template)
 
 
-def load_png(png_path: str) -> json:
+TEMPLATE_NAMES = dict(MAP_TEMPLATE='map', LINE_TEMPLATE='line', RECT_TEMPLATE='rect', POLY_TEMPLATE='poly',
+                      CIRCLE_TEMPLATE='circle')
+
+
+def __getattr__(name: str):
+    # the templates used to be compiled at import, they are now compiled when first used
+    if name in TEMPLATE_NAMES:
+        return load_template(TEMPLATE_NAMES[name])
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+
+
+class PngSidecar:
+    """
+    Transparent version of a map PNG, stored next to it as {png_path}.sidecar:
+    a fixed-size header (magic, format version, width, height) followed by the raw PNG bytes.
+
+    Opening a sidecar only reads the header. The PNG bytes are memory-mapped on first access.
+    """
+    HEADER = struct.Struct('>4sHII')  # magic, version, width, height
+    MAGIC = b'KMWP'
+    VERSION = 1
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, 'rb') as f:
+            magic, version, self.width, self.height = self.HEADER.unpack(f.read(self.HEADER.size))
+        assert magic == self.MAGIC and version == self.VERSION, f'Not a PNG sidecar (version {self.VERSION}): {path}'
+        self._mmap = None
+
+    @classmethod
+    def write(cls, path: str, png: bytes, width: int, height: int) -> None:
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(cls.HEADER.pack(cls.MAGIC, cls.VERSION, width, height))
+            f.write(png)
+        os.replace(tmp_path, path)  # atomic: open memory maps keep the previous version
+
+    @property
+    def png(self) -> memoryview:
+        if self._mmap is None:
+            with open(self.path, 'rb') as f:
+                self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return memoryview(self._mmap)[self.HEADER.size:]
+
+    def iter_base64(self, chunk_size: int = 1 << 16) -> Iterator[str]:
+        """
+        Yield the base64-encoded PNG in chunks of chunk_size characters.
+
+        :param chunk_size: must be a multiple of 4
+        """
+        assert chunk_size % 4 == 0, f'chunk_size must be a multiple of 4: {chunk_size}'
+        png, n_bytes = self.png, chunk_size // 4 * 3
+        for start in range(0, len(png), n_bytes):
+            yield base64.b64encode(png[start:start + n_bytes]).decode('ascii')
+
+    def base64(self) -> str:
+        return base64.b64encode(self.png).decode('ascii')
+
+
+def png_sidecar_path(png_path: str) -> str:
+    return png_path + '.sidecar'
+
+
+def migrate_png_json(png_path: str, remove: bool = True) -> None:
+    """
+    Convert a sidecar of the former format, {png_path}.json with the base64-encoded image, to a PngSidecar.
+
+    :param remove: if True: delete the .json file afterwards
+    """
     with open(png_path + '.json') as f:
-        return json.load(f)
+        png_json = json.load(f)
+    PngSidecar.write(png_sidecar_path(png_path), base64.b64decode(png_json['image']), png_json['width'], png_json['height'])
+    if remove:
+        os.remove(png_path + '.json')
+
 
+def load_png(png_path: str) -> dict:
+    """
+    :return: dict(width=..., height=..., image=base64-encoded PNG)
+    """
+    sidecar = PngSidecar(png_sidecar_path(png_path))
+    return dict(width=sidecar.width, height=sidecar.height, image=sidecar.base64())
 
-MAP_TEMPLATE = load_template('map')
-LINE_TEMPLATE = load_template('line')
-RECT_TEMPLATE = load_template('rect')
-POLY_TEMPLATE = load_template('poly')
-CIRCLE_TEMPLATE = load_template('circle')
 
 ANNOTATION_SETTINGS = dict(
     K=dict(
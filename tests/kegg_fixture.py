@@ -0,0 +1,240 @@
+"""
+Synthetic KEGG_MAP_WIZARD_DATA directory for tests that must run without network access.
+"""
+import os
+import json
+import time
+import hashlib
+import threading
+from io import BytesIO
+from contextlib import contextmanager
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from random import Random
+from tempfile import TemporaryDirectory
+
+from PIL import Image
+
+from kegg_map_wizard import kegg_download
+from kegg_map_wizard.kegg_download import encode_png
+
+MAPS = {
+    '00010': 'Glycolysis / Gluconeogenesis',
+    '00400': 'Phenylalanine, tyrosine and tryptophan biosynthesis',
+    '01100': 'Metabolic pathways',
+}
+
+
+def _rest_data(n: int) -> {str: [str]}:
+    return {
+        'path': [f'path:map{map_id}\t{title}' for map_id, title in MAPS.items()],
+        'ko': [f'ko:K{i:05d}\tgene{i}; enzyme number {i}' for i in range(n)],
+        'rn': [f'rn:R{i:05d}\treaction {i}' for i in range(n)],
+        'compound': [f'cpd:C{i:05d}\tcompound {i}; alias {i}' for i in range(n)],
+        'enzyme': [f'ec:1.1.1.{i}\tenzyme {i}' for i in range(n)],
+        'eco': [f'eco:b{i:04d}\tgene{i}; protein {i}' for i in range(n)],
+        'drug': ['dr:D00001\tdrug 1'],
+        'glycan': ['gl:G00001\tglycan 1'],
+        'dgroup': ['dg:DG00001\tdrug group 1'],
+        'br': ['br:08003\tbrite 1'],
+        'rc': ['rc:RC00001\treaction class 1'],
+        'ec': [],
+    }
+
+
+def _eco_ko_links(n: int) -> [str]:
+    # like link/eco/ko: the genes of eco have the same numbers as their KOs, as in the .conf files below
+    return [f'ko:K{i:05d}\teco:b{i:04d}' for i in range(n)]
+
+
+def _conf_lines(map_id: str, org: str, n_shapes: int) -> [str]:
+    rnd = Random(int(map_id))  # same geometry for every org
+    lines = []
+    for i in range(n_shapes):
+        kind = i % 4
+        x, y = rnd.randint(10, 1100), rnd.randint(10, 800)
+        ids = rnd.sample(range(100), rnd.randint(1, 3))
+        if kind == 0:
+            position = f'rect ({x},{y}) ({x + 46},{y + 17})'
+            annos = {
+                'ko': [f'K{i:05d}' for i in ids],
+                'rn': [f'R{i:05d}' for i in ids],
+                'ec': [f'1.1.1.{i}' for i in ids],
+                'eco': [f'eco:b{i:04d}' for i in ids],
+            }[org]
+            lines.append(f'{position}\t/dbget-bin/www_bget?{"+".join(annos)}\t{", ".join(annos)}')
+        elif kind == 1:
+            position = f'circle ({x},{y}) 4'
+            lines.append(f'{position}\t/dbget-bin/www_bget?C{ids[0]:05d}\tC{ids[0]:05d} (compound {ids[0]})')
+        elif kind == 2:
+            position = f'line ({x},{y},{x + 40},{y},{x + 40},{y + 30}) 2'
+            annos = [f'R{i:05d}' for i in ids]
+            lines.append(f'{position}\t/dbget-bin/www_bget?{"+".join(annos)}\t{", ".join(annos)}')
+        else:
+            position = f'poly ({x},{y},{x + 9},{y + 3},{x},{y + 6})'
+            lines.append(f'{position}\t/kegg-bin/show_pathway?map00400\tmap00400')
+    return lines
+
+
+def make_data_dir(data_dir: str, orgs=('ko', 'rn', 'ec', 'eco'), n_shapes: int = 200, png_size=(1200, 900)) -> str:
+    """
+    Populate data_dir like KeggMapWizard.download_maps would.
+
+    :param data_dir: existing directory
+    :param orgs: organisms for which to create .conf files
+    :param n_shapes: number of shapes per map and organism
+    :param png_size: width and height of the map PNGs
+    :return: data_dir
+    """
+    os.makedirs(f'{data_dir}/rest_data', exist_ok=True)
+    os.makedirs(f'{data_dir}/maps_png', exist_ok=True)
+
+    for file, lines in _rest_data(n=100).items():
+        with open(f'{data_dir}/rest_data/{file}.tsv', 'w') as f:
+            f.writelines(line + '\n' for line in lines)
+
+    for map_id in MAPS:
+        png_path = f'{data_dir}/maps_png/{map_id}.png'
+        img = Image.new('RGB', png_size, (255, 255, 255))
+        rnd = Random(int(map_id))
+        for _ in range(200):
+            x, y = rnd.randrange(png_size[0] - 50), rnd.randrange(png_size[1] - 20)
+            img.paste((rnd.randrange(255), 0, 0), (x, y, x + 46, y + 17))
+        img.save(png_path)
+        encode_png(png_path)
+
+    for org in orgs:
+        os.makedirs(f'{data_dir}/maps_data/{org}', exist_ok=True)
+        for map_id in MAPS:
+            with open(f'{data_dir}/maps_data/{org}/{map_id}.conf', 'w') as f:
+                f.writelines(line + '\n' for line in _conf_lines(map_id, org, n_shapes))
+        with open(f'{data_dir}/maps_data/{org}/non-existent.json', 'w') as f:
+            json.dump([], f)
+
+    return data_dir
+
+
+def build_cdb(path: str) -> str:
+    """
+    Write the cdb file of a REST list, as REST lists were stored before kegg_rest_index. Baseline for its tests and
+    benchmark.
+    """
+    import cdblib
+    with open(path) as in_f, open(f'{path}.cdb', 'wb') as out_f, cdblib.Writer(out_f) as writer:
+        for line in in_f:
+            key, value = kegg_download.split(line.strip())
+            writer.put(key.encode('utf-8'), value.encode('utf-8'))
+    return f'{path}.cdb'
+
+
+def open_cdb(path: str):  # -> cdblib.Reader
+    import cdblib
+    return cdblib.Reader.from_file_path(f'{path}.cdb')
+
+
+@contextmanager
+def fake_data_dir(**kwargs):
+    """
+    Temporarily point kegg_map_wizard at a synthetic data directory.
+    """
+    previous = kegg_download._settings
+    with TemporaryDirectory() as data_dir:
+        make_data_dir(data_dir, **kwargs)
+        kegg_download._settings = kegg_download.Settings(data_dir=data_dir, n_parallel_downloads=6, download_rate=2.)
+        try:
+            yield data_dir
+        finally:
+            kegg_download._settings = previous
+
+
+class KeggStandIn:
+    """
+    Local HTTP server that imitates rest.kegg.jp and the KEGG map PNGs.
+
+    Serves /list/{file}, /get/{org}{map_id}/conf and /map{map_id}.png from the synthetic data,
+    answers 404 with an empty body for everything else.
+    """
+
+    def __init__(self, orgs=('ko', 'rn', 'ec', 'eco'), n_shapes: int = 50, delay: float = 0, etags: bool = True):
+        """
+        :param delay: seconds to wait before each response
+        :param etags: if True: send ETags and answer matching If-None-Match headers with 304
+        """
+        self.delay = delay
+        self.etags = etags
+        self.files = {f'/list/{file}': '\n'.join(lines) + '\n' for file, lines in _rest_data(n=100).items()}
+        for org in orgs:
+            for map_id in MAPS:
+                self.files[f'/get/{org}{map_id}/conf'] = '\n'.join(_conf_lines(map_id, org, n_shapes)) + '\n'
+        self.files['/link/eco/ko'] = '\n'.join(_eco_ko_links(n=100)) + '\n'
+        for map_id in MAPS:
+            buffer = BytesIO()
+            Image.new('RGB', (300, 200), (255, 255, 255)).save(buffer, 'PNG')
+            self.files[f'/map{map_id}.png'] = buffer.getvalue()
+        self.failures = {}  # path -> list of status codes, 'stall' or 'truncate' to answer before serving the file
+        self.stall = 1  # seconds to wait before answering a 'stall' failure
+        self.requests = []  # paths of all requests
+        self.concurrent = self.max_concurrent = 0
+        self.lock = threading.Lock()
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), self._handler())
+        self.url = f'http://127.0.0.1:{self.server.server_port}'
+
+    def _handler(self):
+        stand_in = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                with stand_in.lock:
+                    stand_in.requests.append(self.path)
+                    stand_in.concurrent += 1
+                    stand_in.max_concurrent = max(stand_in.max_concurrent, stand_in.concurrent)
+                    failures = stand_in.failures.get(self.path)
+                    status = failures.pop(0) if failures else None
+                try:
+                    time.sleep(stand_in.stall if status == 'stall' else stand_in.delay)
+                    body = stand_in.files.get(self.path, b'')
+                    if isinstance(body, str):
+                        body = body.encode('utf-8')
+                    if status == 'truncate':  # announce the whole file, send half of it and close
+                        self.send_response(200)
+                        self.send_header('Content-Length', str(len(body)))
+                        self.end_headers()
+                        self.wfile.write(body[:len(body) // 2])
+                        self.close_connection = True
+                        return
+                    if status in (None, 'stall'):
+                        status = 200 if self.path in stand_in.files else 404
+                    else:
+                        body = b'Service unavailable'
+                    etag = f'"{hashlib.sha1(body).hexdigest()}"'
+                    if status == 200 and stand_in.etags and self.headers.get('If-None-Match') == etag:
+                        status, body = 304, b''
+                    self.send_response(status)
+                    if status in (200, 304) and stand_in.etags:
+                        self.send_header('ETag', etag)
+                    if status in (429, 503):
+                        self.send_header('Retry-After', '0')
+                    self.send_header('Content-Length', str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+                except ConnectionError:
+                    pass  # the client gave up, e.g. after a 'stall'
+                finally:
+                    with stand_in.lock:
+                        stand_in.concurrent -= 1
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def __enter__(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self._previous = kegg_download.KEGG_REST_URL, kegg_download.KEGG_PNG_URL, kegg_download._rate_limiter
+        kegg_download.KEGG_REST_URL = kegg_download.KEGG_PNG_URL = self.url
+        kegg_download._rate_limiter = kegg_download.RateLimiter(rate=1000)
+        return self
+
+    def __exit__(self, *exc):
+        kegg_download.KEGG_REST_URL, kegg_download.KEGG_PNG_URL, kegg_download._rate_limiter = self._previous
+        self.server.shutdown()
+        self.server.server_close()
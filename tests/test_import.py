@@ -0,0 +1,65 @@
+import os
+import sys
+import subprocess
+from unittest import TestCase
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HEAVY_MODULES = {'requests', 'PIL', 'jinja2', 'scipy', 'multiprocessing', 'cdblib'}
+
+
+def import_time(statement: str) -> ({str: int}, str):
+    """
+    Run statement in a fresh interpreter with python -X importtime and without KEGG_MAP_WIZARD_DATA.
+
+    :return: dictionary: module -> cumulative import time in microseconds, stderr without the importtime lines
+    """
+    env = {key: value for key, value in os.environ.items() if key != 'KEGG_MAP_WIZARD_DATA'}
+    env['PYTHONPATH'] = ROOT
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', statement],
+        env=env, cwd=ROOT, capture_output=True, text=True, check=True
+    )
+    times, other = {}, []
+    for line in result.stderr.splitlines():
+        if line.startswith('import time:'):
+            _, cumulative, module = line.split('|')
+            if cumulative.strip().isdecimal():
+                times[module.strip()] = int(cumulative)
+        else:
+            other.append(line)
+    return times, '\n'.join(other)
+
+
+class TestImport(TestCase):
+    def test_package(self):
+        times, stderr = import_time('import kegg_map_wizard')
+        self.assertEqual(stderr, '')  # no setup warning, no assertion about KEGG_MAP_WIZARD_DATA
+        self.assertNotIn('kegg_map_wizard.KeggMapWizard', times)
+        self.assertNotIn('numpy', times)
+        print(f"import kegg_map_wizard: {times['kegg_map_wizard'] / 1000:.1f} ms")
+
+    def test_wizard(self):
+        times, stderr = import_time('from kegg_map_wizard.KeggMapWizard import KeggMapWizard')
+        self.assertEqual(stderr, '')
+        self.assertIn('kegg_map_wizard.KeggMapWizard', times)
+        self.assertFalse(HEAVY_MODULES & {module.split('.')[0] for module in times})
+        print(f"import KeggMapWizard: {times['kegg_map_wizard.KeggMapWizard'] / 1000:.1f} ms")
+
+    def test_lazy_configuration(self):
+        statement = '\n'.join([
+            'from kegg_map_wizard import kegg_download, kegg_utils, KeggMapWizard, KeggShape',
+            'assert kegg_download._settings is None',
+            'assert kegg_utils.load_template.cache_info().currsize == 0',
+            'try:',
+            '    kegg_download.DATA_DIR',
+            'except AssertionError as e:',
+            '    print(e)',
+        ])
+        env = {key: value for key, value in os.environ.items() if key != 'KEGG_MAP_WIZARD_DATA'}
+        env['PYTHONPATH'] = ROOT
+        result = subprocess.run([sys.executable, '-c', statement], env=env, capture_output=True, text=True, check=True)
+        self.assertIn('KEGG_MAP_WIZARD_DATA', result.stdout)
+
+    def test_templates_on_demand(self):
+        from kegg_map_wizard.kegg_utils import load_template, MAP_TEMPLATE
+        self.assertIs(MAP_TEMPLATE, load_template('map'))
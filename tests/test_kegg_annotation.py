@@ -0,0 +1,94 @@
+from re import Pattern
+from unittest import TestCase
+from kegg_map_wizard.KeggAnnotation import KeggAnnotation, AnnotationQuery, AnnotationClassifier, \
+    InvalidAnnotationException
+from kegg_map_wizard.kegg_utils import ANNOTATION_SETTINGS
+
+TOKENS = [
+    'K00716', 'K0071', 'K007166', 'k00716', 'K0071a', 'K００７１６',
+    '1.1.1.1', '1.1.1.-', '2.7.11.1', '1.-', '1.1.-.-', '1..1', '1.1.', '1', '1.1.1.1a',
+    'R00010', 'RC00001', 'R0001', 'RC0001', 'RC000011',
+    'C00031', 'G00001', 'D00001', 'DG00001', 'DG0001', 'D000011',
+    'br:08003', 'br:0800', 'br:080033', 'BR:08003',
+    'map00010', 'ko00010', 'eco00010', 'hsa00010', 'abcd00010', 'a00010', 'Map00010', 'mäp00010', 'map0001',
+    'eco:b0001', 'eco:b', 'eco:0001', 'hsa:1234', 'hsa:12a4', 'hsa:', 'hsa:b0001',
+    'dr:D00001', 'dr:D0001', 'dr:DG00001',
+    'htext=br08003', 'htext=br:08003', 'htext=br08003&search_string=%22Acridone%20alkaloids%22&option=-n', 'htext=br0',
+    'map4670', 'map467', 'show', '', ':', 'K00716 ',
+]
+
+
+def parse_query_reference(anno_query: str, re_org_anno: Pattern, org: str) -> AnnotationQuery:
+    """
+    The linear scan over ANNOTATION_SETTINGS that AnnotationClassifier replaces.
+    """
+    if re_org_anno.match(anno_query):
+        return AnnotationQuery(name=anno_query, anno_type=org, html_class='enzyme', rest_file=org, query=anno_query)
+    for anno_type, settings in ANNOTATION_SETTINGS.items():
+        if settings['pattern'].match(anno_query):
+            if anno_type == 'MAP':
+                anno_query = anno_query[-5:]
+            return AnnotationQuery(
+                name=anno_query,
+                anno_type=anno_type,
+                html_class=settings['html_class'],
+                rest_file=settings['rest_file'],
+                query=f'{settings["descr_prefix"]}{anno_query}'
+            )
+    if anno_query.startswith('dr:D'):
+        anno_type = 'D'
+        name = anno_query.removeprefix('dr:')
+    elif anno_query.startswith('htext=br'):
+        anno_type = 'BR'
+        name = anno_query.removeprefix('htext=br').lstrip(':')
+        name = f'br:{name[:5]}'
+    elif anno_query == 'map4670':
+        anno_type = 'MAP'
+        name = 'map04670'
+    else:
+        raise InvalidAnnotationException(f'Annotation {anno_query} does not match any pattern!')
+
+    settings = ANNOTATION_SETTINGS[anno_type]
+    assert settings['pattern'].match(name), f'annotation ({anno_type}) does not match pattern: {name}'
+    if anno_type == 'MAP':
+        name = name[-5:]
+    return AnnotationQuery(
+        name=name,
+        anno_type=anno_type,
+        html_class=settings['html_class'],
+        rest_file=settings['rest_file'],
+        query=f'{settings["descr_prefix"]}{name}'
+    )
+
+
+def outcome(func, *args):
+    try:
+        return func(*args)
+    except (InvalidAnnotationException, AssertionError) as e:
+        return type(e), str(e).splitlines()[0]  # without the details of pytest assertion rewriting
+
+
+class TestAnnotationClassifier(TestCase):
+    def test_same_as_linear_scan(self):
+        for org in ['ko', 'eco', 'hsa']:
+            re_org_anno = KeggAnnotation.org_pattern(org)
+            classifier = AnnotationClassifier(org, re_org_anno)
+            for token in TOKENS:
+                expected = outcome(parse_query_reference, token, re_org_anno, org)
+                self.assertEqual(outcome(classifier.classify, token), expected, msg=f'{org}: {token!r}')
+                self.assertEqual(outcome(classifier.classify, token), expected, msg=f'{org}: {token!r} (memoized)')
+
+    def test_memoized(self):
+        re_org_anno = KeggAnnotation.org_pattern('hsa')
+        classifier = AnnotationClassifier.get('hsa', re_org_anno)
+        self.assertIs(classifier, AnnotationClassifier.get('hsa', re_org_anno))
+        first = KeggAnnotation.parse_query('K00716', re_org_anno, 'hsa')
+        self.assertIs(KeggAnnotation.parse_query('K00716', re_org_anno, 'hsa'), first)
+        self.assertIn('K00716', classifier.cache)
+
+    def test_parse_url(self):
+        anno_queries = KeggAnnotation.parse_url(
+            '/dbget-bin/www_bget?K00716+1.1.1.1+hsa:1234+invalid', KeggAnnotation.org_pattern('hsa'), 'hsa'
+        )
+        self.assertEqual([q.key for q in anno_queries], [('K', 'K00716'), ('EC', 'EC:1.1.1.1'), ('hsa', 'hsa:1234')])
+        self.assertEqual([q.query for q in anno_queries], ['ko:K00716', 'ec:1.1.1.1', 'hsa:1234'])
@@ -0,0 +1,51 @@
+from unittest import TestCase
+from kegg_map_wizard.KeggShape import KeggShape
+from kegg_map_wizard.kegg_bbox import bounding_boxes
+
+
+def bbox(raw_position: str) -> [float]:
+    shape = KeggShape.create_shape(raw_position, 'description', {})
+    return bounding_boxes([shape])[0].tolist()
+
+
+class TestBoundingBoxes(TestCase):
+    def test_circle(self):
+        self.assertEqual(bbox('circle (246,236) 4'), [242, 232, 8, 8])
+
+    def test_rect(self):
+        self.assertEqual(bbox('rect (259,192) (305,209)'), [259, 192, 46, 17])
+
+    def test_rounded_rect(self):
+        # large rects are shifted by one pixel
+        self.assertEqual(bbox('rect (259,192) (306,210)'), [260, 193, 47, 18])
+
+    def test_horizontal_line(self):
+        # butt caps: no extension along the line, half the stroke-width across it
+        self.assertEqual(bbox('line (138,907,158,907) 2'), [138, 902, 20, 10])
+
+    def test_line_with_corner(self):
+        # the miter of a right angle extends the bbox by half the stroke-width
+        self.assertEqual(bbox('line (100,100,200,100,200,300) 2'), [100, 95, 105, 205])
+
+    def test_line_with_repeated_points(self):
+        self.assertEqual(bbox('line (723,2164,775,2164,775,2164) 3'), [723, 2159, 52, 10])
+
+    def test_poly(self):
+        x, y, width, height = bbox('poly (100,100,200,100,200,200,100,200)')
+        self.assertEqual([x, y, width, height], [98.5, 98.5, 103, 103])
+
+    def test_acute_poly_uses_bevel(self):
+        # the tip of a very acute angle exceeds the miter limit and is beveled
+        x, y, width, height = bbox('poly (0,0,1000,10,0,20)')
+        self.assertLess(x + width, 1000 + 1.5)
+        self.assertGreater(x + width, 1000)
+
+    def test_mixed(self):
+        shapes = [
+            KeggShape.create_shape(raw_position, 'description', {})
+            for raw_position in ['circle (246,236) 4', 'line (138,907,158,907) 2', 'rect (259,192) (305,209)', 'poly (341,292,332,295,332,288)']
+        ]
+        boxes = bounding_boxes(shapes)
+        self.assertEqual(boxes.shape, (4, 4))
+        for shape, box in zip(shapes, boxes.tolist()):
+            self.assertEqual(bounding_boxes([shape])[0].tolist(), box)
@@ -0,0 +1,110 @@
+import os
+import json
+from unittest import TestCase
+from unittest.mock import patch
+from kegg_fixture import fake_data_dir, KeggStandIn
+from kegg_map_wizard.KeggMapWizard import KeggMapWizard, KeggMap
+from kegg_map_wizard import kegg_download
+from kegg_map_wizard.kegg_download import map_conf_path, map_cache_path, map_png_path, nonexistent_path
+
+
+class TestMapCache(TestCase):
+    def test_cached_map(self):
+        with fake_data_dir():
+            kmw = KeggMapWizard(orgs=['ko', 'rn', 'ec'])
+            map = kmw.create_map('00010')
+            self.assertTrue(os.path.isfile(map_cache_path(kmw.org_string, '00010')))
+
+            with patch.object(KeggMap, 'add_shapes') as add_shapes:
+                cached_map = kmw.create_map('00010')
+                add_shapes.assert_not_called()
+
+            self.assertEqual(cached_map.shapes.keys(), map.shapes.keys())
+            self.assertEqual((cached_map.width, cached_map.height), (map.width, map.height))
+            self.assertEqual(cached_map.svg(), map.svg())
+
+    def test_invalidation(self):
+        with fake_data_dir():
+            kmw = KeggMapWizard(orgs=['ko', 'rn', 'ec'])
+            kmw.create_map('00010')
+
+            # modify a conf file
+            conf = map_conf_path('rn', '00010')
+            stat = os.stat(conf)
+            os.utime(conf, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+
+            with patch.object(KeggMap, 'add_shapes') as add_shapes:
+                kmw.create_map('00010')
+                self.assertEqual(add_shapes.call_count, 3)
+
+    def test_reload_clears_cache(self):
+        with fake_data_dir():
+            kmw = KeggMapWizard(orgs=['ko'])
+            kmw.create_map('00010')
+            with patch('kegg_map_wizard.KeggMapWizard.KeggMapWizard._download_maps'):
+                kmw.download_maps(map_ids=['00010'], reload=True)
+            self.assertFalse(os.path.isfile(map_cache_path(kmw.org_string, '00010')))
+
+    def test_refresh(self):
+        with fake_data_dir(), KeggStandIn() as stand_in:
+            kmw = KeggMapWizard(orgs=['ko', 'rn'])
+            kmw.create_map('00010')
+            kmw.create_map('00400')
+
+            # the stand-in serves different confs, but the same 00400.png as before
+            stand_in.files.pop('/get/rn00400/conf')
+            stand_in.files.pop('/get/ko00400/conf')
+            with open(f'{kegg_download.DATA_DIR}/maps_png/00400.png', 'rb') as f:
+                stand_in.files['/map00400.png'] = f.read()
+
+            self.assertEqual(kmw.refresh(), {'00010', '01100'})
+            self.assertFalse(os.path.isfile(map_cache_path(kmw.org_string, '00010')))
+            self.assertTrue(os.path.isfile(map_cache_path(kmw.org_string, '00400')))
+
+            self.assertEqual(kmw.refresh(), set())
+            kmw.create_map('00010')
+            self.assertTrue(os.path.isfile(map_cache_path(kmw.org_string, '00010')))
+
+
+class TestAvailability(TestCase):
+    def test_fast_path(self):
+        with fake_data_dir():
+            kmw = KeggMapWizard(orgs=['ko', 'rn'])
+            self.assertTrue(kmw.availability.is_complete('00010'))
+            with patch('kegg_map_wizard.KeggMapWizard.KeggMapWizard.download_configs') as download_configs, \
+                    patch('os.listdir') as listdir:
+                kmw.create_map('00010', use_cache=False)
+                kmw.create_map('00400', use_cache=False)
+            download_configs.assert_not_called()
+            listdir.assert_not_called()
+
+    def test_missing_conf(self):
+        with fake_data_dir(), KeggStandIn(orgs=('ko', 'rn')):
+            os.remove(map_conf_path('rn', '00400'))
+            kmw = KeggMapWizard(orgs=['ko', 'rn'])
+            self.assertFalse(kmw.availability.is_complete('00400'))
+            kmw.create_map('00400', use_cache=False)  # downloads the conf
+            self.assertTrue(os.path.isfile(map_conf_path('rn', '00400')))
+            self.assertTrue(kmw.availability.is_complete('00400'))
+
+    def test_nonexistent(self):
+        with fake_data_dir():
+            os.remove(map_conf_path('rn', '00400'))
+            with open(nonexistent_path('rn'), 'w') as f:
+                json.dump([map_conf_path('rn', '00400', url=True)], f)
+            kmw = KeggMapWizard(orgs=['ko', 'rn'])
+            self.assertTrue(kmw.availability.is_complete('00400'))
+            kmw.availability.update({map_png_path('99999'): 'success', map_conf_path('ko', '99999'): 'success',
+                                     map_conf_path('rn', '99999'): 'non-existent'})
+            self.assertTrue(kmw.availability.is_complete('99999'))
+
+    def test_offline(self):
+        with fake_data_dir():
+            with patch('kegg_map_wizard.kegg_download.fetch_all') as fetch_all:
+                kmw = KeggMapWizard(orgs=['ko'], offline=True)
+                os.remove(map_conf_path('ko', '00400'))
+                map = kmw.create_map('00400', use_cache=False)
+                fetch_all.assert_not_called()
+            self.assertEqual(len(map.shapes), 0)
+            with self.assertRaises(AssertionError):
+                kmw.download_maps(map_ids=['00400'])
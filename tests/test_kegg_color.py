@@ -0,0 +1,104 @@
+from unittest import TestCase
+import numpy as np
+from kegg_fixture import fake_data_dir
+from kegg_map_wizard.KeggMapWizard import KeggMapWizard
+from kegg_map_wizard.ColorMaker import ColorMaker
+from kegg_map_wizard.kegg_color import interpolate, scale, calc_color_array, rgb_to_lch, lch_to_rgb, parse_colors
+
+
+def covered_by(shape, annotations) -> bool:
+    return any(anno.name in annotations for anno in shape.annotations.values())
+
+
+class TestColorScales(TestCase):
+    def test_parse_colors(self):
+        np.testing.assert_array_equal(
+            parse_colors(['red', '#00ff00', 'transparent']),
+            [[255, 0, 0, 1], [0, 255, 0, 1], [0, 0, 0, 0]]
+        )
+        with self.assertRaises(ValueError):
+            parse_colors(['not-a-color'])
+
+    def test_lch_roundtrip(self):
+        rgb = np.random.default_rng(0).integers(0, 256, size=(100, 3)).astype(float)
+        np.testing.assert_allclose(lch_to_rgb(rgb_to_lch(rgb)), rgb, atol=0.01)  # chroma.js rounds its constants
+
+    def test_interpolate(self):
+        # chroma.mix('yellow', 'red', 0.5) == '#ffb400'
+        self.assertEqual(interpolate('yellow', 'red', [0, 0.5, 1]), ['#ffff00', '#ffb400', '#ff0000'])
+        self.assertEqual(interpolate('black', 'white', [0.5], mode='rgb'), ['#808080'])
+        self.assertEqual(interpolate('transparent', 'red', [0.5], mode='rgb'), ['#80000080'])
+
+    def test_scale(self):
+        colors = scale(['yellow', 'red'], 5)
+        self.assertEqual((colors[0], colors[-1]), ('#ffff00', '#ff0000'))
+        greens = [int(c[3:5], 16) for c in colors]
+        self.assertEqual(greens, sorted(greens, reverse=True))
+        self.assertEqual(len(scale(['yellow', 'red'], 1)), 1)
+
+    def test_calc_color_array(self):
+        colors = ['transparent', 'yellow', 'red', 'green']
+        self.assertEqual(calc_color_array(1, colors), ['transparent', 'green'])
+        self.assertEqual(calc_color_array(3, colors), ['transparent', '#ffff00', '#ff0000', 'green'])
+        self.assertEqual(len(calc_color_array(4, colors[:3])), 5)
+
+
+class TestBatchColoring(TestCase):
+    def test_binary(self):
+        with fake_data_dir():
+            map = KeggMapWizard(orgs=['ko', 'rn']).create_map('00010')
+            annotations = ['K00001', 'K00002', 'R00003']
+            coloring = map.color_binary(annotations, color='blue')
+            for shape in map.shapes.values():
+                expected = 'blue' if covered_by(shape, annotations) else 'transparent'
+                self.assertEqual(coloring.fills[shape.hash], expected)
+            self.assertIn('blue', coloring.fills.values())
+
+    def test_continuous(self):
+        with fake_data_dir():
+            map = KeggMapWizard(orgs=['ko']).create_map('00010')
+            numbers = {f'K{i:05d}': i / 100 for i in range(0, 100, 3)}
+            coloring = map.color_continuous(numbers)
+            for shape in map.shapes.values():
+                names = [anno.name for anno in shape.annotations.values() if anno.name in numbers]
+                if names:
+                    self.assertEqual(coloring.fills[shape.hash], interpolate('yellow', 'red', [numbers[names[-1]]])[0])
+                else:
+                    self.assertNotIn(shape.hash, coloring.fills)
+
+    def test_organisms(self):
+        with fake_data_dir():
+            map = KeggMapWizard(orgs=['ko', 'rn']).create_map('00010')
+            organisms = {f'org{o}': [f'K{i:05d}' for i in range(o, 100, 4)] for o in range(3)}
+            palette = calc_color_array(3, ['transparent', 'yellow', 'red', 'green'])
+            coloring = map.color_organisms(organisms)
+            for shape in map.shapes.values():
+                n_covering = sum(covered_by(shape, annotations) for annotations in organisms.values())
+                self.assertEqual(coloring.fills[shape.hash], palette[n_covering])
+
+    def test_groups(self):
+        with fake_data_dir():
+            map = KeggMapWizard(orgs=['ko']).create_map('00010')
+            groups = {
+                'group1': {'org1': [f'K{i:05d}' for i in range(0, 50)], 'org2': ['K00001']},
+                'group2': {'org3': [f'K{i:05d}' for i in range(25, 100)]},
+            }
+            colors = ['transparent', 'yellow', 'red', 'green']
+            palettes = [calc_color_array(2, colors), calc_color_array(1, colors)]
+            coloring = map.color_groups(groups)
+            for shape in map.shapes.values():
+                group_colors = [
+                    palette[sum(covered_by(shape, annotations) for annotations in organisms.values())]
+                    for palette, organisms in zip(palettes, groups.values())
+                ]
+                if len(set(group_colors)) == 1:
+                    self.assertEqual(coloring.fills[shape.hash], group_colors[0])
+                    self.assertNotIn(shape.hash, coloring.defs)
+                else:
+                    self.assertEqual(coloring.fills[shape.hash], f'url(#{shape.hash})')
+                    self.assertEqual(coloring.defs[shape.hash], ColorMaker.svg_gradient(
+                        group_colors, id=shape.hash, x1=shape.bbox.x1, x2=shape.bbox.x2))
+            self.assertTrue(coloring.defs)
+
+            # a coloring can be rendered with a skeleton or used as color_function
+            self.assertEqual(map.compile().render(*coloring), map.svg(color_function=coloring.color_function).encode())
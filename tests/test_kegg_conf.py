@@ -0,0 +1,156 @@
+from unittest import TestCase
+from kegg_fixture import fake_data_dir
+from kegg_map_wizard.KeggMapWizard import KeggMapWizard
+from kegg_map_wizard.KeggMap import KeggMap
+from kegg_map_wizard.KeggShape import KeggShape
+from kegg_map_wizard.KeggAnnotation import KeggAnnotation
+from kegg_map_wizard.kegg_conf import parse_conf, parse_conf_text, conf_columns, ShapeAssembly, \
+    CIRCLE, RECT, POLY, LINE
+from kegg_map_wizard.kegg_download import map_conf_path, map_png_path
+from kegg_map_wizard.kegg_svg import iter_map_svg
+
+CONF = '''rect (259,192) (305,209)\t/dbget-bin/www_bget?K00844+K12407\tK00844, K12407
+rect (620,271) (700,300)\t/kegg-bin/show_pathway?map00010\tGlycolysis
+circ (246,236) 4\t/dbget-bin/www_bget?C00031\tC00031 (D-Glucose)
+filled_circ (10,20) 7\t/dbget-bin/www_bget?C00031\tC00031 (D-Glucose)
+poly (576,199,567,202,567,195)\t/dbget-bin/www_bget?K00844+K12407\tK00844, K12407
+line (723,2164,775,2164,775,2180) 3\t/dbget-bin/www_bget?R00010\tR00010
+'''
+
+
+class TestParseConf(TestCase):
+    def test_columns(self):
+        table = parse_conf_text(CONF)
+        self.assertEqual(len(table), 6)
+        self.assertEqual(table.kinds.tolist(), [RECT, RECT, CIRCLE, CIRCLE, POLY, LINE])
+        self.assertEqual(table.offsets.tolist(), [0, 4, 8, 11, 14, 20, 26])
+        self.assertEqual(table.radius.tolist(), [0, 0, 4, 7, 0, 3])
+        self.assertEqual(table.url_index.tolist(), [0, 1, 2, 2, 0, 3])
+        self.assertEqual(len(table.urls), 4)
+        self.assertEqual(table.points(1).tolist(), [621, 272, 80, 29])  # adjusted rect
+        self.assertEqual(table.points(5).tolist(), [723, 2164, 775, 2164, 775, 2180])
+
+    def test_same_as_create_shape(self):
+        table = parse_conf_text(CONF)
+        for i, line in enumerate(CONF.splitlines()):
+            raw_position, url, description = line.split('\t')
+            expected = KeggShape.create_shape(raw_position, description, annotations={})
+            shape = table.shape(i, annotations={})
+            self.assertIs(type(shape), type(expected))
+            self.assertEqual(shape.type, expected.type)
+            self.assertEqual(shape.raw_position, expected.raw_position)
+            self.assertEqual(shape.description, expected.description)
+            self.assertEqual(shape.points, expected.points)
+            self.assertEqual(shape.coords, expected.coords)
+
+    def test_fixture_confs(self):
+        with fake_data_dir():
+            for org in ['ko', 'rn', 'ec', 'eco']:
+                path = map_conf_path(org, '01100')
+                table = parse_conf(path)
+                with open(path) as f:
+                    lines = [line.rstrip().split('\t') for line in f]
+                self.assertEqual(len(table), len(lines))
+                for i, (raw_position, url, description) in enumerate(lines):
+                    self.assertEqual(table.urls[table.url_index[i]], url)
+                    expected = KeggShape.create_shape(raw_position, description, annotations={})
+                    self.assertEqual(table.shape(i, annotations={}).coords, expected.coords)
+
+    def test_empty(self):
+        self.assertEqual(len(parse_conf_text('')), 0)
+
+    def test_malformed(self):
+        for bad in [
+            'rect (259,192) (305)\t/dbget-bin/www_bget?K00844\tK00844',
+            'poly (576,199,567)\t/dbget-bin/www_bget?K00844\tK00844',
+            'line (723,2164,775) 3\t/dbget-bin/www_bget?K00844\tK00844',
+            'star (1,2)\t/dbget-bin/www_bget?K00844\tK00844',
+            'rect (259,192) (305,209)\t/dbget-bin/www_bget?K00844',
+        ]:
+            with self.assertRaises(AssertionError, msg=bad):
+                parse_conf_text(CONF + bad + '\n')
+
+
+class TestShapeAssembly(TestCase):
+    def test_merge(self):
+        other = 'rect (259,192) (305,209)\t/dbget-bin/www_bget?K00845\tother description\n' \
+                'circ (1,2) 3\t/dbget-bin/www_bget?C00032\tC00032\n'
+        assembly = ShapeAssembly()
+        for text in [CONF, other]:
+            columns = conf_columns(text)
+            assembly.add(columns, [[(url, url)] for url in columns.urls])
+        self.assertEqual(len(assembly.tables), 2)
+        self.assertEqual(len(assembly.tables[1]), 1)  # only the new circle is parsed
+
+        shapes = list(assembly.iter_shapes())
+        self.assertEqual([shape.raw_position for shape in shapes], list(dict.fromkeys(
+            line.split('\t')[0] for line in (CONF + other).splitlines()
+        )))
+        rect = shapes[0]
+        self.assertEqual(rect.description, 'K00844, K12407')  # the first file wins
+        self.assertEqual(list(rect.annotations), ['/dbget-bin/www_bget?K00844+K12407', '/dbget-bin/www_bget?K00845'])
+        self.assertEqual(shapes[-1].coords, KeggShape.create_shape('circ (1,2) 3', 'C00032', {}).coords)
+
+    def test_geometry_parsed_once(self):
+        with fake_data_dir():
+            kmw = KeggMapWizard(orgs=['ko', 'rn', 'ec', 'eco'])
+            map = KeggMap(orgs=kmw.orgs, map_id='01100', title=kmw.all_mapids['01100'], png_path=map_png_path('01100'))
+            for org in kmw.orgs:
+                map.add_shapes(cdb_readers=kmw.cdb_readers, map_id='01100', org=org)
+            self.assertEqual(len(map._assembly.tables), 1)  # the fixture uses the same geometry for every org
+            self.assertEqual(len(map._assembly.layers), 4)
+            self.assertEqual({anno_type for shape in map.shapes.values() for anno_type, name in shape.annotations},
+                             {'K', 'R', 'EC', 'eco', 'MAP', 'C'})
+
+
+class TestLazyShapes(TestCase):
+    def test_lazy(self):
+        with fake_data_dir():
+            kmw = KeggMapWizard(orgs=['ko', 'rn'])
+            map = KeggMap(orgs=kmw.orgs, map_id='00010', title=kmw.all_mapids['00010'], png_path=map_png_path('00010'))
+            for org in kmw.orgs:
+                map.add_shapes(cdb_readers=kmw.cdb_readers, map_id='00010', org=org)
+            self.assertEqual(len(map._shapes), 0)
+            self.assertEqual(len(map._assembly.layers), 2)
+            self.assertGreater(len(map.shapes), 0)
+            self.assertIsNone(map._assembly)
+
+    def test_create_map(self):
+        with fake_data_dir():
+            kmw = KeggMapWizard(orgs=['ko', 'rn'])
+            map = kmw.create_map('00010', use_cache=False)
+            self.assertEqual(len(map._shapes), 0)  # nothing to cache, shapes and bboxes stay lazy
+            self.assertFalse(map.bboxes_loaded)
+            self.assertNotIn('data-bbox', map.svg(calculate_bboxes=False))
+            self.assertIn('data-bbox', map.svg())
+
+            map = kmw.create_map('00010')  # cached maps are complete
+            self.assertTrue(map.bboxes_loaded)
+            self.assertIn('data-bbox', map.svg(calculate_bboxes=False))
+
+    def test_same_svg(self):
+        # merging shapes of several organisms must give the same result as the per-line parser
+        with fake_data_dir():
+            kmw = KeggMapWizard(orgs=['ko', 'rn', 'ec', 'eco'])
+            map = kmw.create_map('00010', use_cache=False)
+            map._load_bounding_boxes()
+
+            reference = kmw.create_map('00010', use_cache=False)
+            reference.shapes = {}
+            for org in kmw.orgs:
+                with open(map_conf_path(org, '00010')) as f:
+                    for line in f:
+                        raw_position, url, description = line.rstrip().split('\t')
+                        anno_queries = KeggAnnotation.parse_url(url, KeggAnnotation.org_pattern(org), org)
+                        annotations = {q.key: kmw.annotation_pool[q.key] for q in anno_queries}
+                        reference.add_shape(KeggShape.create_shape(raw_position, description, annotations))
+            reference._load_bounding_boxes()
+
+            def color_function(shape):
+                return 'red'
+
+            self.assertEqual(
+                ''.join(iter_map_svg(map, color_function, png_url='/x.png')),
+                ''.join(iter_map_svg(reference, color_function, png_url='/x.png'))
+            )
+
@@ -0,0 +1,66 @@
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+import numpy as np
+from kegg_fixture import fake_data_dir
+from kegg_map_wizard.KeggMapWizard import KeggMapWizard
+from kegg_map_wizard.kegg_coverage import CoverageCatalogue, read_genome_annotations
+
+
+def random_genomes(n: int, seed: int = 0) -> [(str, [str])]:
+    rng = np.random.default_rng(seed)
+    return [
+        (f'genome{g}', [f'K{i:05d}' for i in rng.choice(120, size=rng.integers(0, 60), replace=False)])
+        for g in range(n)
+    ]
+
+
+def reference_coverage(maps, genome: [str]) -> [float]:
+    coverage = []
+    for map in maps:
+        shapes = [s for s in map.shapes.values() if s.annotations and 'enzyme' in s.classes()]
+        covered = [s for s in shapes if any(anno.name in genome for anno in s.annotations.values())]
+        coverage.append(len(covered) / len(shapes))
+    return coverage
+
+
+class TestCoverage(TestCase):
+    def test_coverage(self):
+        with fake_data_dir():
+            kmw = KeggMapWizard(orgs=['ko'])
+            catalogue = kmw.coverage_catalogue()
+            self.assertEqual(catalogue.map_ids, ['00010', '00400', '01100'])
+            maps = [kmw.create_map(map_id) for map_id in catalogue.map_ids]
+
+            genomes = random_genomes(20)
+            table = catalogue.coverage(genomes)
+            self.assertEqual(table.shape, (20, 3))
+            for (_, annotations), row in zip(genomes, table):
+                np.testing.assert_allclose(row, reference_coverage(maps, set(annotations)), rtol=1e-6)
+            np.testing.assert_array_equal(catalogue.coverage([('empty', [])]), [[0, 0, 0]])
+
+    def test_chunks_and_workers(self):
+        with fake_data_dir():
+            catalogue = KeggMapWizard(orgs=['ko', 'rn']).coverage_catalogue()
+            genomes = random_genomes(50, seed=1)
+            expected = catalogue.coverage(genomes)
+            for chunk_size, workers in [(7, 1), (10, 2), (1000, 2)]:
+                names, table = catalogue.coverage_table(iter(genomes), chunk_size=chunk_size, workers=workers)
+                self.assertEqual(names, [name for name, _ in genomes])
+                np.testing.assert_array_equal(table, expected)
+
+    def test_tsv(self):
+        with fake_data_dir(), TemporaryDirectory() as tmp:
+            catalogue = KeggMapWizard(orgs=['ko']).coverage_catalogue(map_ids=['00010', '00400'])
+            genomes = random_genomes(5, seed=2)
+            with open(f'{tmp}/genomes.tsv', 'w') as f:
+                f.writelines(f'{name}\t{annotation}\n' for name, annotations in genomes for annotation in annotations)
+            read = list(read_genome_annotations(f'{tmp}/genomes.tsv'))
+            self.assertEqual(read, [genome for genome in genomes if genome[1]])
+
+            catalogue.save(f'{tmp}/catalogue.pickle')
+            catalogue = CoverageCatalogue.load(f'{tmp}/catalogue.pickle')
+            catalogue.write_tsv(f'{tmp}/coverage.tsv', read, chunk_size=2)
+            with open(f'{tmp}/coverage.tsv') as f:
+                lines = f.read().splitlines()
+            self.assertEqual(lines[0], 'genome\t00010\t00400')
+            self.assertEqual(len(lines), len(read) + 1)
@@ -0,0 +1,184 @@
+import os
+import json
+import time
+import base64
+import requests
+from io import BytesIO
+from random import Random
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+from unittest.mock import patch
+from PIL import Image
+from kegg_fixture import KeggStandIn
+from kegg_map_wizard.kegg_download import encode_png, fetch, fetch_all, RateLimiter, load_manifest
+from kegg_map_wizard.kegg_utils import load_png, PngSidecar, png_sidecar_path, migrate_png_json
+
+
+def encode_png_reference(png_path: str) -> bytes:
+    """ Pixel-by-pixel implementation that encode_png must reproduce. """
+    img = Image.open(png_path).convert('RGBA')
+    pixdata = img.load()
+    width, height = img.size
+    for y in range(height):
+        for x in range(width):
+            if pixdata[x, y] == (255, 255, 255, 255):
+                pixdata[x, y] = (255, 255, 255, 0)
+    buffer = BytesIO()
+    img.save(buffer, 'PNG')
+    return buffer.getvalue()
+
+
+def synthetic_map(mode: str, size=(300, 200)) -> Image.Image:
+    rnd = Random(42)
+    img = Image.new('RGB', size, (255, 255, 255))
+    for _ in range(50):
+        x, y = rnd.randrange(size[0] - 46), rnd.randrange(size[1] - 17)
+        img.paste((rnd.randrange(256), rnd.randrange(256), 255), (x, y, x + 46, y + 17))
+    img.putpixel((0, 0), (255, 255, 254))  # almost white stays opaque
+    if mode == 'P':
+        return img.convert('P', palette=Image.ADAPTIVE)
+    if mode == 'RGBA':
+        img = img.convert('RGBA')
+        img.putpixel((1, 0), (255, 255, 255, 128))  # half-transparent white stays half-transparent
+    return img
+
+
+class TestEncodePng(TestCase):
+    def test_identical_to_reference(self):
+        with TemporaryDirectory() as tmp:
+            for mode in ['RGB', 'P', 'RGBA']:
+                png_path = f'{tmp}/{mode}.png'
+                synthetic_map(mode).save(png_path)
+                encode_png(png_path)
+                png_json = load_png(png_path)
+                self.assertEqual(base64.b64decode(png_json['image']), encode_png_reference(png_path), mode)
+                self.assertEqual((png_json['width'], png_json['height']), (300, 200))
+
+
+class TestPngSidecar(TestCase):
+    def test_sidecar(self):
+        with TemporaryDirectory() as tmp:
+            png = os.urandom(100_000)
+            PngSidecar.write(f'{tmp}/map.png.sidecar', png, 300, 200)
+            sidecar = PngSidecar(f'{tmp}/map.png.sidecar')
+            self.assertEqual((sidecar.width, sidecar.height), (300, 200))
+            self.assertIsNone(sidecar._mmap)  # only the header was read
+            self.assertEqual(bytes(sidecar.png), png)
+            self.assertEqual(''.join(sidecar.iter_base64(chunk_size=400)), base64.b64encode(png).decode())
+            self.assertEqual(sidecar.base64(), base64.b64encode(png).decode())
+
+    def test_migrate_png_json(self):
+        with TemporaryDirectory() as tmp:
+            png_path = f'{tmp}/00010.png'
+            synthetic_map('P').save(png_path)
+            encode_png(png_path)
+            expected = load_png(png_path)
+            os.remove(png_sidecar_path(png_path))
+            with open(png_path + '.json', 'w') as f:
+                json.dump(expected, f)
+
+            migrate_png_json(png_path)
+            self.assertFalse(os.path.isfile(png_path + '.json'))
+            self.assertEqual(load_png(png_path), expected)
+
+
+class TestFetchAll(TestCase):
+    def download(self, stand_in: KeggStandIn, tmp: str, n_parallel=4, progress=None):
+        args_list = [
+            (f'{stand_in.url}/list/ko', f'{tmp}/ko.tsv', False),
+            (f'{stand_in.url}/list/compound', f'{tmp}/compound.tsv', False),
+            (f'{stand_in.url}/get/ko00010/conf', f'{tmp}/00010.conf', False),
+            (f'{stand_in.url}/get/ko99999/conf', f'{tmp}/99999.conf', False),
+            (f'{stand_in.url}/map00010.png', f'{tmp}/00010.png', True, True),
+        ]
+        fetch_all(args_list, n_parallel=n_parallel, reload=False, nonexistent_file=f'{tmp}/non-existent.json',
+                  rate_limiter=RateLimiter(rate=1000), progress=progress, verbose=False)
+
+    def test_download(self):
+        with KeggStandIn() as stand_in, TemporaryDirectory() as tmp:
+            reports = []
+            self.download(stand_in, tmp, progress=lambda *report: reports.append(report))
+
+            self.assertEqual(len(reports), 5)
+            with open(f'{tmp}/ko.tsv') as f:
+                self.assertIn('ko:K00001\tgene1; enzyme number 1\n', f.read())
+            self.assertTrue(os.path.isfile(f'{tmp}/00010.conf'))
+            self.assertEqual(load_png(f'{tmp}/00010.png')['width'], 300)
+            with open(f'{tmp}/non-existent.json') as f:
+                self.assertEqual(json.load(f), [f'{stand_in.url}/get/ko99999/conf'])
+
+            # second run: nothing to download
+            n_requests = len(stand_in.requests)
+            self.download(stand_in, tmp)
+            self.assertEqual(len(stand_in.requests), n_requests)
+
+    def test_retry(self):
+        with KeggStandIn() as stand_in, TemporaryDirectory() as tmp:
+            stand_in.failures['/list/ko'] = [429, 503]
+            self.download(stand_in, tmp)
+            self.assertEqual(stand_in.requests.count('/list/ko'), 3)
+            self.assertTrue(os.path.isfile(f'{tmp}/ko.tsv'))
+
+    def test_timeout(self):
+        with KeggStandIn() as stand_in, TemporaryDirectory() as tmp, patch('kegg_map_wizard.kegg_download.TIMEOUT', 0.2):
+            stand_in.failures['/list/ko'] = ['truncate']
+            stand_in.failures['/list/rn'] = ['stall']
+            statuses = fetch_all(
+                [(f'{stand_in.url}/list/{file}', f'{tmp}/{file}.tsv', False) for file in ['ko', 'rn', 'compound']],
+                n_parallel=3, reload=False, rate_limiter=RateLimiter(rate=1000), verbose=False
+            )
+            self.assertEqual(set(statuses.values()), {'success'})  # retried, like 5xx responses
+            self.assertEqual((stand_in.requests.count('/list/ko'), stand_in.requests.count('/list/rn')), (2, 2))
+            with open(f'{tmp}/ko.tsv') as f:
+                self.assertEqual(f.read(), stand_in.files['/list/ko'])
+
+            stand_in.failures['/list/ec'] = ['stall', 'stall']
+            with requests.Session() as session:
+                status = fetch(session, f'{stand_in.url}/list/ec', f'{tmp}/ec.tsv', retries=1, backoff=0, verbose=False)
+            self.assertEqual(status, 'error')
+            self.assertEqual(sorted(os.listdir(tmp)), ['compound.tsv', 'ko.tsv', 'rn.tsv'])  # no partial or temporary files
+
+    def test_incremental(self):
+        with KeggStandIn() as stand_in, TemporaryDirectory() as tmp:
+            args_list = [
+                (f'{stand_in.url}/list/ko', f'{tmp}/ko.tsv', False),
+                (f'{stand_in.url}/list/rn', f'{tmp}/rn.tsv', False),
+            ]
+
+            def sync():
+                return fetch_all(args_list, n_parallel=2, reload=False, incremental=True, rate_limiter=RateLimiter(rate=1000), verbose=False)
+
+            self.assertEqual(sync(), {f'{tmp}/ko.tsv': 'success', f'{tmp}/rn.tsv': 'success'})
+            self.assertEqual(set(load_manifest(tmp)), {'ko.tsv', 'rn.tsv'})
+            mtime = os.stat(f'{tmp}/ko.tsv').st_mtime_ns
+
+            self.assertEqual(sync(), {f'{tmp}/ko.tsv': 'not-modified', f'{tmp}/rn.tsv': 'not-modified'})
+
+            stand_in.files['/list/ko'] += 'ko:K99999\tnew gene\n'
+            stand_in.etags = False  # validators may be missing, then the content hash decides
+            self.assertEqual(sync(), {f'{tmp}/ko.tsv': 'success', f'{tmp}/rn.tsv': 'unchanged'})
+            with open(f'{tmp}/ko.tsv') as f:
+                self.assertIn('ko:K99999\tnew gene\n', f.read())
+            self.assertNotEqual(os.stat(f'{tmp}/ko.tsv').st_mtime_ns, mtime)
+
+    def test_concurrency_cap(self):
+        with KeggStandIn(delay=0.1) as stand_in, TemporaryDirectory() as tmp:
+            self.download(stand_in, tmp, n_parallel=2)
+            self.assertEqual(stand_in.max_concurrent, 2)
+
+
+class TestRateLimiter(TestCase):
+    def test_rate(self):
+        rate_limiter = RateLimiter(rate=50)
+        start = time.monotonic()
+        for _ in range(11):
+            rate_limiter.acquire()
+        self.assertGreater(time.monotonic() - start, 0.19)
+
+    def test_adaptive(self):
+        rate_limiter = RateLimiter(rate=10)
+        rate_limiter.penalize()
+        self.assertEqual(rate_limiter.rate, 5)
+        for _ in range(10):
+            rate_limiter.reward()
+        self.assertEqual(rate_limiter.rate, 10)
@@ -0,0 +1,51 @@
+import os
+from unittest import TestCase
+from unittest.mock import patch
+from kegg_fixture import fake_data_dir
+from kegg_map_wizard.KeggMapWizard import KeggMapWizard, KeggMap
+from kegg_map_wizard.kegg_download import map_conf_path, annotation_index_path
+from kegg_map_wizard.kegg_index import AnnotationIndex
+
+
+def scan_maps(kmw: KeggMapWizard, annotation: str) -> [(str, str)]:
+    return sorted(
+        (map_id, raw_position)
+        for map_id in ['00010', '00400', '01100']
+        for raw_position, shape in kmw.create_map(map_id).shapes.items()
+        if annotation in {anno.name for anno in shape.annotations.values()}
+    )
+
+
+class TestAnnotationIndex(TestCase):
+    def test_lookup(self):
+        with fake_data_dir():
+            kmw = KeggMapWizard(orgs=['ko', 'rn', 'ec'])
+            with patch.object(KeggMap, '__init__', side_effect=AssertionError('no maps should be created')):
+                shapes = {annotation: kmw.shapes_for(annotation) for annotation in ['K00001', 'R00002', 'EC:1.1.1.3', 'C99999']}
+                maps = kmw.maps_for('K00001')
+            self.assertTrue(os.path.isfile(annotation_index_path()))
+
+            for annotation, expected in shapes.items():
+                self.assertEqual(expected, scan_maps(kmw, annotation))
+            self.assertEqual(shapes['C99999'], [])
+            self.assertEqual(maps, sorted({map_id for map_id, _ in shapes['K00001']}))
+            self.assertTrue(maps)
+
+    def test_orgs(self):
+        with fake_data_dir():
+            kmw = KeggMapWizard(orgs=['ko'])
+            self.assertEqual(kmw.shapes_for('eco:b0001'), [])
+            self.assertTrue(KeggMapWizard(orgs=['eco']).shapes_for('eco:b0001'))
+            org_entries = {org for org, _, _ in kmw.annotation_index.get('K00001')}
+            self.assertEqual(org_entries, {'ko'})
+
+    def test_outdated(self):
+        with fake_data_dir():
+            kmw = KeggMapWizard(orgs=['ko'])
+            self.assertTrue(kmw.annotation_index.is_current())
+            with open(map_conf_path('ko', '00010'), 'a') as f:
+                f.write('rect (1,1) (47,18)\t/dbget-bin/www_bget?K01623\tK01623\n')
+            self.assertFalse(AnnotationIndex().is_current())
+
+            kmw.download_maps(map_ids=[])  # resets the index
+            self.assertIn(('00010', 'rect (1,1) (47,18)'), kmw.shapes_for('K01623'))
@@ -0,0 +1,104 @@
+import os
+import json
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+from unittest.mock import patch
+from kegg_fixture import fake_data_dir, KeggStandIn, _eco_ko_links
+from kegg_map_wizard.KeggMapWizard import KeggMapWizard
+from kegg_map_wizard.kegg_download import map_conf_path, ko_link_path, nonexistent_path
+from kegg_map_wizard.kegg_link import derive_conf_text, derive_map_confs, read_ko_links
+
+KO_CONF = '''rect (259,192) (305,209)\t/dbget-bin/www_bget?K00844+K12407\tK00844, K12407
+rect (620,271) (700,300)\t/kegg-bin/show_pathway?map00010\tGlycolysis
+circ (246,236) 4\t/dbget-bin/www_bget?C00031\tC00031 (D-Glucose)
+rect (10,20) (56,37)\t/dbget-bin/www_bget?K00001\tK00001
+'''
+
+
+def write_eco_links():
+    with open(ko_link_path('eco'), 'w') as f:
+        f.writelines(line + '\n' for line in _eco_ko_links(n=100))
+
+
+class TestDerive(TestCase):
+    def test_derive_conf_text(self):
+        ko_to_genes = {'K00844': ['hsa:3098', 'hsa:3099'], 'K12407': ['hsa:2645', 'hsa:3098']}
+        self.assertEqual(derive_conf_text(KO_CONF, ko_to_genes).splitlines(), [
+            'rect (259,192) (305,209)\t/dbget-bin/www_bget?hsa:3098+hsa:3099+hsa:2645\tK00844, K12407',
+            'rect (620,271) (700,300)\t/kegg-bin/show_pathway?map00010\tGlycolysis',
+            'circ (246,236) 4\t/dbget-bin/www_bget?C00031\tC00031 (D-Glucose)',
+        ])
+        self.assertEqual(derive_conf_text(KO_CONF, {}), '')  # no genes in this map
+
+    def test_same_as_downloaded(self):
+        # the eco .conf files of the fixture are what KEGG would return for the ko maps of the fixture
+        with fake_data_dir():
+            write_eco_links()
+            ko_to_genes = read_ko_links('eco')
+            for map_id in ['00010', '01100']:
+                with open(map_conf_path('ko', map_id)) as f:
+                    derived = derive_conf_text(f.read(), ko_to_genes)
+                with open(map_conf_path('eco', map_id)) as f:
+                    downloaded = f.read()
+                self.assertEqual(
+                    [line.split('\t')[:2] for line in derived.splitlines()],
+                    [line.split('\t')[:2] for line in downloaded.splitlines()]
+                )
+
+    def test_outdated(self):
+        with fake_data_dir(orgs=('ko',)):
+            write_eco_links()
+            self.assertEqual(set(derive_map_confs('eco', ['00010', '00400']).values()), {'success'})
+            self.assertEqual(derive_map_confs('eco', ['00010', '00400']), {})  # up-to-date
+
+            eco_conf, ko_conf = map_conf_path('eco', '00010'), map_conf_path('ko', '00010')
+            stat = os.stat(eco_conf)
+            os.utime(eco_conf, ns=(stat.st_atime_ns, stat.st_mtime_ns - 10_000_000_000))  # older than its sources
+            self.assertEqual(derive_map_confs('eco', ['00010', '00400']), {})  # only the mtimes of the sources count
+            eco_mtime, nonexistent_mtime = os.stat(eco_conf).st_mtime_ns, os.stat(nonexistent_path('eco')).st_mtime_ns
+
+            for offset in [10_000_000_000, -10_000_000_000]:  # the ko .conf file changed, also into the past
+                stat = os.stat(ko_conf)
+                os.utime(ko_conf, ns=(stat.st_atime_ns, stat.st_mtime_ns + offset))
+                self.assertEqual(derive_map_confs('eco', ['00010', '00400']), {eco_conf: 'unchanged'})
+                with patch('kegg_map_wizard.kegg_link.read_ko_links', wraps=read_ko_links) as read:
+                    for _ in range(3):
+                        self.assertEqual(derive_map_confs('eco', ['00010', '00400']), {})
+                    self.assertEqual(read.call_count, 0)
+            self.assertEqual(os.stat(eco_conf).st_mtime_ns, eco_mtime)  # not touched: cached maps stay valid
+            self.assertEqual(os.stat(nonexistent_path('eco')).st_mtime_ns, nonexistent_mtime)  # not rewritten
+
+            with open(ko_link_path('eco'), 'w') as f:
+                f.write('ko:K99999\teco:b9999\n')
+            statuses = derive_map_confs('eco', ['00010', '00400'])
+            self.assertEqual(set(statuses.values()), {'non-existent'})
+            self.assertFalse(os.path.isfile(map_conf_path('eco', '00010')))
+            with open(nonexistent_path('eco')) as f:
+                self.assertEqual(len(json.load(f)), 2)
+            self.assertEqual(derive_map_confs('eco', ['00010', '00400']), {})
+
+
+class TestDerivedOrgs(TestCase):
+    def test_local_genome(self):
+        with fake_data_dir(orgs=('ko',)), TemporaryDirectory() as tmp:
+            tsv_path = f'{tmp}/genes.tsv'
+            with open(tsv_path, 'w') as f:
+                f.write('# gene\tKO\tdescription\n')
+                f.write('GENE_0001\tK00001\talcohol dehydrogenase\n')
+                f.write('GENE_0002\tko:K00002\n')
+                f.write('GENE_0002\tK00003\n')
+            kmw = KeggMapWizard(orgs=['ko', 'mygenome'], offline=True, derived_orgs={'mygenome': tsv_path})
+            map = kmw.create_map('00010', use_cache=False)
+            annotations = {key: anno for shape in map.shapes.values() for key, anno in shape.annotations.items()}
+            self.assertIn(('K', 'K00001'), annotations)
+            self.assertEqual(annotations[('mygenome', 'mygenome:GENE_0001')].description, 'alcohol dehydrogenase')
+            self.assertEqual(annotations[('mygenome', 'mygenome:GENE_0002')].description, 'K00002, K00003')
+            self.assertTrue(kmw.availability.is_complete('00010'))
+
+    def test_link_table_download(self):
+        with fake_data_dir(orgs=('ko',)), KeggStandIn() as stand_in:
+            kmw = KeggMapWizard(orgs=['ko', 'eco'], derived_orgs={'eco': None})
+            map = kmw.create_map('00010', use_cache=False)
+            self.assertEqual(stand_in.requests, ['/link/eco/ko'])
+            self.assertIn(('eco', 'eco:b0001'), {key for shape in map.shapes.values() for key in shape.annotations})
+            self.assertEqual(kmw.derive_maps(), {'00400', '01100'})
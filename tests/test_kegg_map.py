@@ -0,0 +1,236 @@
+import os
+import re
+import json
+import sys
+import gzip
+import base64
+import subprocess
+import tracemalloc
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+from kegg_fixture import fake_data_dir
+from kegg_map_wizard.KeggMapWizard import KeggMapWizard
+from kegg_map_wizard.KeggAnnotation import KeggAnnotation
+from kegg_map_wizard.KeggShape import KeggShape, shape_id
+from kegg_map_wizard.kegg_download import DescriptionCache, map_conf_path
+from kegg_map_wizard.kegg_utils import load_png, PngSidecar
+
+
+def peak_memory(func, *args, **kwargs) -> int:
+    tracemalloc.start()
+    try:
+        func(*args, **kwargs)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+class TestStreaming(TestCase):
+    def test_streamed_output_is_identical(self):
+        with fake_data_dir(), TemporaryDirectory() as tmp:
+            map = KeggMapWizard(orgs=['ko', 'rn', 'ec']).create_map('00010')
+            svg = map.svg(color_function=lambda shape: 'red')
+            self.assertEqual(''.join(map.iter_svg(color_function=lambda shape: 'red')), svg)
+
+            map.save_svg(f'{tmp}/map.svg', color_function=lambda shape: 'red')
+            with open(f'{tmp}/map.svg') as f:
+                self.assertEqual(f.read(), svg)
+
+            map.save_svgz(f'{tmp}/map.svgz', color_function=lambda shape: 'red')
+            with gzip.open(f'{tmp}/map.svgz', 'rt') as f:
+                self.assertEqual(f.read(), svg)
+
+    def test_peak_memory(self):
+        with fake_data_dir(), TemporaryDirectory() as tmp:
+            map = KeggMapWizard(orgs=['ko', 'rn', 'ec']).create_map('01100')
+            # as large as the background of a big overview map
+            PngSidecar.write(f'{tmp}/big.png.sidecar', os.urandom(15_000_000), map.width, map.height)
+            map._png_sidecar = PngSidecar(f'{tmp}/big.png.sidecar')
+            map._load_bounding_boxes()
+            document_size = len(map.svg())
+
+            self.assertGreater(peak_memory(map.svg), document_size)
+            self.assertLess(peak_memory(map.save_svg, f'{tmp}/map.svg'), document_size / 20)
+            self.assertLess(peak_memory(map.save_svgz, f'{tmp}/map.svgz'), document_size / 20)
+
+
+class TestExternalPng(TestCase):
+    def test_png_url(self):
+        with fake_data_dir(), TemporaryDirectory() as static_dir:
+            kmw = KeggMapWizard(orgs=['ko'])
+            filenames = kmw.export_pngs(static_dir)
+            self.assertEqual(sorted(filenames), ['00010', '00400', '01100'])
+            self.assertEqual(sorted(os.listdir(static_dir)), sorted(filenames.values()))
+
+            map = kmw.create_map('00400')
+            with open(f'{static_dir}/{filenames["00400"]}', 'rb') as f:
+                self.assertEqual(f.read(), base64.b64decode(load_png(map.png_path)['image']))
+
+            map = kmw.create_map('00010')  # from cache
+            svg = map.svg(png_url=map.static_png_url('/static/kegg/'))
+            self.assertIsNone(map._png_sidecar)  # image was never loaded
+            self.assertIn(f'xlink:href="/static/kegg/{filenames["00010"]}"', svg)
+            self.assertNotIn('base64', svg)
+            self.assertLess(len(svg), len(map.svg()))
+
+    def test_render_all(self):
+        with fake_data_dir(), TemporaryDirectory() as out_dir:
+            kmw = KeggMapWizard(orgs=['ko'])
+            report = kmw.render_all(out_dir, map_ids=['00010'], png_base_url='../png', workers=1)
+            with open(report[0]['path']) as f:
+                self.assertIn(f'xlink:href="../png/00010.', f.read())
+
+    def test_legacy_png_json(self):
+        with fake_data_dir():
+            kmw = KeggMapWizard(orgs=['ko'])
+            map = kmw.create_map('00400', use_cache=False)
+            expected = load_png(map.png_path)
+            os.remove(map.sidecar_path)
+            with open(map.png_path + '.json', 'w') as f:
+                json.dump(expected, f)
+
+            map = kmw.create_map('00400', use_cache=False)
+            self.assertIsNone(map.png_sidecar._mmap)  # construction only reads the header
+            self.assertEqual(map.encoded_png, expected['image'])
+            self.assertFalse(os.path.isfile(map.png_path + '.json'))
+
+
+class TestDescriptionCache(TestCase):
+    def test_shared_cache(self):
+        with fake_data_dir():
+            kmw = KeggMapWizard(orgs=['ko', 'rn', 'ec'])
+            kmw.create_map('00010', use_cache=False)
+            stats = kmw.description_cache.stats()
+            self.assertGreater(stats['misses'], 0)
+
+            kmw.create_map('00010', use_cache=False)
+            self.assertEqual(kmw.description_cache.stats(), stats)  # all annotations are in the pool
+
+            kmw.annotation_pool.clear()
+            kmw.create_map('00010', use_cache=False)
+            self.assertEqual(kmw.description_cache.misses, stats['misses'])  # everything was cached
+            self.assertEqual(kmw.description_cache.hits, stats['hits'] + stats['misses'])
+
+    def test_batched_lookup_is_identical(self):
+        with fake_data_dir():
+            kmw = KeggMapWizard(orgs=['ko', 'rn', 'ec'])
+            map = kmw.create_map('00010', use_cache=False)
+            n_annotations = 0
+            for org in kmw.orgs:
+                with open(map_conf_path(org, '00010')) as f:
+                    for line in f:
+                        raw_position, url, _ = line.rstrip().split('\t')
+                        annotations = KeggAnnotation.create_annos(
+                            kmw.cdb_readers, url=url, re_org_anno=re.compile(rf'^{org}:[0-9]+$'), org=org)
+                        shape_annotations = map.shapes[raw_position].annotations
+                        for key, anno in annotations.items():
+                            self.assertEqual(shape_annotations[key].description, anno.description)
+                            n_annotations += bool(anno.description)
+            self.assertGreater(n_annotations, 0)
+
+    def test_annotation_keys(self):
+        with fake_data_dir():
+            map = KeggMapWizard(orgs=['ec']).create_map('00010', use_cache=False)
+            keys = [key for shape in map.shapes.values() for key in shape.annotations]
+            self.assertIn(('EC', 'EC:1.1.1.1'), keys)  # with the 'EC:' prefix, like anno.name
+            for shape in map.shapes.values():
+                for key, anno in shape.annotations.items():
+                    self.assertEqual(key, (anno.anno_type, anno.name))
+
+    def test_eviction(self):
+        with fake_data_dir():
+            kmw = KeggMapWizard(orgs=['ko'])
+            cache = DescriptionCache(kmw.cdb_readers, maxsize=2)
+            keys = [('ko', f'ko:K{i:05d}') for i in range(1, 4)]
+            self.assertEqual(cache.get_many(keys + keys[:1])[keys[0]], 'gene1; enzyme number 1')
+            self.assertEqual(cache.stats(), dict(hits=0, misses=3, size=2, maxsize=2))
+            self.assertEqual(cache.get(*keys[2]), 'gene3; enzyme number 3')
+            cache.get(*keys[0])  # evicted
+            self.assertEqual((cache.hits, cache.misses), (1, 4))
+
+
+class TestCompactShapes(TestCase):
+    def test_slots(self):
+        with fake_data_dir():
+            map = KeggMapWizard(orgs=['ko', 'rn', 'ec']).create_map('00010')
+            for shape in map.shapes.values():
+                self.assertFalse(hasattr(shape, '__dict__'))
+                self.assertFalse(hasattr(shape.bbox, '__dict__'))
+                for anno in shape.annotations.values():
+                    self.assertFalse(hasattr(anno, '__dict__'))
+
+    def test_shared_annotations(self):
+        with fake_data_dir():
+            kmw = KeggMapWizard(orgs=['ko', 'rn', 'ec'])
+            kmw.create_map('00010')
+            for use_cache in [False, True]:
+                annotations = {
+                    map_id: {
+                        key: anno for shape in kmw.create_map(map_id, use_cache=use_cache).shapes.values()
+                        for key, anno in shape.annotations.items()
+                    }
+                    for map_id in ['00010', '00400']
+                }
+                shared = annotations['00010'].keys() & annotations['00400'].keys()
+                self.assertTrue(shared)
+                for key in shared:
+                    self.assertIs(annotations['00010'][key], annotations['00400'][key])
+                    self.assertIs(annotations['00010'][key], kmw.annotation_pool[key])
+
+
+RENDER_SCRIPT = '''
+import sys, hashlib
+sys.path[:0] = sys.argv[1:3]
+from kegg_map_wizard.KeggMapWizard import KeggMapWizard
+from kegg_map_wizard.ColorMaker import ColorMaker
+
+def color_function(shape):
+    shape.definition = ColorMaker.svg_gradient(colors=['yellow', 'red'], id=shape.hash, x1=shape.bbox.x1, x2=shape.bbox.x2)
+    return f'url(#{shape.hash})'
+
+map = KeggMapWizard(orgs=['ko', 'rn']).create_map('00010', use_cache=False)
+print(hashlib.sha256(map.svg(color_function=color_function).encode()).hexdigest())
+'''
+
+
+class TestShapeIds(TestCase):
+    def test_stable_across_processes(self):
+        with fake_data_dir() as data_dir:
+            root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+            digests = set()
+            for seed in ['1', '2']:
+                env = dict(os.environ, PYTHONHASHSEED=seed, KEGG_MAP_WIZARD_DATA=data_dir)
+                digests.add(subprocess.run(
+                    [sys.executable, '-c', RENDER_SCRIPT, root, os.path.join(root, 'tests')],
+                    env=env, capture_output=True, text=True, check=True
+                ).stdout)
+            self.assertEqual(len(digests), 1)
+
+    def test_ids(self):
+        with fake_data_dir():
+            maps = [KeggMapWizard(orgs=['ko']).create_map(map_id) for map_id in ['00010', '00400']]
+            ids = [{shape.hash for shape in map.shapes.values()} for map in maps]
+            for map, map_ids in zip(maps, ids):
+                self.assertEqual(len(map_ids), len(map.shapes))
+                self.assertTrue(all(re.fullmatch(r's[0-9a-f]{12}', id) for id in map_ids))
+            self.assertFalse(ids[0] & ids[1])  # maps can be embedded in the same page
+
+    def test_unset_until_added(self):
+        with fake_data_dir():
+            map = KeggMapWizard(orgs=['ko']).create_map('00010')
+            by_class = {shape.classes()[0]: shape for shape in map.shapes.values() if shape.classes()}
+            self.assertGreater(len(by_class), 1)
+            annotations = {key: anno for shape in by_class.values() for key, anno in shape.annotations.items()}
+            first = next(iter(map.shapes.values()))
+            shape = KeggShape.create_shape(first.raw_position, first.description, annotations)
+            self.assertIsNone(shape.hash)
+            self.assertEqual(shape.classes(), sorted(by_class))  # sorted, not in the order of a set
+
+    def test_collision(self):
+        with fake_data_dir():
+            map = KeggMapWizard(orgs=['ko']).create_map('00010')
+            shape = next(iter(map.shapes.values()))
+            with self.assertLogs(level='WARNING'):
+                other_id = map._unique_shape_id(shape.raw_position)  # same position: the id is taken
+            self.assertNotEqual(other_id, shape.hash)
+            self.assertEqual(other_id, shape_id(shape.raw_position, map_id=map.map_id, salt=1))
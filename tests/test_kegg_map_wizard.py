@@ -7,7 +7,10 @@ from kegg_map_wizard.KeggAnnotation import KeggAnnotation
 from kegg_map_wizard.KeggShape import KeggShape, Poly, Circle, Rect, Line
 import os
 import re
+import gzip
 import shutil
+from tempfile import TemporaryDirectory
+from kegg_fixture import fake_data_dir
 
 from random import randint
 
@@ -98,6 +101,54 @@ class TestKeggMapWizard(TestCase):
             map.save_svg(out_path=f'{out_path}/{kmw.org_string}{map_id}.svg', color_function=color_function_multigroups)
 
 
+class TestRenderAll(TestCase):
+    def test_render_all(self):
+        with fake_data_dir(), TemporaryDirectory() as out_dir:
+            kmw = KeggMapWizard(orgs=['ko', 'rn', 'ec'])
+            report = kmw.render_all(out_dir, color_function=color_function_test, workers=2)
+            self.assertEqual([r['map_id'] for r in report], ['00010', '00400', '01100'])
+            self.assertTrue(all(r['status'] == 'success' for r in report), report)
+            with open(report[0]['path']) as f:
+                self.assertEqual(f.read(), kmw.create_map('00010').svg(color_function=color_function_test))
+
+    def test_render_all_svgz(self):
+        with fake_data_dir(), TemporaryDirectory() as out_dir:
+            kmw = KeggMapWizard(orgs=['ko'])
+            report = kmw.render_all(out_dir, map_ids=['00400'], fmt='svgz', workers=1)
+            self.assertEqual(report[0]['path'], f'{out_dir}/ko00400.svgz')
+            with gzip.open(report[0]['path']) as f:
+                self.assertIn(b'kegg-svg-00400', f.read())
+
+    def test_render_all_offline(self):
+        import kegg_map_wizard.KeggMapWizard as kegg_map_wizard_module
+        with fake_data_dir(orgs=('ko',)) as data_dir, TemporaryDirectory() as out_dir:
+            tsv_path = f'{data_dir}/genes.tsv'
+            with open(tsv_path, 'w') as f:
+                f.write('GENE_0001\tK00001\talcohol dehydrogenase\n')
+            kmw = KeggMapWizard(orgs=['ko'], offline=True)
+            report = kmw.render_all(out_dir, map_ids=['00010'], workers=1)
+            self.assertEqual(report[0]['status'], 'success', report)
+            self.assertIsNone(kegg_map_wizard_module._worker_wizard)  # the wizard is passed, not stored
+
+            kmw = KeggMapWizard(orgs=['ko', 'mygenome'], offline=True, derived_orgs={'mygenome': tsv_path})
+            self.assertFalse(kmw.availability.is_complete('00010'))
+            report = kmw.render_all(out_dir, map_ids=['00010', '00400'], workers=2)  # derived here, not in the workers
+            self.assertTrue(all(r['status'] == 'success' for r in report), report)
+            with open(report[0]['path']) as f:
+                self.assertIn('mygenome:GENE_0001', f.read())
+
+    def test_render_all_error(self):
+        with fake_data_dir(), TemporaryDirectory() as out_dir:
+            kmw = KeggMapWizard(orgs=['ko'])
+            report = kmw.render_all(out_dir, map_ids=['00400'], color_function=color_function_error, workers=2)
+            self.assertEqual(report[0]['status'], 'error')
+            self.assertIn('no color', report[0]['error'])
+
+
+def color_function_error(shape: KeggShape):
+    raise ValueError('no color')
+
+
 def run_wizard(orgs: [str], color_function: Callable = None, dirname: str = None, calculate_bboxes=True):
     kmw = KeggMapWizard(orgs=orgs)
 
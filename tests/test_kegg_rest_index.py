@@ -0,0 +1,99 @@
+import os
+import pickle
+import multiprocessing
+from unittest import TestCase
+from unittest.mock import patch
+from kegg_fixture import fake_data_dir, build_cdb, open_cdb
+from kegg_map_wizard.KeggMapWizard import KeggMapWizard
+from kegg_map_wizard.kegg_download import rest_data_path, rest_index_path, get_description
+from kegg_map_wizard.kegg_rest_index import RestIndex, build_rest_index, open_rest_index, rest_list_files
+
+_index = None  # inherited by forked workers
+
+
+def _lookup(key: str) -> str:
+    return _index.get('ko', key)
+
+
+class TestRestIndex(TestCase):
+    def test_same_as_cdb(self):
+        with fake_data_dir():
+            index = open_rest_index()
+            for rest_file, path in rest_list_files().items():
+                build_cdb(path)
+                cdb_reader, reader = open_cdb(path), index.readers([rest_file])[rest_file]
+                with open(path) as f:
+                    keys = [line.split('\t')[0] for line in f]
+                for key in keys + [f'{rest_file}:missing']:
+                    self.assertEqual(get_description(reader, key), get_description(cdb_reader, key), msg=key)
+                self.assertEqual(reader.get_many(keys), {key: get_description(cdb_reader, key) for key in keys})
+
+    def test_lookups(self):
+        with fake_data_dir():
+            index = open_rest_index()
+            self.assertEqual(index.get('ko', 'ko:K00012'), 'gene12; enzyme number 12')
+            self.assertIsNone(index.get('ko', 'ko:K99999'))
+            self.assertIsNone(index.get('rn', 'ko:K00012'))  # rest files are separate namespaces
+            self.assertEqual(
+                index.get_many([('ko', 'ko:K00001'), ('compound', 'cpd:C00002'), ('ko', 'ko:K99999')]),
+                {('ko', 'ko:K00001'): 'gene1; enzyme number 1', ('compound', 'cpd:C00002'): 'compound 2; alias 2',
+                 ('ko', 'ko:K99999'): None}
+            )
+            self.assertEqual([key for key, _ in index.prefix('ko', 'ko:K0001')], [f'ko:K{i:05d}' for i in range(10, 20)])
+            self.assertEqual(len(list(index.prefix('ec'))), 0)  # empty list
+            self.assertEqual(len(list(index.prefix('path'))), 3)
+
+    def test_search(self):
+        with fake_data_dir():
+            index = open_rest_index()
+            self.assertEqual(index.search('Enzyme number 12!'), [('ko', 'ko:K00012', 'gene12; enzyme number 12')])
+            self.assertEqual(len(index.search('gene1')), 22)  # prefix: gene1, gene10, ..., gene19 of ko and eco
+            self.assertEqual(len(index.search('gene1', rest_files=['ko'])), 11)
+            self.assertEqual(len(index.search('gene1', limit=5)), 5)
+            self.assertEqual(index.search('glycolysis'), [('path', 'path:map00010', 'Glycolysis / Gluconeogenesis')])
+            self.assertEqual(index.search('glycolysis unknownword'), [])
+            self.assertEqual(index.search('!'), [])
+
+            kmw = KeggMapWizard(orgs=['ko'], offline=True)
+            self.assertEqual([key for _, key, _ in kmw.search('protein')], [])  # eco is not in orgs
+            self.assertEqual([key for _, key, _ in kmw.search('gluco')], ['path:map00010'])
+
+    def test_sorted_runs(self):
+        with fake_data_dir():
+            with open(rest_data_path('ko'), 'a') as f:
+                f.write('ko:K00001\tduplicate key; enzyme\n')  # only the first is found
+            build_rest_index()
+            with open(rest_index_path(), 'rb') as f:
+                one_run = f.read()
+            with patch('kegg_map_wizard.kegg_rest_index.RUN_SIZE', 7):  # sort and merge many runs on disk
+                build_rest_index()
+            with open(rest_index_path(), 'rb') as f:
+                self.assertEqual(f.read(), one_run)
+            leftovers = [name for name in os.listdir(os.path.dirname(rest_index_path())) if 'tmp' in name]
+            self.assertEqual(leftovers, [])  # the runs are removed
+            self.assertEqual(RestIndex().get('ko', 'ko:K00001'), 'gene1; enzyme number 1')
+
+    def test_rebuild(self):
+        with fake_data_dir():
+            index = open_rest_index()
+            self.assertIs(type(index), RestIndex)
+            self.assertTrue(index.is_current())
+            mtime = os.stat(rest_index_path()).st_mtime_ns
+            open_rest_index()
+            self.assertEqual(os.stat(rest_index_path()).st_mtime_ns, mtime)  # not rebuilt
+
+            with open(rest_data_path('ko'), 'a') as f:
+                f.write('ko:K99999\tnew gene; hexokinase\n')
+            self.assertFalse(index.is_current())
+            self.assertIsNone(index.get('ko', 'ko:K99999'))  # the open index is not affected
+            self.assertEqual(open_rest_index().get('ko', 'ko:K99999'), 'new gene; hexokinase')
+
+    def test_share(self):
+        global _index
+        with fake_data_dir():
+            _index = open_rest_index()
+            self.assertEqual(pickle.loads(pickle.dumps(_index)).get('ko', 'ko:K00003'), 'gene3; enzyme number 3')
+            with multiprocessing.get_context('fork').Pool(2) as pool:
+                self.assertEqual(pool.map(_lookup, ['ko:K00001', 'ko:K00002']),
+                                 ['gene1; enzyme number 1', 'gene2; enzyme number 2'])
+            _index = None
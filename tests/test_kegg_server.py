@@ -0,0 +1,160 @@
+import os
+import gzip
+import json
+import asyncio
+from urllib.parse import quote
+from unittest import TestCase
+from kegg_fixture import fake_data_dir
+from kegg_map_wizard.KeggMapWizard import KeggMapWizard
+from kegg_map_wizard.kegg_download import map_conf_path
+from kegg_map_wizard.kegg_server import MapServer, CompiledMap, CompiledMapCache
+
+BINARY = dict(mode='binary', annotations=['K00001', 'K00002', 'K00003'], color='red')
+
+
+async def fetch(port: int, target: str, method: str = 'GET', headers: {str: str} = None, body: bytes = b'') -> (int, dict, bytes):
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    head = f'{method} {target} HTTP/1.1\r\nHost: localhost\r\nConnection: close\r\nContent-Length: {len(body)}\r\n'
+    head += ''.join(f'{name}: {value}\r\n' for name, value in (headers or {}).items())
+    writer.write(f'{head}\r\n'.encode('latin-1') + body)
+    response = await reader.read()
+    writer.close()
+    head, _, body = response.partition(b'\r\n\r\n')
+    status_line, *header_lines = head.decode('latin-1').split('\r\n')
+    return int(status_line.split(' ')[1]), dict(line.split(': ', 1) for line in header_lines), body
+
+
+def run(scenario, workers: int, org_strings=('ko+rn+ec', 'eco'), **kwargs):
+    async def main():
+        server = MapServer(list(org_strings), workers=workers, **kwargs)
+        _, port = await server.start(port=0)
+        try:
+            return await scenario(server, port)
+        finally:
+            await server.close()
+
+    return asyncio.run(main())
+
+
+class TestCompiledMapCache(TestCase):
+    def test_budget(self):
+        cache = CompiledMapCache(max_bytes=100)
+        sources = dict(version=1)
+        for map_id in ['00010', '00020', '00030']:
+            cache.put(('ko', map_id), CompiledMap(map=None, skeleton=None, sources=sources, nbytes=40))
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(cache.nbytes, 80)
+        self.assertIsNone(cache.get(('ko', '00010'), sources))  # evicted
+        self.assertIsNotNone(cache.get(('ko', '00020'), sources))
+        cache.put(('ko', '00040'), CompiledMap(map=None, skeleton=None, sources=sources, nbytes=40))
+        self.assertNotIn(('ko', '00030'), cache)  # least recently used
+        self.assertIn(('ko', '00020'), cache)
+
+        self.assertIsNone(cache.get(('ko', '00020'), dict(version=2)))  # outdated
+        cache.put(('ko', '00050'), CompiledMap(map=None, skeleton=None, sources=sources, nbytes=500))
+        self.assertEqual(len(cache), 1)  # too large, but kept
+        self.assertEqual((cache.hits, cache.misses, cache.evictions), (1, 2, 4))
+
+
+class TestMapServer(TestCase):
+    def test_render(self):
+        async def scenario(server, port):
+            kegg_map = KeggMapWizard(orgs=['ko', 'rn', 'ec'], offline=True).create_map('00010')
+            skeleton = kegg_map.compile()
+
+            status, headers, body = await fetch(port, '/map/ko+rn+ec/00010.svg')
+            self.assertEqual(status, 200)
+            self.assertEqual(headers['Content-Type'], 'image/svg+xml')
+            self.assertEqual(body, skeleton.render({}))
+            etag = headers['ETag']
+
+            status, headers, body = await fetch(port, '/map/ko+rn+ec/00010.svg', headers={'If-None-Match': etag})
+            self.assertEqual((status, headers['ETag'], body), (304, etag, b''))
+
+            status, headers, body = await fetch(port, '/map/ko+rn+ec/00010.svgz')
+            self.assertEqual((status, headers['Content-Encoding']), (200, 'gzip'))
+            self.assertNotEqual(headers['ETag'], etag)
+            self.assertEqual(gzip.decompress(body), skeleton.render({}))
+
+            colored = skeleton.render(*kegg_map.color_binary(BINARY['annotations'], color='red'))
+            status, headers, body = await fetch(port, f'/map/ko+rn+ec/00010.svg?coloring={quote(json.dumps(BINARY))}')
+            self.assertEqual((status, body), (200, colored))
+            status, post_headers, body = await fetch(port, '/map/ko+rn+ec/00010.svg', method='POST', body=json.dumps(BINARY).encode())
+            self.assertEqual((status, body, post_headers['ETag']), (200, colored, headers['ETag']))
+
+            status, headers, body = await fetch(port, '/map/ko+rn+ec/00010.svg', method='HEAD')
+            self.assertEqual((status, int(headers['Content-Length']), body), (200, len(skeleton.render({})), b''))
+            self.assertEqual(server.n_not_modified, 1)
+
+        with fake_data_dir():
+            run(scenario, workers=0)
+
+    def test_errors(self):
+        async def scenario(server, port):
+            for target, method, body, expected in [
+                ('/map/ko/00010.svg', 'GET', b'', 404),  # org string is not served
+                ('/map/eco/99999.svg', 'GET', b'', 404),
+                ('/map/eco/00010.png', 'GET', b'', 404),
+                ('/maps', 'GET', b'', 404),
+                ('/map/eco/00010.svg', 'PUT', b'', 405),
+                ('/map/eco/00010.svg?coloring={', 'GET', b'', 400),
+                ('/map/eco/00010.svg', 'POST', b'{"mode": "rainbow"}', 400),
+                ('/map/eco/00010.svg', 'POST', b'{"mode": "binary", "annotation": ["K00001"]}', 400),
+            ]:
+                status, headers, _ = await fetch(port, target, method=method, body=body)
+                self.assertEqual(status, expected, msg=f'{method} {target} {body}')
+
+            status, _, _ = await fetch(port, '/map/eco/99999.svg', headers={'If-None-Match': '*'})
+            self.assertEqual((status, server.n_not_modified), (404, 0))  # no ETag for maps that do not exist
+            n_rendered = server.n_rendered
+            status, _, _ = await fetch(port, '/map/eco/00010.svg', headers={'If-None-Match': '*'})
+            self.assertEqual((status, server.n_not_modified, server.n_rendered), (304, 1, n_rendered))
+
+            # the client announces a longer body than it sends and stops writing
+            reader, writer = await asyncio.open_connection('127.0.0.1', port)
+            writer.write(b'POST /map/eco/00010.svg HTTP/1.1\r\nHost: localhost\r\nContent-Length: 100\r\n\r\n{}')
+            writer.write_eof()
+            response = await reader.read()
+            writer.close()
+            self.assertTrue(response.startswith(b'HTTP/1.1 400 '), msg=response)
+            self.assertIn(b'Incomplete request body', response)
+            status, _, _ = await fetch(port, '/map/eco/00010.svg')
+            self.assertEqual(status, 200)
+
+        with fake_data_dir():
+            run(scenario, workers=0)
+
+    def test_sources_ttl(self):
+        async def scenario(server, port):
+            _, headers, _ = await fetch(port, '/map/eco/00010.svg')
+            path = map_conf_path('eco', '00010')
+            stat = os.stat(path)
+            os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))  # the map changed
+            status, _, _ = await fetch(port, '/map/eco/00010.svg', headers={'If-None-Match': headers['ETag']})
+            self.assertEqual(status, 304)  # the sources are reused
+            await asyncio.sleep(server.sources_ttl)
+            status, new_headers, _ = await fetch(port, '/map/eco/00010.svg', headers={'If-None-Match': headers['ETag']})
+            self.assertEqual(status, 200)
+            self.assertNotEqual(new_headers['ETag'], headers['ETag'])
+
+        with fake_data_dir():
+            run(scenario, workers=0, sources_ttl=0.5)
+
+    def test_workers(self):
+        async def scenario(server, port):
+            targets = [f'/map/{org_string}/{map_id}.svg' for org_string in ['ko+rn+ec', 'eco'] for map_id in ['00010', '00400']]
+            responses = await asyncio.gather(*(fetch(port, target) for target in targets * 3))
+            self.assertEqual({status for status, _, _ in responses}, {200})
+            for i, (_, headers, body) in enumerate(responses[len(targets):]):
+                self.assertEqual(body, responses[i % len(targets)][2])  # same map, same response
+
+            _, headers, _ = await fetch(port, targets[0])
+            path = map_conf_path('ko', '00010')
+            stat = os.stat(path)
+            os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))  # the map changed
+            status, new_headers, _ = await fetch(port, targets[0], headers={'If-None-Match': headers['ETag']})
+            self.assertEqual(status, 200)
+            self.assertNotEqual(new_headers['ETag'], headers['ETag'])
+
+        with fake_data_dir():
+            run(scenario, workers=2, sources_ttl=0)
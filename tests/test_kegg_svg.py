@@ -0,0 +1,110 @@
+from unittest import TestCase
+from kegg_fixture import fake_data_dir
+from kegg_map_wizard.KeggMapWizard import KeggMapWizard
+from kegg_map_wizard.KeggShape import KeggShape, Poly, Circle, Rect, Line
+from kegg_map_wizard.ColorMaker import ColorMaker
+from kegg_map_wizard.kegg_utils import MAP_TEMPLATE
+from kegg_map_wizard.kegg_svg import iter_map_svg, shape_fragments, SvgSkeleton
+
+type_to_color = {
+    Poly: 'red',
+    Circle: 'yellow',
+    Rect: 'green',
+    Line: 'blue'
+}
+
+
+def color_function_gradient(shape: KeggShape):
+    if type(shape) is Line:
+        return 'black'
+    shape.definition = ColorMaker.svg_gradient(colors=['yellow', 'red'], id=shape.hash, x1=shape.bbox.x1, x2=shape.bbox.x2)
+    return f'url(#{shape.hash})'
+
+
+class TestGolden(TestCase):
+    """
+    The serializer must produce the same bytes as the templates.
+    """
+
+    def assert_identical(self, map, color_function, png_url=None):
+        expected = ''.join(MAP_TEMPLATE.generate(map=map, color_function=color_function, png_url=png_url))
+        self.assertEqual(''.join(iter_map_svg(map, color_function=color_function, png_url=png_url)), expected)
+
+    def test_maps(self):
+        with fake_data_dir():
+            kmw = KeggMapWizard(orgs=['ko', 'rn', 'ec', 'eco'])
+            for map_id in ['00010', '00400', '01100']:
+                map = kmw.create_map(map_id)
+                self.assert_identical(map, lambda shape: type_to_color[type(shape)])
+                self.assert_identical(map, color_function_gradient)
+                self.assert_identical(map, lambda shape: None, png_url='/static/kegg/a&b "c".png')
+
+    def test_without_bboxes(self):
+        with fake_data_dir():
+            map = KeggMapWizard(orgs=['ko']).create_map('00010', use_cache=False)
+            for shape in map.shapes.values():
+                shape.bbox = None
+            self.assert_identical(map, lambda shape: 'red')
+
+    def test_special_characters(self):
+        with fake_data_dir():
+            map = KeggMapWizard(orgs=['ko']).create_map('00400')
+            map.title = 'Phenylalanine, {tyrosine} & "tryptophan"'
+            for shape in map.shapes.values():
+                shape.description = 'a {b} <c> & "d"'
+            self.assert_identical(map, lambda shape: '{}')
+
+    def test_empty_map(self):
+        with fake_data_dir():
+            map = KeggMapWizard(orgs=['ko']).create_map('00010')
+            map.shapes = {}
+            self.assert_identical(map, lambda shape: 'red')
+
+    def test_shape_fragments(self):
+        with fake_data_dir():
+            map = KeggMapWizard(orgs=['ko', 'rn']).create_map('00010')
+            for shape in map.shapes.values():
+                head, tail = shape_fragments(shape)
+                self.assertEqual(head + 'red' + tail, shape.svg(lambda s: 'red'))
+
+
+class TestSkeleton(TestCase):
+    def test_render(self):
+        with fake_data_dir():
+            map = KeggMapWizard(orgs=['ko', 'rn', 'ec']).create_map('01100')
+            skeleton = map.compile()
+
+            self.assertEqual(skeleton.render({}), map.svg().encode())
+
+            color_function = lambda shape: type_to_color[type(shape)]
+            fills = {shape.hash: color_function(shape) for shape in map.shapes.values()}
+            self.assertEqual(skeleton.render(fills), map.svg(color_function).encode())
+            self.assertEqual(b''.join(skeleton.iter_render(fills)), skeleton.render(fills))
+
+            expected = map.svg(color_function_gradient).encode()
+            self.assertEqual(skeleton.render_function(map, color_function_gradient), expected)
+            defs = {shape.hash: getattr(shape, 'definition', None) for shape in map.shapes.values()}
+            fills = {shape.hash: color_function_gradient(shape) for shape in map.shapes.values()}
+            self.assertEqual(skeleton.render(fills, defs=defs), expected)
+
+    def test_png_url(self):
+        with fake_data_dir():
+            map = KeggMapWizard(orgs=['ko']).create_map('00010')
+            skeleton = map.compile(png_url='/static/00010.png', default_fill='red')
+            self.assertEqual(skeleton.render({}), map.svg(lambda shape: 'red', png_url='/static/00010.png').encode())
+
+    def test_serializable(self):
+        with fake_data_dir() as data_dir:
+            map = KeggMapWizard(orgs=['ko', 'rn']).create_map('00400')
+            skeleton = map.compile()
+            skeleton.save(f'{data_dir}/00400.skeleton')
+            loaded = SvgSkeleton.load(f'{data_dir}/00400.skeleton')
+            self.assertEqual(loaded.shape_ids, skeleton.shape_ids)
+            fills = {shape_id: 'blue' for shape_id in skeleton.shape_ids[::2]}
+            self.assertEqual(loaded.render(fills), skeleton.render(fills))
+
+    def test_immutable(self):
+        with fake_data_dir():
+            skeleton = KeggMapWizard(orgs=['ko']).create_map('00010').compile()
+            with self.assertRaises(AttributeError):
+                skeleton.default_fill = 'red'